@@ -0,0 +1,63 @@
+"""
+Encoding and decoding messages with raft.adapters.codec, against pickle
+(which the network used to use): a heartbeat, and an AppendEntries of
+1000 entries, without and with client sessions.  Decoding is from a
+memoryview, as it would be from a receive buffer.
+
+    PYTHONPATH=src python benchmarks/bench_codec.py
+"""
+import pickle
+import timeit
+from typing import Callable, List, Tuple
+
+from raft.adapters import codec
+from raft.log import Entry, Session
+from raft.messages import AppendEntries, Message
+
+REPEATS = 5
+
+
+def append_entries(entries: List[Entry]) -> Message:
+    return Message(frm='S1', to='S2', cmd=AppendEntries(
+        term=7, leaderId='S1', prevLogIndex=123_456, prevLogTerm=7, entries=entries,
+        leaderCommit=123_400, seq=42,
+    ))
+
+
+MESSAGES = [
+    ('heartbeat', append_entries([])),
+    ('1000 entries', append_entries([Entry(term=7, cmd=f'key{i}=value{i}') for i in range(1000)])),
+    ('1000 w/ sessions', append_entries([
+        Entry(term=7, cmd=f'key{i}=value{i}', session=Session(clientId=f'client{i % 10}', seq=i, timestamp=1e9))
+        for i in range(1000)
+    ])),
+]
+CODECS = [
+    ('pickle', pickle.dumps, pickle.loads),
+    ('codec', codec.encode, codec.decode),
+]  # type: List[Tuple[str, Callable, Callable]]
+
+
+def best_of(fn: Callable[[], object], number: int) -> float:
+    """seconds per call"""
+    return min(timeit.repeat(fn, number=number, repeat=REPEATS)) / number
+
+
+def main() -> None:
+    print(f'{"message":>16} {"codec":>7} {"bytes":>8} {"encode us":>10} {"decode us":>10}')
+    for name, msg in MESSAGES:
+        number = 20_000 if not msg.cmd.entries else 100
+        for codec_name, encode, decode in CODECS:
+            data = encode(msg)
+            view = memoryview(bytearray(data))
+            assert decode(view) == msg
+            encode_time = best_of(lambda: encode(msg), number)  # pylint: disable=cell-var-from-loop
+            decode_time = best_of(lambda: decode(view), number)  # pylint: disable=cell-var-from-loop
+            print(
+                f'{name:>16} {codec_name:>7} {len(data):>8} '
+                f'{encode_time * 1e6:>10.1f} {decode_time * 1e6:>10.1f}'
+            )
+
+
+if __name__ == '__main__':
+    main()
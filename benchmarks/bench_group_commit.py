@@ -0,0 +1,43 @@
+"""
+Write throughput of PersistentLog with one sync() (and so one write and
+fsync) per entry, versus one per batch of entries, as happens when several
+appends land in the same clock tick.
+
+    PYTHONPATH=src python benchmarks/bench_group_commit.py
+"""
+import tempfile
+import time
+from pathlib import Path
+
+from raft.adapters.persistent_log import PersistentLog
+from raft.log import Entry
+
+ENTRIES = 2_000
+
+
+def writes_per_second(path: Path, durability: str, batch_size: int) -> float:
+    log = PersistentLog(path, durability=durability)
+    start = time.perf_counter()
+    for i in range(ENTRIES):
+        log.add_entry(Entry(term=1, cmd=f'key{i}=value{i}'), i, log.entry_term(i), 0)
+        if (i + 1) % batch_size == 0:
+            log.sync(now=time.perf_counter())
+    log.sync(now=time.perf_counter())
+    elapsed = time.perf_counter() - start
+    log.close()
+    path.unlink()
+    return ENTRIES / elapsed
+
+
+def main() -> None:
+    print(f'{"durability":>14} {"batch size":>11} {"writes/s":>12}')
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = Path(tmpdir) / 'bench.log'
+        for durability in ['per-batch', 'interval=10ms', 'none']:
+            for batch_size in [1, 10, 100, 1000]:
+                rate = writes_per_second(path, durability, batch_size)
+                print(f'{durability:>14} {batch_size:>11} {rate:>12,.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Raft messages per second between the servers of a five server cluster on a
+fake network, idle and under a steady trickle of client commands, with and
+without quiesce.  Followers that have just been sent entries aren't sent a
+heartbeat as well, and a quiet leader only heartbeats every
+QUIESCENT_HEARTBEAT_INTERVAL until there's work to do.  Rates are in
+simulated time.
+
+    PYTHONPATH=src python benchmarks/bench_idle_heartbeats.py
+"""
+import contextlib
+import io
+from collections import defaultdict, deque
+from typing import Deque, Dict, List
+
+from raft.adapters.run_server import clock_tick
+from raft.log import InMemoryLog
+from raft.messages import ClientSetCommand, Message
+from raft.server import Follower, Leader
+
+SECONDS = 10
+TICK = 0.001
+PEERS = ["S1", "S2", "S3", "S4", "S5"]
+
+
+class CountingNetwork:
+    def __init__(self) -> None:
+        self._queues = defaultdict(deque)  # type: Dict[str, Deque[Message]]
+        self.raft_messages = 0
+
+    def get_messages(self, to: str) -> List[Message]:
+        queue = self._queues[to]
+        messages = list(queue)
+        queue.clear()
+        return messages
+
+    def dispatch(self, msg: Message) -> None:
+        if msg.to in PEERS:
+            self._queues[msg.to].append(msg)
+            if msg.frm in PEERS:
+                self.raft_messages += 1
+
+
+def messages_per_second(commands_per_second: int, quiesce: bool) -> float:
+    servers = [
+        Leader(
+            name="S1", now=0, log=InMemoryLog([]), peers=PEERS, currentTerm=1, votedFor=None,
+            quiesce=quiesce,
+        )
+    ] + [
+        Follower(
+            name=n, peers=PEERS, now=0, log=InMemoryLog([]), currentTerm=1, votedFor=None,
+            quiesce=quiesce,
+        )
+        for n in PEERS[1:]
+    ]
+    raftnet = CountingNetwork()
+    ticks = int(SECONDS / TICK)
+    every = ticks // (SECONDS * commands_per_second) if commands_per_second else 0
+    with contextlib.redirect_stdout(io.StringIO()):  # servers are chatty
+        for tick in range(1, ticks + 1):
+            if every and tick % every == 0:
+                raftnet.dispatch(Message(
+                    frm="client", to="S1", cmd=ClientSetCommand(guid=str(tick), cmd=f"foo={tick}"),
+                ))
+            for server in servers:
+                clock_tick(server, raftnet, tick * TICK)
+    return raftnet.raft_messages / SECONDS
+
+
+def main() -> None:
+    print(f'{"commands/s":>10} {"quiesce":>8} {"messages/s":>11}')
+    for commands_per_second in [0, 1, 10, 100]:
+        for quiesce in [False, True]:
+            rate = messages_per_second(commands_per_second, quiesce)
+            print(f'{commands_per_second:>10} {str(quiesce):>8} {rate:>11.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,28 @@
+"""
+Time to append 1M entries to an InMemoryLog one at a time, the way the
+leader does for client commands.  Appends should be amortized O(1), so the
+time per append should not grow with the size of the log.
+
+    PYTHONPATH=src python benchmarks/bench_inmemory_log.py [entries]
+"""
+import sys
+import time
+
+from raft.log import Entry, InMemoryLog
+
+
+def main(total: int) -> None:
+    log = InMemoryLog([])
+    checkpoint = total // 10
+    print(f'{"log size":>12} {"us/append":>12}')
+    start = time.perf_counter()
+    for i in range(total):
+        log.add_entry(Entry(term=1, cmd=f'key{i}=value{i}'), i, log.last_log_term, 0)
+        if (i + 1) % checkpoint == 0:
+            now = time.perf_counter()
+            print(f'{i + 1:>12,} {(now - start) / checkpoint * 1e6:>12.2f}')
+            start = now
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
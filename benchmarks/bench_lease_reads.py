@@ -0,0 +1,81 @@
+"""
+Read latency in a three server cluster on a fake network with a fixed
+one-way delay, with quorum-confirmed (ReadIndex) reads against lease reads.
+ReadIndex reads wait for a round of heartbeats, so take at least one round
+trip; while its lease lasts, a leader answers reads straight away.
+Latencies are in simulated time.
+
+    PYTHONPATH=src python benchmarks/bench_lease_reads.py
+"""
+import contextlib
+import io
+from typing import Iterator, List, Tuple
+
+from raft.adapters.run_server import clock_tick
+from raft.log import InMemoryLog
+from raft.messages import ClientGetCommand, ClientSetCommand, Message
+from raft.server import Follower, Leader
+
+TICKS = 2000
+TICK = 0.001
+DELAY = 0.005
+READS_PER_TICK = 10
+PEERS = ["S1", "S2", "S3"]
+
+
+class DelayingNetwork:
+    def __init__(self) -> None:
+        self.now = 0.0
+        # the delay is fixed, so these arrive in the order they were sent
+        self._in_flight = []  # type: List[Tuple[float, Message]]
+
+    def get_messages(self, to: str) -> List[Message]:
+        arrived = [m for t, m in self._in_flight if t <= self.now and m.to == to]
+        self._in_flight = [(t, m) for t, m in self._in_flight if t > self.now or m.to != to]
+        return arrived
+
+    def dispatch(self, msg: Message) -> None:
+        if msg.to in PEERS:
+            self._in_flight.append((self.now + DELAY, msg))
+
+
+def read_latencies(lease_reads: bool) -> Iterator[float]:
+    servers = [
+        Leader(
+            name="S1", now=1, log=InMemoryLog([]), peers=PEERS, currentTerm=1, votedFor=None,
+            lease_reads=lease_reads,
+        )
+    ] + [
+        Follower(
+            name=n, peers=PEERS, now=1, log=InMemoryLog([]), currentTerm=1, votedFor=None,
+            lease_reads=lease_reads,
+        )
+        for n in PEERS[1:]
+    ]
+    leader = servers[0]
+    raftnet = DelayingNetwork()
+    raftnet.dispatch(Message(frm="client", to="S1", cmd=ClientSetCommand(guid="w", cmd="foo=1")))
+    with contextlib.redirect_stdout(io.StringIO()):  # servers are chatty
+        for tick in range(TICKS):
+            raftnet.now = now = 1 + tick * TICK
+            for i in range(READS_PER_TICK):
+                raftnet.dispatch(Message(
+                    frm="client", to="S1", cmd=ClientGetCommand(guid=f"{tick}.{i}", key="foo"),
+                ))
+            for server in servers:
+                clock_tick(server, raftnet, now)
+    histogram = leader.read_latency
+    for p in [50, 99, 99.9]:
+        yield histogram.percentile(p)
+
+
+def main() -> None:
+    print(f"one-way network delay {DELAY * 1000:.1f}ms, {READS_PER_TICK} reads per {TICK * 1000:.1f}ms tick")
+    print(f'{"mode":>10} {"p50 ms":>8} {"p99 ms":>8} {"p99.9 ms":>9}')
+    for name, lease_reads in [("readindex", False), ("lease", True)]:
+        p50, p99, p999 = (t * 1000 for t in read_latencies(lease_reads))
+        print(f'{name:>10} {p50:>8.2f} {p99:>8.2f} {p999:>9.2f}')
+
+
+if __name__ == '__main__':
+    main()
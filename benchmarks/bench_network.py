@@ -0,0 +1,77 @@
+"""
+Heartbeat-sized messages per second from one server to another over
+localhost, through the thread-per-connection TCPRaftNet and the
+single-event-loop AsyncRaftNet.  Wall clock time, including encoding.
+
+    PYTHONPATH=src python benchmarks/bench_network.py
+"""
+import asyncio
+import contextlib
+import io
+import time
+
+from raft.adapters.network import AsyncRaftNet, TCPRaftNet
+from raft.messages import AppendEntries, Message
+
+MESSAGES = 20_000
+ASYNC_SERVERS = {
+    'S1': ('localhost', 16201),
+    'S2': ('localhost', 16202),
+}
+
+
+def heartbeat(i: int) -> Message:
+    return Message(frm='S1', to='S2', cmd=AppendEntries(
+        term=1, leaderId='S1', prevLogIndex=i, prevLogTerm=1, entries=[], leaderCommit=i, seq=i,
+    ))
+
+
+def threaded() -> float:
+    s1net, s2net = TCPRaftNet('S1'), TCPRaftNet('S2')
+    s1net.start()
+    s2net.start()
+    time.sleep(0.2)  # for the listeners to come up
+    start = time.perf_counter()
+    for i in range(MESSAGES):
+        s1net.dispatch(heartbeat(i))
+    received = 0
+    while received < MESSAGES:
+        received += len(s2net.get_messages('S2'))
+    return MESSAGES / (time.perf_counter() - start)
+
+
+async def single_loop() -> float:
+    s1net, s2net = AsyncRaftNet('S1', ASYNC_SERVERS), AsyncRaftNet('S2', ASYNC_SERVERS)
+    await s1net.start()
+    await s2net.start()
+    # connect first: anything over max_queued dispatched while that's
+    # happening is dropped, and we'd wait for it forever
+    s1net.dispatch(heartbeat(0))
+    while not s2net.get_messages('S2'):
+        await s2net.wait_for_messages(timeout=1)
+    start = time.perf_counter()
+    received = 0
+    for i in range(MESSAGES):
+        s1net.dispatch(heartbeat(i))
+        if i % 100 == 99:
+            await asyncio.sleep(0)  # as a server would, between ticks
+            received += len(s2net.get_messages('S2'))
+    while received < MESSAGES:
+        await s2net.arrived.wait()
+        received += len(s2net.get_messages('S2'))
+    elapsed = time.perf_counter() - start
+    await s1net.close()
+    await s2net.close()
+    return MESSAGES / elapsed
+
+
+def main() -> None:
+    with contextlib.redirect_stdout(io.StringIO()):  # the networks are chatty
+        rates = [("threads", threaded()), ("asyncio", asyncio.run(single_loop()))]
+    print(f'{"network":>8} {"msgs/s":>10}')
+    for name, rate in rates:
+        print(f'{name:>8} {rate:>10.0f}')
+
+
+if __name__ == '__main__':
+    main()
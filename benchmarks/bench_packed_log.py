@@ -0,0 +1,60 @@
+"""
+Memory per entry and lookup cost for InMemoryLog, which keeps an Entry object
+per entry, versus PackedLog, which packs terms and cmds into arrays.
+
+    PYTHONPATH=src python benchmarks/bench_packed_log.py [sizes...]
+
+The default sizes are 1M and 10M entries; 10M InMemoryLog entries take a
+couple of gigabytes.  Each run happens in a fresh process, and memory is
+the growth in its peak RSS while building the log.
+"""
+import random
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from raft.log import Entry, InMemoryLog, PackedLog
+
+LOOKUPS = 100_000
+
+
+def build(log_class, size: int):
+    log = log_class([])
+    for i in range(size):
+        log.add_entry(Entry(term=1 + i // 1000, cmd=f'key{i}=value{i}'), i, log.last_log_term, 0)
+    return log
+
+
+def peak_rss() -> int:
+    # kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def ns_per_lookup(log, lookup, size: int) -> float:
+    indexes = [random.randint(1, size) for _ in range(LOOKUPS)]
+    start = time.perf_counter()
+    for index in indexes:
+        lookup(log, index)
+    return (time.perf_counter() - start) / LOOKUPS * 1e9
+
+
+def run(log_class, size: int) -> str:
+    before = peak_rss()
+    log = build(log_class, size)
+    memory = (peak_rss() - before) / size
+    term = ns_per_lookup(log, log_class.entry_term, size)
+    entry = ns_per_lookup(log, log_class.entry_at, size)
+    return f'{log_class.__name__:>12} {size:>12,} {memory:>12.0f} {term:>14.0f} {entry:>12.0f}'
+
+
+def main(sizes) -> None:
+    print(f'{"log":>12} {"entries":>12} {"bytes/entry":>12} {"entry_term ns":>14} {"entry_at ns":>12}')
+    for size in sizes:
+        for log_class in [InMemoryLog, PackedLog]:
+            with ProcessPoolExecutor(max_workers=1) as pool:
+                print(pool.submit(run, log_class, size).result())
+
+
+if __name__ == '__main__':
+    main([int(s) for s in sys.argv[1:]] or [1_000_000, 10_000_000])
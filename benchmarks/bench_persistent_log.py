@@ -0,0 +1,44 @@
+"""
+Append cost for PersistentLog as the log grows.  Each append should cost
+about the same whether the log holds a thousand entries or a million.
+Every append is synced on its own, without fsync, to time the write itself.
+
+    PYTHONPATH=src python benchmarks/bench_persistent_log.py
+"""
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from raft.adapters.persistent_log import PersistentLog
+from raft.log import Entry
+
+SAMPLE = 1_000
+
+
+def fill_to(log: PersistentLog, size: int) -> None:
+    while log.lastLogIndex < size:
+        i = log.lastLogIndex
+        log.add_entry(Entry(term=1, cmd=f'key{i}=value{i}'), i, log.entry_term(i), 0)
+        log.sync(now=0)
+
+
+def time_appends(log: PersistentLog, count: int) -> float:
+    start = time.perf_counter()
+    fill_to(log, log.lastLogIndex + count)
+    return (time.perf_counter() - start) / count
+
+
+def main(sizes) -> None:
+    with tempfile.TemporaryDirectory() as tmpdir:
+        log = PersistentLog(Path(tmpdir) / 'bench.log', durability='none')
+        print(f'{"log size":>12} {"us/append":>12}')
+        for size in sizes:
+            fill_to(log, size)
+            per_append = time_appends(log, SAMPLE)
+            print(f'{size:>12,} {per_append * 1e6:>12.1f}')
+        log.close()
+
+
+if __name__ == '__main__':
+    main([int(s) for s in sys.argv[1:]] or [1_000, 10_000, 100_000, 1_000_000])
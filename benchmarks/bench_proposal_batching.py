@@ -0,0 +1,78 @@
+"""
+Raft messages sent per committed client command, in a three server cluster
+on a fake network, as the number of client commands per tick goes up.
+Proposals made in the same tick share AppendEntries, so the cost per
+command should fall with load.  batch_size=1 appends and replicates each
+command as it arrives, for comparison.
+
+    PYTHONPATH=src python benchmarks/bench_proposal_batching.py
+"""
+import contextlib
+import io
+from collections import defaultdict, deque
+from typing import Deque, Dict, List
+
+from raft.adapters.run_server import clock_tick
+from raft.log import InMemoryLog
+from raft.messages import ClientSetCommand, Message
+from raft.server import Follower, Leader
+
+TICKS = 200
+TICK = 0.005
+PEERS = ["S1", "S2", "S3"]
+
+
+class CountingNetwork:
+    def __init__(self) -> None:
+        self._queues = defaultdict(deque)  # type: Dict[str, Deque[Message]]
+        self.raft_messages = 0
+
+    def get_messages(self, to: str) -> List[Message]:
+        queue = self._queues[to]
+        messages = list(queue)
+        queue.clear()
+        return messages
+
+    def dispatch(self, msg: Message) -> None:
+        if msg.to in PEERS:
+            self._queues[msg.to].append(msg)
+            if msg.frm in PEERS:
+                self.raft_messages += 1
+
+
+def messages_per_command(commands_per_tick: int, batch_size: int) -> float:
+    leader = Leader(
+        name="S1", now=1, log=InMemoryLog([]), peers=PEERS, currentTerm=1, votedFor=None,
+        batch_size=batch_size,
+    )
+    followers = [
+        Follower(name=n, peers=PEERS, now=1, log=InMemoryLog([]), currentTerm=1, votedFor=None)
+        for n in PEERS[1:]
+    ]
+    raftnet = CountingNetwork()
+    with contextlib.redirect_stdout(io.StringIO()):  # servers are chatty
+        run(leader, followers, raftnet, commands_per_tick)
+    return raftnet.raft_messages / max(leader.commitIndex, 1)
+
+
+def run(leader: Leader, followers: List[Follower], raftnet: CountingNetwork, commands_per_tick: int) -> None:
+    for tick in range(TICKS):
+        now = 1 + tick * TICK
+        for i in range(commands_per_tick):
+            raftnet.dispatch(Message(
+                frm="client", to="S1", cmd=ClientSetCommand(guid=f"{tick}.{i}", cmd=f"k{i}={tick}"),
+            ))
+        for server in [leader] + followers:
+            clock_tick(server, raftnet, now)
+
+
+def main() -> None:
+    print(f'{"cmds/tick":>10} {"unbatched msgs/cmd":>19} {"batched msgs/cmd":>17}')
+    for load in [1, 10, 100, 1000]:
+        unbatched = messages_per_command(load, batch_size=1)
+        batched = messages_per_command(load, batch_size=256)
+        print(f'{load:>10} {unbatched:>19.3f} {batched:>17.3f}')
+
+
+if __name__ == '__main__':
+    main()
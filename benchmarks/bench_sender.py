@@ -0,0 +1,81 @@
+"""
+Sending queued messages over a socketpair: the old way, a frame-and-sendall
+per message, against transport.send_messages, which gathers everything
+that's queued into sendmsg calls.  Heartbeat-sized messages, in bursts the
+size a sender thread would find queued; counts send calls too.
+
+    PYTHONPATH=src python benchmarks/bench_sender.py
+"""
+import socket
+import threading
+import time
+from typing import Callable, List, Sequence, Tuple
+
+from raft.adapters import transport
+
+MESSAGES = 100_000
+MESSAGE = b'x' * 40
+
+
+class CountingSocket:
+    def __init__(self, sock: socket.socket) -> None:
+        self.sock = sock
+        self.sends = 0
+
+    def sendall(self, data: bytes) -> None:
+        self.sends += 1
+        self.sock.sendall(data)
+
+    def sendmsg(self, buffers: Sequence[bytes]) -> int:
+        self.sends += 1
+        return self.sock.sendmsg(buffers)
+
+
+def old_sender(sock: CountingSocket, msgs: List[bytes]) -> None:
+    for msg in msgs:
+        sock.sendall(transport.frame(msg))
+
+
+def new_sender(sock: CountingSocket, msgs: List[bytes]) -> None:
+    transport.send_messages(sock, msgs)  # type: ignore
+
+
+SENDERS = [('old', old_sender), ('new', new_sender)]  # type: List[Tuple[str, Callable]]
+
+
+def run(sender: Callable, burst: int) -> Tuple[float, int]:
+    """messages per second, and send calls"""
+    a, b = socket.socketpair()
+    bursts = MESSAGES // burst
+    expected = bursts * burst * (transport.HEADER_SIZE + len(MESSAGE))
+
+    def drain() -> None:
+        buffer = bytearray(1024 * 1024)
+        received = 0
+        while received < expected:
+            received += b.recv_into(buffer)
+
+    receiver = threading.Thread(target=drain)
+    receiver.start()
+    counting = CountingSocket(a)
+    msgs = [MESSAGE] * burst
+    start = time.perf_counter()
+    for _ in range(bursts):
+        sender(counting, msgs)
+    receiver.join()
+    elapsed = time.perf_counter() - start
+    a.close()
+    b.close()
+    return bursts * burst / elapsed, counting.sends
+
+
+def main() -> None:
+    print(f'{"burst":>6} {"sender":>7} {"msgs/s":>10} {"sends":>8}')
+    for burst in [1, 4, 32, 256]:
+        for name, sender in SENDERS:
+            rate, sends = run(sender, burst)
+            print(f'{burst:>6} {name:>7} {rate:>10.0f} {sends:>8}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Client command latency, and how often each server wakes up, for a three
+server cluster over localhost, with the old fixed 10ms polling loop and
+with the event-driven one, which sleeps until a message arrives or
+next_deadline() comes round.  One command at a time, wall clock time.
+
+    PYTHONPATH=src python benchmarks/bench_server_loop.py
+"""
+import asyncio
+import contextlib
+import io
+import statistics
+import time
+from typing import Callable, Dict, List
+
+from raft.adapters import run_server
+from raft.adapters.network import AsyncRaftNet
+from raft.log import InMemoryLog
+from raft.messages import ClientSetCommand, ClientSetSucceeded, Message
+from raft.server import Follower, Leader, Server
+
+COMMANDS = 200
+IDLE_SECONDS = 1.0
+PEERS = ["S1", "S2", "S3"]
+SERVERS = {
+    'S1': ('localhost', 16301),
+    'S2': ('localhost', 16302),
+    'S3': ('localhost', 16303),
+    'client': ('localhost', 16304),
+}
+
+
+async def polling(server: Server, raftnet: AsyncRaftNet) -> None:
+    while True:
+        run_server.clock_tick(server, raftnet, time.time())
+        await asyncio.sleep(0.01)
+
+
+async def measure(loop: Callable, ticks: Dict[str, int]) -> List[float]:
+    nets = {name: AsyncRaftNet(name, SERVERS) for name in SERVERS}
+    for net in nets.values():
+        await net.start()
+    servers = [
+        Leader(name="S1", peers=PEERS, now=time.time(), log=InMemoryLog([]), currentTerm=1, votedFor=None)
+    ] + [
+        Follower(name=n, peers=PEERS, now=time.time(), log=InMemoryLog([]), currentTerm=1, votedFor=None)
+        for n in PEERS[1:]
+    ]
+    real_clock_tick = run_server.clock_tick
+
+    def counting_clock_tick(server, raftnet, now):
+        ticks[server.name] = ticks.get(server.name, 0) + 1
+        real_clock_tick(server, raftnet, now)
+
+    run_server.clock_tick = counting_clock_tick
+    tasks = [asyncio.create_task(loop(s, nets[s.name])) for s in servers]
+    client = nets['client']
+    latencies = []
+    try:
+        await asyncio.sleep(0.1)  # for the followers to catch up
+        for i in range(COMMANDS):
+            start = time.perf_counter()
+            client.dispatch(Message(frm='client', to='S1', cmd=ClientSetCommand(guid=str(i), cmd=f'foo={i}')))
+            while not any(isinstance(m.cmd, ClientSetSucceeded) for m in client.get_messages('client')):
+                await client.wait_for_messages(timeout=1)
+            latencies.append(time.perf_counter() - start)
+        ticks.clear()
+        ticks.update({name: 0 for name in PEERS})
+        await asyncio.sleep(IDLE_SECONDS)
+    finally:
+        run_server.clock_tick = real_clock_tick
+        for task in tasks:
+            task.cancel()
+        for net in nets.values():
+            await net.close()
+    return latencies
+
+
+def main() -> None:
+    results = []
+    for name, loop in [("polling", polling), ("events", run_server.run_async_server)]:
+        ticks = {}  # type: Dict[str, int]
+        with contextlib.redirect_stdout(io.StringIO()):  # servers are chatty
+            latencies = asyncio.run(measure(loop, ticks))
+        results.append((name, latencies, ticks))
+    print(f'{"loop":>8} {"p50 ms":>8} {"p99 ms":>8} {"idle wakeups/s (leader, followers)":>36}')
+    for name, latencies, ticks in results:
+        p50 = statistics.median(latencies) * 1000
+        p99 = sorted(latencies)[int(len(latencies) * 0.99)] * 1000
+        wakeups = ', '.join(f'{ticks[n] / IDLE_SECONDS:.0f}' for n in PEERS)
+        print(f'{name:>8} {p50:>8.2f} {p99:>8.2f} {wakeups:>36}')
+
+
+if __name__ == '__main__':
+    main()
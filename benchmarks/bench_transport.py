@@ -0,0 +1,98 @@
+"""
+Receiving framed messages over a socketpair: the old way (a 12 digit
+ascii header, then the message built up with bytes concatenation, two
+reads a message) against transport.FrameReader, which reads as much as
+is there into one reused buffer and hands back every frame in it.
+Heartbeat-sized messages, and a few big ones.  Counts recv calls too.
+
+    PYTHONPATH=src python benchmarks/bench_transport.py
+"""
+import socket
+import threading
+import time
+from typing import Callable, List, Tuple
+
+from raft.adapters import transport
+
+OLD_HEADER_SIZE = 12
+
+
+class CountingSocket:
+    def __init__(self, sock: socket.socket) -> None:
+        self.sock = sock
+        self.recvs = 0
+
+    def recv(self, size: int) -> bytes:
+        self.recvs += 1
+        return self.sock.recv(size)
+
+    def recv_into(self, buffer: memoryview) -> int:
+        self.recvs += 1
+        return self.sock.recv_into(buffer)
+
+
+def old_recv_exactly(sock: CountingSocket, num_bytes: int) -> bytes:
+    msg = b''
+    while num_bytes:
+        part = sock.recv(num_bytes)
+        msg += part
+        num_bytes -= len(part)
+    return msg
+
+
+def old_reader(sock: CountingSocket, count: int) -> None:
+    for _ in range(count):
+        old_recv_exactly(sock, int(old_recv_exactly(sock, OLD_HEADER_SIZE)))
+
+
+def new_reader(sock: CountingSocket, count: int) -> None:
+    reader = transport.FrameReader(sock)  # type: ignore
+    received = 0
+    while received < count:
+        received += len(reader.read_frames())
+
+
+READERS = [
+    ('old', old_reader, lambda msg: b'%12d' % len(msg) + msg),
+    ('new', new_reader, transport.frame),
+]  # type: List[Tuple[str, Callable, Callable[[bytes], bytes]]]
+WORKLOADS = [
+    ('20000 x 40B', 20_000, 40),
+    ('20 x 8MB', 20, 8 * 1024 * 1024),
+]
+
+
+def run(reader: Callable, framer: Callable[[bytes], bytes], count: int, size: int) -> Tuple[float, int]:
+    a, b = socket.socketpair()
+    msg = b'x' * size
+    framed = framer(msg)
+
+    def send() -> None:
+        for _ in range(count):
+            a.sendall(framed)
+
+    sender = threading.Thread(target=send)
+    counting = CountingSocket(b)
+    start = time.perf_counter()
+    sender.start()
+    reader(counting, count)
+    elapsed = time.perf_counter() - start
+    sender.join()
+    a.close()
+    b.close()
+    return elapsed, counting.recvs
+
+
+def main() -> None:
+    print(f'{"messages":>12} {"framing":>8} {"MB/s":>8} {"msgs/s":>10} {"recvs":>8}')
+    for name, count, size in WORKLOADS:
+        for reader_name, reader, framer in READERS:
+            elapsed, recvs = run(reader, framer, count, size)
+            print(
+                f'{name:>12} {reader_name:>8} {count * size / elapsed / 1e6:>8.0f} '
+                f'{count / elapsed:>10.0f} {recvs:>8}'
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,308 @@
+import struct
+import sys
+from array import array
+from itertools import accumulate
+from typing import Any, Callable, Dict, List, Tuple, Type, Union
+
+from raft.log import Entry, Session
+from raft.messages import (
+    Message,
+    ClientSetCommand,
+    ClientSetSucceeded,
+    ClientGetCommand,
+    ClientGetSucceeded,
+    ClientRedirect,
+    AppendEntries,
+    AppendEntriesSucceeded,
+    AppendEntriesFailed,
+    InstallSnapshot,
+    InstallSnapshotSucceeded,
+    InstallSnapshotFailed,
+    ReadIndexRequest,
+    ReadIndexReply,
+    RequestVote,
+    VoteGranted,
+    VoteDenied,
+    PreVote,
+    PreVoteGranted,
+    PreVoteDenied,
+)
+
+# Messages on the wire, instead of pickles, which would run whatever code a
+# peer (or anyone who can reach our port) cares to send us.  Each one is a
+# fixed header, then who it's from and to, then the command's fields in the
+# order given in _SCHEMAS:
+#
+#     version (u8) | tag (u8) | frm (str) | to (str) | fields...
+#
+# ints are unsigned LEB128 varints, strs and bytes a varint length and then
+# the (utf-8) bytes, floats f64, bools a byte.  Optional fields have a byte
+# saying whether they're there first.  AppendEntries' entries are packed
+# column by column, so they decode a whole array at a time rather than a
+# field at a time:
+#
+#     count (varint) | terms (u64 each) | session count (varint) | sessions |
+#     cmd lengths (u32 each) | cmds
+#
+# and the sessions, if there are any, likewise:
+#
+#     entry positions (u32 each) | seqs (u64 each) | timestamps (f64 each) |
+#     clientId lengths (u32 each) | clientIds
+#
+# Arrays are little-endian.
+#
+# Anything that changes the layout of a message needs a new CODEC_VERSION;
+# new message types just need a new tag.
+CODEC_VERSION = 2
+_HEADER = struct.Struct('>BB')
+_FLOAT = struct.Struct('>d')
+_BIG_ENDIAN = sys.byteorder == 'big'
+
+
+class DecodeError(ValueError):
+    pass
+
+
+def _put_uint(out: bytearray, value: int) -> None:
+    if value < 0:
+        raise ValueError(f'cannot encode negative int {value}')
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _get_uint(view: memoryview, pos: int) -> Tuple[int, int]:
+    byte = view[pos]
+    if byte < 0x80:
+        return byte, pos + 1
+    value = shift = 0
+    while True:
+        byte = view[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+        if shift > 63:
+            # nothing we send needs more than 64 bits
+            raise DecodeError('varint too long')
+
+
+def _put_bytes(out: bytearray, value: bytes) -> None:
+    _put_uint(out, len(value))
+    out += value
+
+
+def _get_bytes(view: memoryview, pos: int) -> Tuple[bytes, int]:
+    length, pos = _get_uint(view, pos)
+    end = pos + length
+    if end > len(view):
+        raise DecodeError('truncated message')
+    return bytes(view[pos:end]), end
+
+
+def _put_str(out: bytearray, value: str) -> None:
+    _put_bytes(out, value.encode())
+
+
+def _get_str(view: memoryview, pos: int) -> Tuple[str, int]:
+    length, pos = _get_uint(view, pos)
+    end = pos + length
+    if end > len(view):
+        raise DecodeError('truncated message')
+    return str(view[pos:end], 'utf-8'), end
+
+
+def _put_float(out: bytearray, value: float) -> None:
+    out += _FLOAT.pack(value)
+
+
+def _get_float(view: memoryview, pos: int) -> Tuple[float, int]:
+    (value,) = _FLOAT.unpack_from(view, pos)
+    return value, pos + _FLOAT.size
+
+
+def _put_bool(out: bytearray, value: bool) -> None:
+    out.append(1 if value else 0)
+
+
+def _get_bool(view: memoryview, pos: int) -> Tuple[bool, int]:
+    return view[pos] != 0, pos + 1
+
+
+Encoder = Callable[[bytearray, Any], None]
+Decoder = Callable[[memoryview, int], Tuple[Any, int]]
+
+
+def _optional(put: Encoder, get: Decoder) -> Tuple[Encoder, Decoder]:
+    def put_optional(out: bytearray, value: Any) -> None:
+        _put_bool(out, value is not None)
+        if value is not None:
+            put(out, value)
+
+    def get_optional(view: memoryview, pos: int) -> Tuple[Any, int]:
+        present, pos = _get_bool(view, pos)
+        return get(view, pos) if present else (None, pos)
+
+    return put_optional, get_optional
+
+
+def _array_bytes(values: array) -> bytes:
+    if _BIG_ENDIAN:
+        values.byteswap()
+    return values.tobytes()
+
+
+def _array_from(typecode: str, view: memoryview, pos: int, count: int) -> Tuple[array, int]:
+    values = array(typecode)
+    end = pos + count * values.itemsize
+    if end > len(view):
+        raise DecodeError('truncated message')
+    values.frombytes(view[pos:end])
+    if _BIG_ENDIAN:
+        values.byteswap()
+    return values, end
+
+
+def _put_strs(out: bytearray, values: List[str]) -> None:
+    """their utf-8 lengths (u32 each), then all their bytes together"""
+    encoded = [value.encode() for value in values]
+    out += _array_bytes(array('I', [len(value) for value in encoded]))
+    out += b''.join(encoded)
+
+
+def _get_strs(view: memoryview, pos: int, count: int) -> Tuple[List[str], int]:
+    lengths, pos = _array_from('I', view, pos, count)
+    ends = list(accumulate(lengths))
+    end = pos + (ends[-1] if ends else 0)
+    if end > len(view):
+        raise DecodeError('truncated message')
+    encoded = view[pos:end]
+    text = str(encoded, 'utf-8')
+    starts = [0] + ends[:-1]
+    if len(text) == len(encoded):
+        # all ascii, so byte offsets are str offsets too
+        return [text[start:stop] for start, stop in zip(starts, ends)], end
+    return [str(encoded[start:stop], 'utf-8') for start, stop in zip(starts, ends)], end
+
+
+def _put_entries(out: bytearray, entries: List[Entry]) -> None:
+    _put_uint(out, len(entries))
+    if not entries:
+        return
+    out += _array_bytes(array('Q', [entry.term for entry in entries]))
+    positions = [i for i, entry in enumerate(entries) if entry.session is not None]
+    sessions = [entry.session for entry in entries if entry.session is not None]
+    _put_uint(out, len(sessions))
+    if sessions:
+        out += _array_bytes(array('I', positions))
+        out += _array_bytes(array('Q', [session.seq for session in sessions]))
+        out += _array_bytes(array('d', [session.timestamp for session in sessions]))
+        _put_strs(out, [session.clientId for session in sessions])
+    _put_strs(out, [entry.cmd for entry in entries])
+
+
+def _get_entries(view: memoryview, pos: int) -> Tuple[List[Entry], int]:
+    count, pos = _get_uint(view, pos)
+    if not count:
+        return [], pos
+    terms, pos = _array_from('Q', view, pos, count)
+    session_count, pos = _get_uint(view, pos)
+    if session_count:
+        positions, pos = _array_from('I', view, pos, session_count)
+        seqs, pos = _array_from('Q', view, pos, session_count)
+        timestamps, pos = _array_from('d', view, pos, session_count)
+        clientIds, pos = _get_strs(view, pos, session_count)
+    cmds, pos = _get_strs(view, pos, count)
+    entries = list(map(Entry, terms, cmds))
+    if session_count:
+        if max(positions) >= count:
+            raise DecodeError('session for an entry that is not there')
+        for i, session in zip(positions, map(Session, clientIds, seqs, timestamps)):
+            entries[i].session = session
+    return entries, pos
+
+
+_UINT = (_put_uint, _get_uint)
+_STR = (_put_str, _get_str)
+_BYTES = (_put_bytes, _get_bytes)
+_FLOAT_FIELD = (_put_float, _get_float)
+_BOOL = (_put_bool, _get_bool)
+_OPTIONAL_STR = _optional(_put_str, _get_str)
+_OPTIONAL_FLOAT = _optional(_put_float, _get_float)
+_ENTRIES = (_put_entries, _get_entries)
+
+Field = Tuple[str, Tuple[Encoder, Decoder]]
+
+# tag, and fields in wire order.  tags are forever: never reuse one
+_SCHEMAS = {
+    ClientSetCommand: (1, [('guid', _STR), ('cmd', _STR), ('clientId', _OPTIONAL_STR), ('seq', _UINT)]),
+    ClientSetSucceeded: (2, [('guid', _STR)]),
+    ClientGetCommand: (3, [('guid', _STR), ('key', _STR), ('max_staleness', _OPTIONAL_FLOAT)]),
+    ClientGetSucceeded: (4, [('guid', _STR), ('value', _OPTIONAL_STR)]),
+    ClientRedirect: (5, [('guid', _STR), ('leaderHint', _OPTIONAL_STR)]),
+    AppendEntries: (6, [
+        ('term', _UINT), ('leaderId', _STR), ('prevLogIndex', _UINT), ('prevLogTerm', _UINT),
+        ('entries', _ENTRIES), ('leaderCommit', _UINT), ('seq', _UINT),
+        ('electionTimeout', _FLOAT_FIELD), ('quiescent', _BOOL),
+    ]),
+    AppendEntriesSucceeded: (7, [('matchIndex', _UINT), ('seq', _UINT)]),
+    AppendEntriesFailed: (8, [
+        ('term', _UINT), ('conflictTerm', _UINT), ('conflictIndex', _UINT), ('seq', _UINT),
+    ]),
+    InstallSnapshot: (9, [
+        ('term', _UINT), ('leaderId', _STR), ('lastIncludedIndex', _UINT),
+        ('lastIncludedTerm', _UINT), ('offset', _UINT), ('data', _BYTES), ('done', _BOOL),
+    ]),
+    InstallSnapshotSucceeded: (10, [
+        ('term', _UINT), ('lastIncludedIndex', _UINT), ('offset', _UINT), ('done', _BOOL),
+    ]),
+    ReadIndexRequest: (11, [('term', _UINT), ('readId', _UINT)]),
+    ReadIndexReply: (12, [('term', _UINT), ('readId', _UINT), ('readIndex', _UINT)]),
+    RequestVote: (13, [
+        ('term', _UINT), ('candidateId', _STR), ('lastLogIndex', _UINT), ('lastLogTerm', _UINT),
+    ]),
+    VoteGranted: (14, []),
+    VoteDenied: (15, [('term', _UINT)]),
+    PreVote: (16, [
+        ('proposedTerm', _UINT), ('candidateId', _STR), ('lastLogIndex', _UINT), ('lastLogTerm', _UINT),
+    ]),
+    PreVoteGranted: (17, [('proposedTerm', _UINT)]),
+    PreVoteDenied: (18, [('term', _UINT)]),
+    InstallSnapshotFailed: (19, [('term', _UINT)]),
+}  # type: Dict[Type, Tuple[int, List[Field]]]
+_BY_TAG = {tag: (cls, fields) for cls, (tag, fields) in _SCHEMAS.items()}
+
+
+def encode(msg: Message) -> bytes:
+    tag, fields = _SCHEMAS[type(msg.cmd)]
+    out = bytearray(_HEADER.pack(CODEC_VERSION, tag))
+    _put_str(out, msg.frm)
+    _put_str(out, msg.to)
+    for name, (put, _) in fields:
+        put(out, getattr(msg.cmd, name))
+    return bytes(out)
+
+
+def decode(data: Union[bytes, bytearray, memoryview]) -> Message:
+    """the message encoded in data, which can be any bytes-like object, eg a memoryview"""
+    view = memoryview(data)
+    try:
+        version, tag = _HEADER.unpack_from(view)
+        if version != CODEC_VERSION:
+            raise DecodeError(f'unsupported codec version {version}')
+        if tag not in _BY_TAG:
+            raise DecodeError(f'unknown message tag {tag}')
+        cls, fields = _BY_TAG[tag]
+        frm, pos = _get_str(view, _HEADER.size)
+        to, pos = _get_str(view, pos)
+        values = []
+        for _, (_, get) in fields:
+            value, pos = get(view, pos)
+            values.append(value)
+    except (IndexError, struct.error, UnicodeDecodeError) as e:
+        raise DecodeError(f'malformed message: {e}') from e
+    if pos != len(view):
+        raise DecodeError(f'{len(view) - pos} bytes left over after message')
+    return Message(frm, to, cls(*values))
@@ -1,14 +1,15 @@
 from colorama import Fore, Style
+from collections import deque
 from enum import Enum
-from typing import Any, Dict, List, Protocol
+from typing import Any, Deque, Dict, List, Optional, Protocol, Set, Tuple, Union
 from dataclasses import dataclass
-import pickle
+import asyncio
 import queue
 import socket
 import threading
 
 from raft.messages import Message
-from raft.adapters import transport
+from raft.adapters import codec, transport
 
 
 def _tid() -> str:
@@ -25,10 +26,19 @@ class RaftNetwork(Protocol):
         ...
 
 
+class WaitableRaftNetwork(RaftNetwork, Protocol):
+
+    def wait_for_messages(self, timeout: float) -> None:
+        """block until there are messages to get, or for up to timeout seconds"""
+        ...
+
+
 class FakeRaftNetwork:
     def __init__(self, messages: List[Message]):
         self._messages = messages
         self._message_backups = []  # type: List[Message]
+        # servers cut off from everyone else: messages to or from them are lost
+        self._isolated = set()  # type: Set[str]
 
     def get_messages(self, to: str) -> List[Message]:
         """retrieve messages for someone, and take them out of the network"""
@@ -40,20 +50,33 @@ class FakeRaftNetwork:
 
     def dispatch(self, msg: Message) -> None:
         """put the message into the network"""
+        if msg.frm in self._isolated or msg.to in self._isolated:
+            return
         self._messages.append(msg)
 
+    def isolate(self, name: str) -> None:
+        """partition a server off, losing anything on its way to it"""
+        self._isolated.add(name)
+        self._messages[:] = [m for m in self._messages if m.to != name]
+
+    def heal(self, name: str) -> None:
+        self._isolated.discard(name)
+
 
 
 # -- Dave's code, modified
 
+def encode(msg: Message) -> bytes:
+    return codec.encode(msg)
+
+def decode(raw: Union[bytes, bytearray, memoryview]) -> Message:
+    return codec.decode(raw)
+
 def receive_message(sock: socket.socket) -> Message:
-    raw = transport.recv_message(sock)
-    result = pickle.loads(raw)  # TODO: messages include user-submitted data. so this is terrible
-    assert isinstance(result, Message)
-    return result
+    return decode(transport.recv_message(sock))
 
 def send_message(msg: Message, sock: socket.socket) -> None:
-    transport.send_message(sock, pickle.dumps(msg))
+    transport.send_message(sock, encode(msg))
 
 
 @dataclass
@@ -63,6 +86,10 @@ class Host:
     port: int
 
 
+# the most messages a sender takes off a peer's queue to send together
+MAX_SEND_BATCH = 512
+
+
 class TCPRaftNet:
     SERVERS = {
         'S1': ('localhost', 16001),
@@ -72,85 +99,295 @@ class TCPRaftNet:
         'S5': ('localhost', 16005),
     }
 
-    def __init__(self, name) -> None:
+    def __init__(
+        self,
+        name,
+        servers: Optional[Dict[str, Tuple[str, int]]] = None,
+        socket_options: Optional[transport.SocketOptions] = None,
+    ) -> None:
         self.name = name
-        self.host = self.SERVERS[name]
+        self.servers = servers or self.SERVERS
+        self.host = self.servers[name]
+        self.socket_options = socket_options or transport.SocketOptions()
         # Message queues.  There is a separate outgoing queue for each destination.
         # There is a single incoming queue for all received messages.
+        # a None on an outgoing queue tells its sender to stop
         self._outgoing = {
             name: queue.Queue()
-            for name in self.SERVERS
+            for name in self.servers
             if name != self.name
         }  # type: Dict[str, queue.Queue]
         self._incoming = queue.Queue()  # type: queue.Queue[Message]
+        # set when a message arrives, cleared when they're got
+        self._arrived = threading.Event()
+        self._listener = None  # type: Optional[socket.socket]
+        self._connections = set()  # type: Set[socket.socket]
+        self._threads = []  # type: List[threading.Thread]
 
     def _debug(self, msg) -> None:
         print(f'{Fore.YELLOW}[raftnet][{self.name}][{_tid()}] {msg}{Style.RESET_ALL}')
 
     def dispatch(self, msg: Message) -> None:
         # Drop the message in a queue and walk away immediately. Does NOT block.
+        if msg.to not in self._outgoing:
+            self._debug(f'no route to {msg.to}, dropping {msg}')
+            return
         self._outgoing[msg.to].put(msg)
 
 
     def get_messages(self, to: str) -> List[Message]:
         assert to == self.name  # TODO: this argument is only really needed so 1 FakeRaftNetwork can be shared amongst multiple servers. eh.
+        self._arrived.clear()
         messages = []
         while not self._incoming.empty():
             messages.append(self._incoming.get())
         return messages
 
+    def wait_for_messages(self, timeout: float) -> None:
+        self._arrived.wait(timeout)
+
 
     def start(self) -> None:
         # Launch various threads related to the network component
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, True)
+        # before listen(), so accepted connections get its buffer sizes
+        self.socket_options.apply(sock)
+        sock.bind(self.host)
+        sock.listen()
+        self._listener = sock
 
         # Thread responsible for listening for incoming connections
-        threading.Thread(target=self.acceptor_thread, daemon=True).start()
+        self._start_thread(self.acceptor_thread, sock)
 
         # Threads dedicated to sending outgoing messages
         for server_name in self._outgoing:
-            threading.Thread(target=self.sender_thread, args=(server_name,), daemon=True).start()
-
-    def acceptor_thread(self):
-        self._debug('Starting acceptor thread')
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, True)
-        sock.bind(self.host)
-        sock.listen()
+            self._start_thread(self.sender_thread, server_name)
+
+    def close(self) -> None:
+        """stop listening, hang up on everyone, and wait for the threads to finish"""
+        if self._listener is not None:
+            # wakes the acceptor out of accept()
+            self._listener.shutdown(socket.SHUT_RDWR)
+            self._listener.close()
+        for sock in list(self._connections):
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass  # already gone
+        for outgoing in self._outgoing.values():
+            outgoing.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def _start_thread(self, target, *args) -> None:
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        self._threads.append(thread)
+        thread.start()
+
+    def acceptor_thread(self, sock):
         self._debug('Acceptor thread waiting for connections')
         while True:
-            client, _ = sock.accept()
-            threading.Thread(target=self.receiver_thread, args=(client,), daemon=True).start()
+            try:
+                client, _ = sock.accept()
+            except OSError:
+                return  # closed
+            self.socket_options.apply(client)
+            self._connections.add(client)
+            self._start_thread(self.receiver_thread, client)
 
     def receiver_thread(self, sock):
         self._debug('Starting receiver thread')
         # Thread that deals with messages
+        reader = transport.FrameReader(sock)
         try:
             while True:
-                msg = receive_message(sock)
-                self._debug(f'Received msg {msg}')
-                self._incoming.put(msg)
+                for frame in reader.read_frames():
+                    msg = decode(frame)
+                    self._debug(f'Received msg {msg}')
+                    self._incoming.put(msg)
+                self._arrived.set()
+        except codec.DecodeError as e:
+            # not a peer we can talk to.  keep what came before, and hang up
+            self._debug(f'closing connection after a malformed message: {e}')
+            self._arrived.set()
+            sock.close()
         except (EOFError, ConnectionError):
             sock.close()
+        finally:
+            self._connections.discard(sock)
 
     def sender_thread(self, server_name):
         self._debug(f'starting sender thread')
+        outgoing = self._outgoing[server_name]
         sock = None
         while True:
-            msg = self._outgoing[server_name].get()
-            self._debug(f'sender: sending msg {msg}')
-            # Make some kind of best-effort to send the message
+            # everything that's queued up for them, to go out together
+            msgs = [outgoing.get()]
+            while len(msgs) < MAX_SEND_BATCH:
+                try:
+                    msgs.append(outgoing.get_nowait())
+                except queue.Empty:
+                    break
+            if None in msgs:
+                if sock is not None:
+                    sock.close()
+                return
+            self._debug(f'sender: sending msgs {msgs}')
+            # Make some kind of best-effort to send the messages
             if sock is None:
                 sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                self.socket_options.apply(sock)
                 try:
-                    sock.connect(self.SERVERS[server_name])
+                    sock.connect(self.servers[server_name])
                 except OSError:
                     sock.close()
                     sock = None
-                    continue       # Oh well. Throw the message away.
+                    continue       # Oh well. Throw the messages away.
 
             try:
                 self._debug('sender: actually sending now')
-                send_message(msg, sock)
+                transport.send_messages(sock, [encode(msg) for msg in msgs])
             except OSError:
                 sock.close()
                 sock = None
+
+
+# how many messages can wait to go out to a peer: past that, the oldest are
+# dropped, as they would be by a lossy network.  and how many bytes a
+# connection can have buffered before its sender waits for them to drain
+MAX_QUEUED_PER_PEER = 1024
+WRITE_BUFFER_HIGH = 256 * 1024
+
+
+class AsyncRaftNet:
+    """
+    TCPRaftNet on a single asyncio event loop: a stream per peer, each with
+    its own sender task, instead of a thread per connection.  dispatch and
+    get_messages don't block, so a server can be driven from the same loop
+    (see run_server.run_async_server); everything must run on that loop.
+    """
+    SERVERS = TCPRaftNet.SERVERS
+
+    def __init__(
+        self,
+        name: str,
+        servers: Optional[Dict[str, Tuple[str, int]]] = None,
+        max_queued: int = MAX_QUEUED_PER_PEER,
+        socket_options: Optional[transport.SocketOptions] = None,
+    ) -> None:
+        self.name = name
+        self.servers = servers or self.SERVERS
+        self.socket_options = socket_options or transport.SocketOptions()
+        self.host = self.servers[name]
+        self._outgoing = {
+            name: deque(maxlen=max_queued)
+            for name in self.servers
+            if name != self.name
+        }  # type: Dict[str, Deque[Message]]
+        self._incoming = []  # type: List[Message]
+        # set whenever something is queued for a peer, or arrives for us.
+        # made in start(), on the loop they're for
+        self._ready_to_send = {}  # type: Dict[str, asyncio.Event]
+        self.arrived = None  # type: Optional[asyncio.Event]
+        self._listener = None  # type: Optional[asyncio.AbstractServer]
+        self._tasks = []  # type: List[asyncio.Task]
+        self._connections = set()  # type: Set[asyncio.StreamWriter]
+
+    def _debug(self, msg) -> None:
+        print(f'{Fore.YELLOW}[asyncnet][{self.name}] {msg}{Style.RESET_ALL}')
+
+    def dispatch(self, msg: Message) -> None:
+        if msg.to not in self._outgoing:
+            self._debug(f'no route to {msg.to}, dropping {msg}')
+            return
+        self._outgoing[msg.to].append(msg)
+        if msg.to in self._ready_to_send:
+            self._ready_to_send[msg.to].set()
+
+    def get_messages(self, to: str) -> List[Message]:
+        assert to == self.name
+        messages, self._incoming = self._incoming, []
+        if self.arrived is not None:
+            self.arrived.clear()
+        return messages
+
+    async def wait_for_messages(self, timeout: float) -> None:
+        """wait until there are messages to get, or for up to timeout seconds"""
+        assert self.arrived is not None
+        try:
+            await asyncio.wait_for(self.arrived.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def start(self) -> None:
+        """start listening, and a sender task for each peer"""
+        self.arrived = asyncio.Event()
+        host, port = self.host
+        self._listener = await asyncio.start_server(
+            self._receive_from, host, port, reuse_address=True,
+        )
+        for server_name, queued in self._outgoing.items():
+            self._ready_to_send[server_name] = asyncio.Event()
+            if queued:
+                self._ready_to_send[server_name].set()
+            self._tasks.append(asyncio.create_task(self._send_to(server_name)))
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        for writer in list(self._connections):
+            writer.close()
+        if self._listener is not None:
+            self._listener.close()
+            await self._listener.wait_closed()
+
+    async def _receive_from(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._connections.add(writer)
+        self.socket_options.apply(writer.get_extra_info('socket'))
+        try:
+            while True:
+                header = await reader.readexactly(transport.HEADER_SIZE)
+                raw = await reader.readexactly(transport.frame_size(header))
+                self._incoming.append(decode(raw))
+                assert self.arrived is not None
+                self.arrived.set()
+        except codec.DecodeError as e:
+            self._debug(f'closing connection after a malformed message: {e}')
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+
+    async def _send_to(self, server_name: str) -> None:
+        queued = self._outgoing[server_name]
+        ready = self._ready_to_send[server_name]
+        writer = None  # type: Optional[asyncio.StreamWriter]
+        while True:
+            await ready.wait()
+            ready.clear()
+            if writer is None:
+                host, port = self.servers[server_name]
+                try:
+                    _, writer = await asyncio.open_connection(host, port)
+                except OSError:
+                    # Oh well. Throw the messages away.
+                    queued.clear()
+                    continue
+                writer.transport.set_write_buffer_limits(high=WRITE_BUFFER_HIGH)
+                self.socket_options.apply(writer.get_extra_info('socket'))
+                self._connections.add(writer)
+            try:
+                msgs = [encode(msg) for msg in queued]
+                queued.clear()
+                writer.writelines(transport.frame_buffers(msgs))
+                # waits only if the peer is falling behind, by when new
+                # messages are piling up in (and falling off) the queue
+                await writer.drain()
+            except ConnectionError:
+                self._connections.discard(writer)
+                writer.close()
+                writer = None
+
@@ -1,22 +1,169 @@
-import json
-from dataclasses import asdict
+import os
+import re
+import struct
+import zlib
+from array import array
 from pathlib import Path
-from typing import List
+from typing import List, Optional, Tuple, Union
 
-from raft.log import Entry, InMemoryLog
+from raft.log import Entry, InMemoryLog, Session, Snapshot
+
+# The log file is an append-only segment of records, each one a fixed header
+# followed by a body:
+#
+#     length (u32) | crc32 of kind+body (u32) | kind (u8) | body
+#
+# An append record's body is the entry term (u64) followed by the utf-8 cmd.
+# Entries with a client session are session append records instead:
+#
+#     term (u64) | seq (u64) | timestamp (f64) | clientId length (u16) | clientId | cmd
+#
+# A compacted segment starts with a base record, whose body is the index (u64)
+# of the entry just before its first one.
+#
+# The latest snapshot lives next to the segment, in a file of its own:
+#
+#     lastIncludedIndex (u64) | lastIncludedTerm (u64) | crc32 of data (u32) | data
+_HEADER = struct.Struct('>IIB')
+_TERM = struct.Struct('>Q')
+_INDEX = struct.Struct('>Q')
+_SESSION = struct.Struct('>QQdH')
+_SNAPSHOT_HEADER = struct.Struct('>QQI')
+_APPEND = 1
+_BASE = 2
+_SESSION_APPEND = 3
+
+
+def _checksum(kind: int, body: Union[bytes, memoryview]) -> int:
+    return zlib.crc32(body, zlib.crc32(bytes([kind])))
+
+
+def _encode_record(kind: int, body: bytes) -> bytes:
+    return _HEADER.pack(len(body), _checksum(kind, body), kind) + body
+
+
+def _encode_entry(entry: Entry) -> bytes:
+    session = entry.session
+    if session is None:
+        return _encode_record(_APPEND, _TERM.pack(entry.term) + entry.cmd.encode())
+    clientId = session.clientId.encode()
+    header = _SESSION.pack(entry.term, session.seq, session.timestamp, len(clientId))
+    return _encode_record(_SESSION_APPEND, header + clientId + entry.cmd.encode())
+
+
+def _decode_session_entry(body: memoryview) -> Entry:
+    term, seq, timestamp, length = _SESSION.unpack_from(body)
+    clientId = str(body[_SESSION.size:_SESSION.size + length], 'utf-8')
+    cmd = str(body[_SESSION.size + length:], 'utf-8')
+    return Entry(term=term, cmd=cmd, session=Session(clientId, seq, timestamp))
+
+
+def _parse_durability(durability: str) -> Optional[float]:
+    """
+    'none' never fsyncs, 'per-batch' fsyncs every sync() that wrote something,
+    and 'interval=Nms' fsyncs at most once every N milliseconds.  returns the
+    minimum seconds between fsyncs, or None for no fsyncs.
+    """
+    if durability == 'none':
+        return None
+    if durability == 'per-batch':
+        return 0.0
+    match = re.fullmatch(r'interval=(\d+)ms', durability)
+    if match is None:
+        raise ValueError(f'unknown durability policy {durability!r}')
+    return int(match.group(1)) / 1000.0
+
+
+def _replay(data: bytes) -> Tuple[int, List[Entry], array, int]:
+    """
+    parse records up to the end of the segment, or up to the first torn or
+    corrupt one.  returns the index before the first entry, the entries, the
+    file offset each one starts at, and the size of the valid part of the
+    segment.
+    """
+    base = 0
+    entries = []  # type: List[Entry]
+    offsets = array('Q')
+    view = memoryview(data)
+    pos = 0
+    while pos + _HEADER.size <= len(data):
+        length, crc, kind = _HEADER.unpack_from(view, pos)
+        body = view[pos + _HEADER.size:pos + _HEADER.size + length]
+        if len(body) < length or _checksum(kind, body) != crc:
+            break
+        if kind == _BASE and pos == 0:
+            (base,) = _INDEX.unpack_from(body)
+        elif kind == _APPEND:
+            (term,) = _TERM.unpack_from(body)
+            entries.append(Entry(term=term, cmd=str(body[_TERM.size:], 'utf-8')))
+            offsets.append(pos)
+        elif kind == _SESSION_APPEND:
+            entries.append(_decode_session_entry(body))
+            offsets.append(pos)
+        else:
+            break
+        pos += _HEADER.size + length
+    return base, entries, offsets, pos
+
+
+def _encode_snapshot(snapshot: Snapshot) -> bytes:
+    header = _SNAPSHOT_HEADER.pack(
+        snapshot.lastIncludedIndex, snapshot.lastIncludedTerm, zlib.crc32(snapshot.data)
+    )
+    return header + snapshot.data
+
+
+def _decode_snapshot(data: bytes) -> Snapshot:
+    lastIncludedIndex, lastIncludedTerm, crc = _SNAPSHOT_HEADER.unpack_from(data)
+    body = data[_SNAPSHOT_HEADER.size:]
+    if zlib.crc32(body) != crc:
+        raise ValueError('snapshot file is corrupt')
+    return Snapshot(lastIncludedIndex, lastIncludedTerm, body)
 
 
 class PersistentLog:
+    """
+    Log backed by an append-only segment file.  Adding an entry encodes just
+    that entry's record; overwriting a conflicting suffix cuts the file back
+    to where the suffix started.  Reads are served from an in-memory copy,
+    which is rebuilt by replaying the segment on startup.
+
+    Records are buffered until sync(), which writes everything appended since
+    the last one in a single write, and fsyncs according to the durability
+    policy.  durableIndex only covers entries that policy considers safe.
 
-    def __init__(self, path: Path):
+    Taking a snapshot writes it to its own file, then rewrites the segment
+    with just the entries after it.  Both are written to a temporary file and
+    renamed into place, so a crash leaves either the old or the new version.
+    """
+
+    def __init__(self, path: Path, durability: str = 'per-batch'):
         self.path = path
-        if not self.path.exists():
-            existing_entries = []
-        else:
-            existing_entries = [
-                Entry(**entry) for entry in json.loads(self.path.read_text())
-            ]
-        self.log = InMemoryLog(existing_entries)
+        self.snapshot_path = path.with_name(path.name + '.snapshot')
+        self._fsync_interval = _parse_durability(durability)
+        snapshot = None  # type: Optional[Snapshot]
+        if self.snapshot_path.exists():
+            snapshot = _decode_snapshot(self.snapshot_path.read_bytes())
+        data = self.path.read_bytes() if self.path.exists() else b''
+        base, entries, self._offsets, self._size = _replay(data)
+        if snapshot is not None and snapshot.lastIncludedIndex > base:
+            # crashed after saving a snapshot but before rewriting the segment
+            covered = snapshot.lastIncludedIndex - base
+            del entries[:covered], self._offsets[:covered]
+        self.log = InMemoryLog(entries, snapshot)
+        self._file = open(self.path, 'ab')
+        if self._size < len(data):
+            # torn write or garbage at the tail, eg from a crash mid-append.
+            self._file.truncate(self._size)
+        self._pending = bytearray()
+        self._written = self._size  # everything before this is in the file
+        self._unsynced = False
+        self._last_fsync = None  # type: Optional[float]
+        self._durableIndex = self.log.lastLogIndex
+
+    @property
+    def durableIndex(self) -> int:
+        return self._durableIndex
 
     @property
     def lastLogIndex(self) -> int:
@@ -26,6 +173,18 @@ class PersistentLog:
     def last_log_term(self) -> int:
         return self.log.last_log_term
 
+    def entry_term(self, index: int) -> int:
+        return self.log.entry_term(index)
+
+    def entry_at(self, index: int) -> Entry:
+        return self.log.entry_at(index)
+
+    def first_index_of_term(self, term: int) -> int:
+        return self.log.first_index_of_term(term)
+
+    def last_index_of_term(self, term: int) -> int:
+        return self.log.last_index_of_term(term)
+
     def check_log(self, prevLogIndex: int, prevLogTerm: int) -> bool:
         return self.log.check_log(prevLogIndex, prevLogTerm)
 
@@ -36,14 +195,120 @@ class PersistentLog:
         prevLogTerm: int,
         leaderCommit: int,
     ) -> bool:
-        result = self.log.add_entry(
-            entry, prevLogIndex, prevLogTerm, leaderCommit
-        )
-        self._flush()
-        return result
+        return self.append_entries(prevLogIndex, prevLogTerm, [entry])
+
+    def append_entries(
+        self,
+        prevLogIndex: int,
+        prevLogTerm: int,
+        entries: List[Entry],
+    ) -> bool:
+        if not self.log.check_log(prevLogIndex, prevLogTerm):
+            return False
+        index = prevLogIndex + 1
+        new = max(0, self.log.snapshot.lastIncludedIndex - prevLogIndex)
+        while new < len(entries) and index + new <= self.log.lastLogIndex:
+            if self.log.entry_at(index + new) != entries[new]:
+                self._truncate_from(index + new)
+                break
+            new += 1
+        for entry in entries[new:]:
+            self._append(entry)
+        return self.log.append_entries(prevLogIndex, prevLogTerm, entries)
 
     def read(self) -> List[Entry]:
         return self.log.read()
 
-    def _flush(self) -> None:
-        self.path.write_text(json.dumps([asdict(e) for e in self.read()]))
+    @property
+    def snapshot(self) -> Snapshot:
+        return self.log.snapshot
+
+    def compact(self, snapshot: Snapshot) -> None:
+        self.log.compact(snapshot)
+        self._save_snapshot(snapshot)
+        self._rewrite_segment()
+
+    def install_snapshot(self, snapshot: Snapshot) -> None:
+        if snapshot.lastIncludedIndex <= self.log.snapshot.lastIncludedIndex:
+            return
+        self.log.install_snapshot(snapshot)
+        self._save_snapshot(snapshot)
+        self._rewrite_segment()
+
+    def sync(self, now: float) -> None:
+        if self._pending:
+            self._file.write(self._pending)
+            self._file.flush()
+            self._written = self._size
+            self._pending.clear()
+            self._unsynced = True
+        if self._fsync_interval is None:
+            self._durableIndex = self.log.lastLogIndex
+            return
+        due = self._last_fsync is None or now - self._last_fsync >= self._fsync_interval
+        if self._unsynced and due:
+            os.fsync(self._file.fileno())
+            self._unsynced = False
+            self._last_fsync = now
+        if not self._unsynced:
+            self._durableIndex = self.log.lastLogIndex
+
+    def close(self) -> None:
+        if self._pending:
+            self._file.write(self._pending)
+        self._file.flush()
+        if self._fsync_interval is not None:
+            os.fsync(self._file.fileno())
+        self._file.close()
+
+    def _append(self, entry: Entry) -> None:
+        record = _encode_entry(entry)
+        self._pending += record
+        self._offsets.append(self._size)
+        self._size += len(record)
+
+    def _truncate_from(self, index: int) -> None:
+        """cut the segment back to just before the (1-based) index"""
+        position = index - self.log.snapshot.lastIncludedIndex - 1
+        self._size = self._offsets[position]
+        del self._offsets[position:]
+        self._durableIndex = min(self._durableIndex, index - 1)
+        if self._size >= self._written:
+            del self._pending[self._size - self._written:]
+            return
+        self._pending.clear()
+        self._file.truncate(self._size)
+        self._written = self._size
+        self._unsynced = True
+
+    def _replace_file(self, path: Path, data: Union[bytes, bytearray]) -> None:
+        tmp = path.with_name(path.name + '.tmp')
+        with open(tmp, 'wb') as f:
+            f.write(data)
+            f.flush()
+            if self._fsync_interval is not None:
+                os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def _save_snapshot(self, snapshot: Snapshot) -> None:
+        self._replace_file(self.snapshot_path, _encode_snapshot(snapshot))
+
+    def _rewrite_segment(self) -> None:
+        """
+        replace the segment with a base record and the entries after the
+        snapshot.  this costs as much as the entries kept, which compaction
+        keeps small.
+        """
+        self._file.close()
+        base = self.log.snapshot.lastIncludedIndex
+        segment = bytearray(_encode_record(_BASE, _INDEX.pack(base)))
+        self._offsets = array('Q')
+        for entry in self.log.read():
+            self._offsets.append(len(segment))
+            segment += _encode_entry(entry)
+        self._replace_file(self.path, segment)
+        self._file = open(self.path, 'ab')
+        self._size = self._written = len(segment)
+        self._pending.clear()
+        self._unsynced = False
+        self._durableIndex = self.log.lastLogIndex
@@ -3,14 +3,26 @@ import sys
 import time
 from typing import Tuple
 from raft.log import InMemoryLog
-from raft.adapters.network import RaftNetwork, TCPRaftNet
+from raft.adapters.network import AsyncRaftNet, RaftNetwork, TCPRaftNet, WaitableRaftNetwork
 from raft.server import Server, Follower
+from raft.state_machine import KeyValueStore, ThreadedApplier
 
-def run_tcp_server(server: Server, raftnet: RaftNetwork):
+def run_tcp_server(server: Server, raftnet: WaitableRaftNetwork):
     print(f'Starting server {server.name}')
     while True:
         clock_tick(server, raftnet, time.time())
-        time.sleep(0.01)
+        # sleep until there's a message to handle, or a timer to see to
+        raftnet.wait_for_messages(timeout=_time_until(server.next_deadline()))
+
+async def run_async_server(server: Server, raftnet: AsyncRaftNet):
+    """run_tcp_server, as a task on the event loop raftnet runs on"""
+    print(f'Starting server {server.name}')
+    while True:
+        clock_tick(server, raftnet, time.time())
+        await raftnet.wait_for_messages(timeout=_time_until(server.next_deadline()))
+
+def _time_until(deadline: float) -> float:
+    return max(deadline - time.time(), 0.0)
 
 def clock_tick(server: Server, raftnet: RaftNetwork, now: float):
     server.clock_tick(now=now)  # am expecting this to handle timeouts, heartbeats, etc
@@ -18,6 +30,8 @@ def clock_tick(server: Server, raftnet: RaftNetwork, now: float):
     for m in raftnet.get_messages(server.name):
         server.handle_message(m)
 
+    server.flush()  # one log write (and fsync) for everything this tick
+
     while server.outbox:
         m = server.outbox.pop(0)
         raftnet.dispatch(m)
@@ -28,7 +42,8 @@ def _main(name: str) -> Tuple[Server, RaftNetwork]:
     raftnet = TCPRaftNet(name)
     raftnet.start()
     server = Follower(
-        name=name, log=InMemoryLog([]), currentTerm=0, votedFor=None
+        name=name, peers=list(TCPRaftNet.SERVERS), now=time.time(), log=InMemoryLog([]),
+        currentTerm=0, votedFor=None, applier=ThreadedApplier(KeyValueStore()),
     )
     import threading
     threading.Thread(target=run_tcp_server, args=(server, raftnet), daemon=True).start()
@@ -1,5 +1,9 @@
+import os
+import struct
 import time
-from socket import socket
+from dataclasses import dataclass
+from socket import socket, IPPROTO_TCP, SOL_SOCKET, SO_RCVBUF, SO_SNDBUF, TCP_NODELAY
+from typing import List, Optional, Sequence, Union
 from colorama import Style
 
 class ConnectionClosed(ConnectionError):
@@ -10,29 +14,164 @@ def _log(msg: str) -> None:
     print(f'{Style.DIM}[transport] {msg}{Style.RESET_ALL}')
 
 HOST = '127.0.0.1'
+# every message goes out prefixed by its size, as a big-endian u32
+_LENGTH = struct.Struct('>I')
+HEADER_SIZE = _LENGTH.size
+# anything bigger is a peer that's confused (or not a peer at all)
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+RECV_BUFFER_SIZE = 64 * 1024
+
+
+def frame(msg: bytes) -> bytes:
+    return _LENGTH.pack(len(msg)) + msg
+
+
+def frame_size(header: Union[bytes, bytearray, memoryview]) -> int:
+    """the size of the message that follows a HEADER_SIZE header"""
+    size = int(_LENGTH.unpack_from(header)[0])
+    if size > MAX_FRAME_SIZE:
+        raise ConnectionError(f'frame of {size} bytes is over the {MAX_FRAME_SIZE} byte limit')
+    return size
+
+
+def frame_buffers(msgs: Sequence[bytes]) -> List[bytes]:
+    """msgs framed, as a header and then the message itself for each, uncopied"""
+    buffers = []
+    for msg in msgs:
+        buffers.append(_LENGTH.pack(len(msg)))
+        buffers.append(msg)
+    return buffers
+
 
 def send_message(sock: socket, msg: bytes) -> None:
-    size_prefix = b'%12d' % len(msg)
-    sock.sendall(size_prefix + msg)
-
-
-def _recv_exactly(sock: socket, num_bytes: int) -> bytes:
-    # Receive exactly a requested number of bytes on a socket
-    msg = b''
-    while num_bytes:
-        part = sock.recv(num_bytes)  # No guarantee we get the complete message
-        if part == b'':
-            raise EOFError(f'Client disconnected with partial message {msg!r}')
-        msg += part
-        num_bytes -= len(part)
+    sock.sendall(frame(msg))
+
+
+# how many buffers one sendmsg call can take
+MAX_SEND_BUFFERS = os.sysconf('SC_IOV_MAX') if hasattr(os, 'sysconf') else 1024
+
+
+def send_messages(sock: socket, msgs: Sequence[bytes]) -> None:
+    """
+    send msgs, framed, gathering them into as few sendmsg calls as the
+    socket will take them in, rather than a sendall each
+    """
+    if len(msgs) == 1:
+        # cheaper to copy one message behind its header than to gather it
+        send_message(sock, msgs[0])
+        return
+    # a partly sent buffer is replaced with a view of the rest of it
+    buffers = list(frame_buffers(msgs))  # type: List[Union[bytes, memoryview]]
+    first = 0
+    while first < len(buffers):
+        sent = sock.sendmsg(buffers[first:first + MAX_SEND_BUFFERS])
+        # skip over what's gone, which may end part way through a buffer
+        while first < len(buffers) and sent >= len(buffers[first]):
+            sent -= len(buffers[first])
+            first += 1
+        if sent:
+            buffers[first] = memoryview(buffers[first])[sent:]
+
+
+def _recv_exactly(sock: socket, num_bytes: int) -> bytearray:
+    # Receive exactly a requested number of bytes on a socket, straight into
+    # the bytearray that's returned
+    msg = bytearray(num_bytes)
+    view = memoryview(msg)
+    received = 0
+    while received < num_bytes:
+        part = sock.recv_into(view[received:])  # No guarantee we get the complete message
+        if part == 0:
+            raise EOFError(f'Client disconnected with partial message {bytes(view[:received])!r}')
+        received += part
     return msg
 
-def recv_message(sock: socket) -> bytes:
+def recv_message(sock: socket) -> bytearray:
     try:
-        expected_size = int(_recv_exactly(sock, 12))
+        expected_size = frame_size(_recv_exactly(sock, HEADER_SIZE))
+        return _recv_exactly(sock, expected_size)
     except EOFError:
         raise ConnectionClosed('Client disconnected')
-    return _recv_exactly(sock, expected_size)
+
+
+class FrameReader:
+    """
+    reads frames off a socket into one buffer that's reused from read to
+    read: each recv_into takes as much as the socket has, and every whole
+    frame that's arrived is handed back at once, as a view onto the buffer.
+    what's left of a partial frame moves down to the start of the buffer,
+    which grows if the frame won't fit in it.
+    """
+
+    def __init__(self, sock: socket, buffer_size: int = RECV_BUFFER_SIZE) -> None:
+        self._sock = sock
+        self._buffer = bytearray(buffer_size)
+        self._start = 0  # first byte not yet handed back
+        self._end = 0  # end of what's been received
+
+    def read_frames(self) -> List[memoryview]:
+        """
+        block until at least one whole frame has arrived, then return all of
+        them.  they're only good until the next call, which may overwrite them
+        """
+        while True:
+            frames = self._whole_frames()
+            if frames:
+                return frames
+            self._make_room()
+            received = self._sock.recv_into(memoryview(self._buffer)[self._end:])
+            if received == 0:
+                raise ConnectionClosed('Client disconnected')
+            self._end += received
+
+    def _whole_frames(self) -> List[memoryview]:
+        view = memoryview(self._buffer)
+        frames = []
+        while self._end - self._start >= HEADER_SIZE:
+            begin = self._start + HEADER_SIZE
+            end = begin + frame_size(view[self._start:begin])
+            if end > self._end:
+                break
+            frames.append(view[begin:end])
+            self._start = end
+        return frames
+
+    def _make_room(self) -> None:
+        """move any partial frame to the front, in a bigger buffer if it needs one"""
+        pending = self._end - self._start
+        needed = len(self._buffer)
+        if pending >= HEADER_SIZE:
+            header = memoryview(self._buffer)[self._start:self._start + HEADER_SIZE]
+            needed = max(needed, HEADER_SIZE + frame_size(header))
+        if needed > len(self._buffer):
+            # a new buffer, rather than resizing this one, which views of the
+            # frames last handed back may still be holding on to
+            buffer = bytearray(needed)
+            buffer[:pending] = self._buffer[self._start:self._end]
+            self._buffer = buffer
+        elif self._start:
+            self._buffer[:pending] = self._buffer[self._start:self._end]
+        self._start, self._end = 0, pending
+
+
+@dataclass(frozen=True)
+class SocketOptions:
+    """
+    what to set on every connection.  nodelay turns Nagle's algorithm off, so
+    a lone heartbeat or ack goes out straight away instead of waiting on the
+    ack for the last one; senders coalesce their own writes.  buffer sizes
+    are left to the kernel unless given
+    """
+    nodelay: bool = True
+    send_buffer: Optional[int] = None
+    recv_buffer: Optional[int] = None
+
+    def apply(self, sock: socket) -> None:
+        sock.setsockopt(IPPROTO_TCP, TCP_NODELAY, self.nodelay)
+        if self.send_buffer is not None:
+            sock.setsockopt(SOL_SOCKET, SO_SNDBUF, self.send_buffer)
+        if self.recv_buffer is not None:
+            sock.setsockopt(SOL_SOCKET, SO_RCVBUF, self.recv_buffer)
 
 
 def connect_tenaciously(s: socket, port: int, host: str = HOST) -> socket:
@@ -1,11 +1,37 @@
-from typing import List, Protocol
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Protocol
 from dataclasses import dataclass
 
 
+@dataclass
+class Session:
+    """
+    which client sent a command, its number for it, and the leader's clock
+    when it arrived, so that all servers expire sessions at the same point
+    in the log
+    """
+    clientId: str
+    seq: int
+    timestamp: float
+
+
 @dataclass
 class Entry:
     term: int
     cmd: str
+    session: Optional[Session] = None
+
+
+@dataclass
+class Snapshot:
+    """state machine state as of lastIncludedIndex, which replaces the log up to there"""
+    lastIncludedIndex: int
+    lastIncludedTerm: int
+    data: bytes
+
+
+NO_SNAPSHOT = Snapshot(lastIncludedIndex=0, lastIncludedTerm=0, data=b'')
 
 
 class Log(Protocol):
@@ -21,11 +47,22 @@ class Log(Protocol):
         ...
 
     def entry_term(self, index: int) -> int:
-        """term of entry at (1-based) index position"""
+        """
+        term of entry at (1-based) index position.  the last index covered by
+        the snapshot has the snapshot's term; anything before it is gone.
+        """
         ...
 
     def entry_at(self, index: int) -> Entry:
-        """Entry at (1-based) index position"""
+        """Entry at (1-based) index position, which must be after the snapshot"""
+        ...
+
+    def first_index_of_term(self, term: int) -> int:
+        """1-based index of the first entry with this term, or 0 if there isn't one"""
+        ...
+
+    def last_index_of_term(self, term: int) -> int:
+        """1-based index of the last entry with this term, or 0 if there isn't one"""
         ...
 
     def check_log(self, prevLogIndex: int, prevLogTerm: int) -> bool:
@@ -40,48 +77,162 @@ class Log(Protocol):
     ) -> bool:
         ...
 
+    def append_entries(
+        self,
+        prevLogIndex: int,
+        prevLogTerm: int,
+        entries: List[Entry],
+    ) -> bool:
+        """
+        add a batch of entries after (1-based) prevLogIndex, if prevLogIndex and
+        prevLogTerm match.  entries already present are left alone, and the log
+        is only truncated from the first one that conflicts.
+        """
+        ...
+
     def read(self) -> List[Entry]:
+        """the entries after the snapshot"""
+        ...
+
+    @property
+    def snapshot(self) -> Snapshot:
+        """the latest snapshot, which covers every entry up to its lastIncludedIndex"""
+        ...
+
+    def compact(self, snapshot: Snapshot) -> None:
+        """
+        discard entries up to and including the snapshot's lastIncludedIndex,
+        which must be in the log, and keep the snapshot in their place.
+        """
+        ...
+
+    def install_snapshot(self, snapshot: Snapshot) -> None:
+        """
+        take a snapshot from the leader.  if we have its last entry, the
+        entries after it are kept; otherwise the whole log is replaced.
+        snapshots older than the one we have are ignored.
+        """
+        ...
+
+    @property
+    def durableIndex(self) -> int:
+        """1-based index of the latest entry that would survive a crash"""
+        ...
+
+    def sync(self, now: float) -> None:
+        """make everything added so far durable, as far as the log's policy goes"""
+        ...
+
+
+class EntryStore(Protocol):
+    """what InMemoryLog keeps its entries in: a list, or PackedEntries"""
+
+    def __len__(self) -> int:
+        ...
+
+    def __iter__(self) -> Iterator[Entry]:
+        ...
+
+    def __getitem__(self, i: int) -> Entry:
+        ...
+
+    def __delitem__(self, key: slice) -> None:
+        ...
+
+    def append(self, entry: Entry) -> None:
         ...
 
 
 class InMemoryLog:
 
-    def __init__(self, log: List[Entry]) -> None:
-        self._log = log
+    def __init__(self, log: List[Entry], snapshot: Optional[Snapshot] = None) -> None:
+        self._snapshot = snapshot or NO_SNAPSHOT
+        # entries after the snapshot; the first one is at index _base + 1
+        self._base = self._snapshot.lastIncludedIndex
+        self._log = []  # type: EntryStore
+        # term boundaries: each run of entries with the same term, as its term
+        # and the 1-based index it starts at.  terms only go up along a log.
+        self._run_terms = []  # type: List[int]
+        self._run_starts = []  # type: List[int]
+        self._extend(log)
 
     def _has_entry_at(self, index: int) -> bool:
         """1-based"""
-        return 0 < index <= len(self._log)
+        return self._base < index <= self.lastLogIndex
+
+    def _truncate(self, length: int) -> None:
+        """keep entries up to (1-based) index length"""
+        del self._log[length - self._base:]
+        while self._run_starts and self._run_starts[-1] > length:
+            self._run_starts.pop()
+            self._run_terms.pop()
+
+    def _extend(self, entries: List[Entry]) -> None:
+        for entry in entries:
+            self._log.append(entry)
+            if not self._run_terms or self._run_terms[-1] != entry.term:
+                self._run_terms.append(entry.term)
+                self._run_starts.append(self.lastLogIndex)
 
-    def _replace_at(self, index: int, entry: Entry) -> None:
-        """1-based index. truncates any after, unless entry matches"""
-        if self._has_entry_at(index) and self.entry_at(index) == entry:
+    def _discard_up_to(self, index: int) -> None:
+        """drop entries up to and including (1-based) index from the front"""
+        del self._log[:index - self._base]
+        self._base = index
+        if not self._log:
+            del self._run_terms[:], self._run_starts[:]
             return
-        self._log = self._log[:index - 1] + [entry]
+        # the run holding the new first entry now starts with it
+        run = bisect_right(self._run_starts, index + 1) - 1
+        del self._run_terms[:run], self._run_starts[:run]
+        self._run_starts[0] = index + 1
+
+    def _run_of(self, term: int) -> int:
+        """position of term's run in the term boundaries, or -1"""
+        run = bisect_left(self._run_terms, term)
+        if run < len(self._run_terms) and self._run_terms[run] == term:
+            return run
+        return -1
 
     @property
     def lastLogIndex(self) -> int:
-        return len(self._log)
+        return self._base + len(self._log)
 
     @property
     def last_log_term(self) -> int:
         if len(self._log) == 0:
-            return 0
-        return self.entry_term(self.lastLogIndex)
+            return self._snapshot.lastIncludedTerm
+        return self._log[-1].term
 
     def entry_term(self, index: int) -> int:
         if index == 0:
             return 0
+        if index == self._base:
+            return self._snapshot.lastIncludedTerm
         return self.entry_at(index).term
 
     def entry_at(self, index: int) -> Entry:
         if index < 0:
             return self._log[index]
-        return self._log[index - 1]
+        if index <= self._base:
+            raise IndexError(f'entry {index} is in the snapshot')
+        return self._log[index - self._base - 1]
+
+    def first_index_of_term(self, term: int) -> int:
+        run = self._run_of(term)
+        return self._run_starts[run] if run >= 0 else 0
+
+    def last_index_of_term(self, term: int) -> int:
+        run = self._run_of(term)
+        if run < 0:
+            return 0
+        if run + 1 < len(self._run_starts):
+            return self._run_starts[run + 1] - 1
+        return self.lastLogIndex
 
     def check_log(self, prevLogIndex: int, prevLogTerm: int) -> bool:
         """check whether prevLogIndex and prevLogTerm match.  1-based index"""
-        if prevLogIndex == 0:
+        if prevLogIndex <= self._base:
+            # everything in the snapshot was committed, so it matches any leader
             return True
         if not self._has_entry_at(prevLogIndex):
             print(f'nope, no entry at {prevLogIndex}')
@@ -97,12 +248,157 @@ class InMemoryLog:
         prevLogIndex: int,  # 1-based
         prevLogTerm: int,
         leaderCommit: int,  # 1-based, ignored for now.  # TODO: remove?
+    ) -> bool:
+        return self.append_entries(prevLogIndex, prevLogTerm, [entry])
+
+    def append_entries(
+        self,
+        prevLogIndex: int,
+        prevLogTerm: int,
+        entries: List[Entry],
     ) -> bool:
         if not self.check_log(prevLogIndex, prevLogTerm):
             return False
-        self._replace_at(prevLogIndex + 1, entry)
+        # skip any that are already covered by the snapshot
+        skip = max(0, self._base - prevLogIndex)
+        index = prevLogIndex + skip + 1
+        for i, entry in enumerate(entries[skip:]):
+            if not self._has_entry_at(index + i) or self.entry_at(index + i) != entry:
+                self._truncate(index + i - 1)
+                self._extend(entries[skip + i:])
+                break
         return True
 
-
     def read(self) -> List[Entry]:
-        return self._log
+        return list(self._log)
+
+    @property
+    def snapshot(self) -> Snapshot:
+        return self._snapshot
+
+    def compact(self, snapshot: Snapshot) -> None:
+        assert self._base < snapshot.lastIncludedIndex <= self.lastLogIndex
+        self._discard_up_to(snapshot.lastIncludedIndex)
+        self._snapshot = snapshot
+
+    def install_snapshot(self, snapshot: Snapshot) -> None:
+        if snapshot.lastIncludedIndex <= self._base:
+            return
+        if (
+            snapshot.lastIncludedIndex <= self.lastLogIndex
+            and self.entry_term(snapshot.lastIncludedIndex) == snapshot.lastIncludedTerm
+        ):
+            self._discard_up_to(snapshot.lastIncludedIndex)
+        else:
+            self._truncate(self._base)
+            self._base = snapshot.lastIncludedIndex
+        self._snapshot = snapshot
+
+    @property
+    def durableIndex(self) -> int:
+        return self.lastLogIndex
+
+    def sync(self, now: float) -> None:
+        pass
+
+
+class PackedEntries:
+    """
+    list-like store of entries, packed into arrays rather than kept as Entry
+    objects: terms in one array, every cmd's utf-8 bytes in one buffer, and
+    where each cmd ends in another.  indexing builds the Entry on demand.
+    only a prefix or a suffix can be deleted, which is all a log needs.
+    sessions are rarer, so live in a dict keyed by position counting from
+    the first entry ever appended.
+    """
+
+    def __init__(self, entries: Iterable[Entry] = ()) -> None:
+        self._terms = array('q')
+        self._ends = array('Q')
+        self._cmds = bytearray()
+        self._deleted = 0  # entries deleted from the front
+        self._sessions = {}  # type: Dict[int, Session]
+        for entry in entries:
+            self.append(entry)
+
+    def __len__(self) -> int:
+        return len(self._terms)
+
+    def _start_of(self, i: int) -> int:
+        return self._ends[i - 1] if i else 0
+
+    def __getitem__(self, i: int) -> Entry:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        cmd = self._cmds[self._start_of(i):self._ends[i]].decode()
+        return Entry(term=self._terms[i], cmd=cmd, session=self._sessions.get(self._deleted + i))
+
+    def __iter__(self) -> Iterator[Entry]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def term_at(self, i: int) -> int:
+        return self._terms[i]
+
+    def append(self, entry: Entry) -> None:
+        if entry.session is not None:
+            self._sessions[self._deleted + len(self)] = entry.session
+        self._cmds += entry.cmd.encode()
+        self._terms.append(entry.term)
+        self._ends.append(len(self._cmds))
+
+    def __delitem__(self, key: slice) -> None:
+        start, stop, _ = key.indices(len(self))
+        if start >= stop:
+            return
+        if stop == len(self):
+            del self._cmds[self._start_of(start):]
+            del self._terms[start:], self._ends[start:]
+            self._drop_sessions(lambda i: i >= self._deleted + start)
+        elif start == 0:
+            cut = self._ends[stop - 1]
+            del self._cmds[:cut]
+            del self._terms[:stop]
+            self._ends = array('Q', (end - cut for end in self._ends[stop:]))
+            self._deleted += stop
+            self._drop_sessions(lambda i: i < self._deleted)
+        else:
+            raise ValueError('can only delete a prefix or a suffix')
+
+    def _drop_sessions(self, dropped: Callable[[int], bool]) -> None:
+        if self._sessions:
+            self._sessions = {i: s for i, s in self._sessions.items() if not dropped(i)}
+
+
+class PackedLog(InMemoryLog):
+    """
+    InMemoryLog over PackedEntries, for big logs: an entry costs its cmd's
+    bytes plus 16, rather than a few hundred for an Entry and its str.
+    entry_term() reads the term array directly, but anything returning
+    Entry objects has to build them, so read() is O(n).
+    """
+
+    def __init__(self, log: List[Entry], snapshot: Optional[Snapshot] = None) -> None:
+        super().__init__([], snapshot)
+        self._entries = PackedEntries()
+        self._log = self._entries
+        self._extend(log)
+
+    @property
+    def last_log_term(self) -> int:
+        if len(self._log) == 0:
+            return self._snapshot.lastIncludedTerm
+        return self._entries.term_at(-1)
+
+    def entry_term(self, index: int) -> int:
+        if index == 0:
+            return 0
+        if index == self._base:
+            return self._snapshot.lastIncludedTerm
+        if index < 0:
+            return self._entries.term_at(index)
+        if not self._has_entry_at(index):
+            raise IndexError(index)
+        return self._entries.term_at(index - self._base - 1)
@@ -1,5 +1,5 @@
 from dataclasses import dataclass
-from typing import List, Union
+from typing import List, Optional, Union
 from raft.log import Entry
 
 
@@ -7,6 +7,10 @@ from raft.log import Entry
 class ClientSetCommand:
     guid: str
     cmd: str
+    # clients that may retry number their commands 1, 2, 3..., so a retry of
+    # one that's already been applied isn't applied again
+    clientId: Optional[str] = None
+    seq: int = 0
 
 
 @dataclass
@@ -14,6 +18,29 @@ class ClientSetSucceeded:
     guid: str
 
 
+@dataclass
+class ClientGetCommand:
+    guid: str
+    key: str
+    # a follower may answer from its own state machine, without checking
+    # with the leader, if it has heard from the leader this recently
+    max_staleness: Optional[float] = None
+
+
+@dataclass
+class ClientGetSucceeded:
+    guid: str
+    value: Optional[str]
+
+
+@dataclass
+class ClientRedirect:
+    # we aren't (or are no longer) the leader, so the command may not have
+    # been applied; try again with the leader, if we know who that is
+    guid: str
+    leaderHint: Optional[str]
+
+
 @dataclass
 class AppendEntries:
     term: int
@@ -22,16 +49,74 @@ class AppendEntries:
     prevLogTerm: int
     entries: List[Entry]
     leaderCommit: int
+    # echoed back in the response, so the leader can tell which of its
+    # rounds of AppendEntries a follower has answered
+    seq: int = 0
+    # the election timeout the leader has picked for the network it's
+    # measured, for followers to use; 0 leaves theirs alone
+    electionTimeout: float = 0.0
+    # the leader has nothing to do, and will only send heartbeats every
+    # QUIESCENT_HEARTBEAT_INTERVAL until it does, so wait longer to hear from it
+    quiescent: bool = False
 
 
 @dataclass
 class AppendEntriesSucceeded:
     matchIndex: int
+    seq: int = 0
 
 
 @dataclass
 class AppendEntriesFailed:
     term: int
+    # where the follower's log stops matching prevLogIndex / prevLogTerm: the
+    # term it has at prevLogIndex and the first index of that term, or if its
+    # log is too short, conflictTerm=0 and conflictIndex=lastLogIndex + 1
+    conflictTerm: int
+    conflictIndex: int
+    seq: int = 0
+
+
+@dataclass
+class InstallSnapshot:
+    term: int
+    leaderId: str
+    lastIncludedIndex: int
+    lastIncludedTerm: int
+    # this chunk's byte offset in the snapshot data, and whether it's the last
+    offset: int
+    data: bytes
+    done: bool
+
+
+@dataclass
+class InstallSnapshotSucceeded:
+    term: int
+    lastIncludedIndex: int
+    # how many bytes of the snapshot the follower has, and whether it's installed
+    offset: int
+    done: bool
+
+
+@dataclass
+class InstallSnapshotFailed:
+    # a chunk from a leader whose term is over.  ours, so it can step down
+    term: int
+
+
+@dataclass
+class ReadIndexRequest:
+    # a follower asking the leader what's committed, so it can answer reads
+    term: int
+    readId: int
+
+
+@dataclass
+class ReadIndexReply:
+    # the follower can answer its reads once it has applied up to readIndex
+    term: int
+    readId: int
+    readIndex: int
 
 
 @dataclass
@@ -52,16 +137,48 @@ class VoteDenied:
     term: int
 
 
+@dataclass
+class PreVote:
+    # would we get your vote if we stood in proposedTerm?  nobody's term
+    # changes, so a server that can't win can't disrupt anything by asking
+    proposedTerm: int
+    candidateId: str
+    lastLogIndex: int
+    lastLogTerm: int
+
+
+@dataclass
+class PreVoteGranted:
+    proposedTerm: int
+
+
+@dataclass
+class PreVoteDenied:
+    term: int
+
+
 @dataclass
 class Message:
     frm: str
     to: str
     cmd: Union[
         ClientSetCommand,
+        ClientSetSucceeded,
+        ClientGetCommand,
+        ClientGetSucceeded,
+        ClientRedirect,
         AppendEntries,
         AppendEntriesSucceeded,
         AppendEntriesFailed,
+        InstallSnapshot,
+        InstallSnapshotSucceeded,
+        InstallSnapshotFailed,
+        ReadIndexRequest,
+        ReadIndexReply,
         RequestVote,
         VoteGranted,
         VoteDenied,
+        PreVote,
+        PreVoteGranted,
+        PreVoteDenied,
     ]
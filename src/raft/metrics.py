@@ -0,0 +1,50 @@
+import math
+from typing import Dict, List
+
+BUCKETS_PER_DOUBLING = 4
+DOUBLINGS = 40  # 1us up to about 12 days
+
+
+class LatencyHistogram:
+    """
+    latencies, counted in log-spaced buckets: four per doubling from 1us
+    upwards.  percentiles come back as the top of their bucket, so they're
+    at most about 19% high.
+    """
+
+    def __init__(self) -> None:
+        self.counts = [0] * (BUCKETS_PER_DOUBLING * DOUBLINGS)  # type: List[int]
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float) -> None:
+        micros = max(seconds * 1e6, 1.0)
+        bucket = min(int(math.log2(micros) * BUCKETS_PER_DOUBLING), len(self.counts) - 1)
+        self.counts[bucket] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, p: float) -> float:
+        """the latency (in seconds) that p percent of those recorded were within"""
+        if not self.count:
+            return 0.0
+        wanted = math.ceil(self.count * p / 100)
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= max(wanted, 1):
+                top = 2 ** ((bucket + 1) / BUCKETS_PER_DOUBLING) / 1e6
+                return min(top, self.max)
+        return self.max
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.0,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'max': self.max,
+        }
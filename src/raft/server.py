@@ -1,21 +1,87 @@
 import random
-from typing import Dict, List, Optional
-from raft.log import Log, Entry
+from bisect import bisect_left, insort
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, List, Optional, Set, Tuple
+from raft.log import Log, Entry, Session, Snapshot
+from raft.metrics import LatencyHistogram
+from raft.state_machine import Applier, InlineApplier, KeyValueStore
 from raft.messages import (
     Message,
     AppendEntries,
     AppendEntriesSucceeded,
     AppendEntriesFailed,
+    InstallSnapshot,
+    InstallSnapshotSucceeded,
+    InstallSnapshotFailed,
     ClientSetCommand,
     ClientSetSucceeded,
+    ClientGetCommand,
+    ClientGetSucceeded,
+    ClientRedirect,
+    ReadIndexRequest,
+    ReadIndexReply,
     RequestVote,
     VoteGranted,
     VoteDenied,
+    PreVote,
+    PreVoteGranted,
+    PreVoteDenied,
 )
 
 HEARTBEAT_FREQUENCY = 0.02
 MIN_ELECTION_TIMEOUT = 0.15
 ELECTION_TIMEOUT_JITTER = 0.15
+MAX_ENTRIES_PER_APPEND = 64
+MAX_BYTES_PER_APPEND = 64 * 1024
+MAX_INFLIGHT_APPENDS = 8
+REPLICATION_TIMEOUT = 0.1
+SNAPSHOT_THRESHOLD = 10_000
+PROPOSAL_BATCH_SIZE = 256
+PROPOSAL_MAX_DELAY = 0.0
+# how far apart two servers' clocks can drift over one election timeout.  a
+# leader's lease is MIN_ELECTION_TIMEOUT less this, counted from when it sent
+# the heartbeats a majority have answered
+MAX_CLOCK_DRIFT = 0.01
+# with check_quorum, a leader steps down if it hasn't heard from a majority
+# for this long, by when they could all have timed out and started an election
+CHECK_QUORUM_TIMEOUT = MIN_ELECTION_TIMEOUT + ELECTION_TIMEOUT_JITTER
+# adaptive timeouts: the election timeout is this many times the p99 round
+# trip to the slowest follower, over its last RTT_SAMPLES heartbeats
+RTT_MULTIPLIER = 10
+RTT_SAMPLES = 100
+# quiescence: a leader with nothing to do only heartbeats this often, and its
+# followers wait this long to hear from it before standing themselves
+QUIESCENT_HEARTBEAT_INTERVAL = 0.5
+QUIESCENT_ELECTION_TIMEOUT = 3.0
+# how soon to tick again while waiting for the log to become durable or the
+# applier to catch up, neither of which tell us when they have
+BUSY_POLL_INTERVAL = 0.001
+
+
+class MatchIndexes(Dict[str, int]):
+    """
+    the leader's matchIndex for each follower, which also keeps the indexes
+    in sorted order, so finding how far a quorum has got takes a lookup
+    rather than a scan of every follower.
+    """
+
+    def __init__(self, followers: List[str]):
+        super().__init__((f, 0) for f in followers)
+        self._sorted = [0] * len(self)
+
+    def __setitem__(self, follower: str, index: int) -> None:
+        if follower in self:
+            del self._sorted[bisect_left(self._sorted, self[follower])]
+        super().__setitem__(follower, index)
+        insort(self._sorted, index)
+
+    def clear(self) -> None:
+        super().clear()
+        self._sorted.clear()
+
+    def nth_highest(self, n: int) -> int:
+        """the nth highest (1-based) matchIndex, or 0 if there aren't n followers"""
+        return self._sorted[-n] if 0 < n <= len(self._sorted) else 0
 
 
 class Server:
@@ -27,13 +93,110 @@ class Server:
         log: Log,
         currentTerm: int,
         votedFor: Optional[str],
+        max_entries: int = MAX_ENTRIES_PER_APPEND,
+        max_bytes: int = MAX_BYTES_PER_APPEND,
+        max_inflight: int = MAX_INFLIGHT_APPENDS,
+        snapshot_threshold: int = SNAPSHOT_THRESHOLD,
+        applier: Optional[Applier] = None,
+        batch_size: int = PROPOSAL_BATCH_SIZE,
+        max_batch_delay: float = PROPOSAL_MAX_DELAY,
+        lease_reads: bool = False,
+        forward_client_commands: bool = True,
+        pre_vote: bool = True,
+        check_quorum: bool = True,
+        min_election_timeout: float = MIN_ELECTION_TIMEOUT,
+        max_election_timeout: Optional[float] = None,
+        quiesce: bool = False,
     ):
         self.name = name
         self.peers = peers
         self.now = now
+        # budget for the entries in a single AppendEntries
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # how many unacknowledged AppendEntries a follower can have in flight
+        self.max_inflight = max_inflight
+        # a leader buffers client commands, and appends and replicates them
+        # together once batch_size are waiting, or once the oldest has waited
+        # max_batch_delay (checked at the end of each tick)
+        self.batch_size = batch_size
+        self.max_batch_delay = max_batch_delay
+        self._proposals = []  # type: List[Tuple[str, ClientSetCommand, float]]
+        self._proposed_at = 0  # type: float
+        # the election timeout adapts to the network, between these bounds:
+        # the leader measures round trips to its followers, picks a timeout
+        # from them, and sends it out with its AppendEntries.  the election
+        # timeout jitter and the heartbeat interval scale along with it.
+        # by default both bounds are MIN_ELECTION_TIMEOUT, which pins them
+        self.min_election_timeout = min_election_timeout
+        self.max_election_timeout = max(max_election_timeout or 0.0, min_election_timeout)
+        self._set_election_timeout(MIN_ELECTION_TIMEOUT)
+        # quiesce: once everything has been committed, applied and on every
+        # follower for an election timeout, a leader says it's going quiet and stretches its heartbeats out to
+        # QUIESCENT_HEARTBEAT_INTERVAL, until there's something to do again.
+        # its followers give it QUIESCENT_ELECTION_TIMEOUT meanwhile, so
+        # losing a quiet leader takes that much longer to notice.  _quiescent
+        # is whether the leader (us, or the one we follow) is quiet right now
+        self.quiesce = quiesce
+        self._quiescent = False
+        # lease reads: a leader answers reads on its own while a majority have
+        # heard from it within the last min_election_timeout - MAX_CLOCK_DRIFT,
+        # as none of them will help elect anyone else until that's up.  this
+        # is only safe if every server in the cluster has lease_reads set (so
+        # they ignore RequestVote for that long), and clocks drift no more
+        # than MAX_CLOCK_DRIFT.  off by default, in which case every read
+        # waits for a round of heartbeats
+        self.lease_reads = lease_reads
+        self._leader_seen_at = float("-inf")
+        # who we last heard from as leader, if anyone
+        self.leaderId = None  # type: Optional[str]
+        # a follower passes client commands on to the leader, and its answer
+        # back, keeping who sent each (by guid) until then.  otherwise, or if
+        # it doesn't know the leader, it redirects the client
+        self.forward_client_commands = forward_client_commands
+        self._forwarded = {}  # type: Dict[str, str]
+        # a follower whose election timeout runs out first asks for pre-votes:
+        # whether the others would vote for it, were it to stand.  they say no
+        # if they've heard from a leader recently, so a server that's been
+        # cut off can't force out a working leader by bumping the term when
+        # it's back.  it only becomes a candidate once a majority say yes
+        self.pre_vote = pre_vote
+        self._pre_votes = set()  # type: Set[str]
+        self.check_quorum = check_quorum
+        # reads that arrived this tick.  a follower asks the leader for a read
+        # index for them all at once, and keeps them by the id it asked with,
+        # along with when it asked and the read index once it knows it
+        self._new_reads = []  # type: List[Tuple[str, Any, float]]
+        self._read_id = 0
+        self._asked_reads = (
+            {}
+        )  # type: Dict[int, Tuple[float, Optional[int], List[Tuple[str, Any, float]]]]
+        # the seq of a leader's latest ReadIndex round (see
+        # _setup_follower_tracking_indexes).  acks don't say which term
+        # they're from, so it carries on across terms rather than starting
+        # again: a late ack to an earlier leadership's round can then never
+        # pass for an ack to one of ours
+        self._read_seq = 0
+        # client commands in the log that we'll reply to once they're applied:
+        # their index, who sent them, their guid, and when we got them
+        self._pending = deque()  # type: Deque[Tuple[int, str, str, float]]
+        # time from receiving a client command to replying that it's applied
+        self.commit_latency = LatencyHistogram()
+        # and from receiving a read to answering it
+        self.read_latency = LatencyHistogram()
+        # take a snapshot once this many applied entries have built up in the log
+        self.snapshot_threshold = snapshot_threshold
+        # applies committed entries to the state machine; by default straight
+        # away, to a key-value store
+        self.applier = applier or InlineApplier(KeyValueStore())  # type: Applier
+        # (1-based) index of the last entry handed to the applier
+        self._queuedForApply = 0
         self._last_heartbeat = 0  # type: float
         self._reset_election_timeout()
         self.outbox = []  # type: List[Message]
+        self._awaiting_sync = []  # type: List[Tuple[int, Message]]
+        # snapshot being received from the leader: its lastIncludedIndex and data so far
+        self._incoming_snapshot = None  # type: Optional[Tuple[int, bytearray]]
 
         # Raft persistent state
         self.log = log
@@ -42,32 +205,168 @@ class Server:
 
         # Raft volatile state
         self.commitIndex = 0
-        self.lastApplied = 0
+
+    @property
+    def lastApplied(self) -> int:
+        """to wait for an index to be applied, use applier.applied.wait_for()"""
+        return self.applier.applied.value
 
     def __repr__(self):
         return f"<{self.__class__.__name__}: term={self.currentTerm}, lastLogIndex={self.log.lastLogIndex}>"
 
+    def _set_election_timeout(self, timeout: float) -> None:
+        self.election_timeout = min(max(timeout, self.min_election_timeout), self.max_election_timeout)
+        scale = self.election_timeout / MIN_ELECTION_TIMEOUT
+        self.election_timeout_jitter = ELECTION_TIMEOUT_JITTER * scale
+        self.heartbeat_interval = HEARTBEAT_FREQUENCY * scale
+
     def _reset_election_timeout(self) -> None:
-        jitter = random.randint(0, int(ELECTION_TIMEOUT_JITTER * 1000)) / 1000.0
-        self._election_timeout = self.now + MIN_ELECTION_TIMEOUT + jitter
+        jitter = random.randint(0, round(self.election_timeout_jitter * 1000)) / 1000.0
+        self._election_timeout = self.now + self._leader_timeout() + jitter
+
+    def _leader_timeout(self) -> float:
+        """how long to go without hearing from the leader before standing ourselves"""
+        return QUIESCENT_ELECTION_TIMEOUT if self._quiescent else self.election_timeout
 
     def handle_message(self, msg: Message) -> None:
         print(f"{self.name} handling {msg}")
+        if isinstance(msg.cmd, RequestVote) and self._leader_may_hold_lease():
+            print(f"{self.name} ignoring vote request, we heard from a leader recently")
+            return
         if hasattr(msg.cmd, "term") and msg.cmd.term > self.currentTerm:
             self.currentTerm = msg.cmd.term
             self.votedFor = None
-            self._become_follower()
+            self._become_follower(leaderHint=getattr(msg.cmd, "leaderId", None))
         self._handle_message(msg)
 
+    def _leader_may_hold_lease(self) -> bool:
+        return self.lease_reads and self._heard_from_leader_recently()
+
+    def _heard_from_leader_recently(self) -> bool:
+        return self.now < self._leader_seen_at + self._leader_timeout()
+
+    def _log_is_up_to_date(self, lastLogIndex: int, lastLogTerm: int) -> bool:
+        """is a log ending at this index and term at least as up to date as ours?"""
+        if lastLogTerm < self.log.last_log_term:
+            return False
+        if lastLogIndex < self.log.lastLogIndex:
+            return False
+        return True
+
+    def _handle_PreVote(self, frm: str, cmd: PreVote) -> None:
+        grant = (
+            cmd.proposedTerm > self.currentTerm
+            and not self._heard_from_leader_recently()
+            and self._log_is_up_to_date(cmd.lastLogIndex, cmd.lastLogTerm)
+        )
+        if grant:
+            self.outbox.append(
+                Message(frm=self.name, to=frm, cmd=PreVoteGranted(proposedTerm=cmd.proposedTerm))
+            )
+        else:
+            self.outbox.append(Message(frm=self.name, to=frm, cmd=PreVoteDenied(term=self.currentTerm)))
+
     def _handle_message(self, msg: Message) -> None:
         raise NotImplementedError
 
     def clock_tick(self, now: float):
         raise NotImplementedError
 
-    def _become_follower(self) -> None:
+    def next_deadline(self) -> float:
+        """
+        when clock_tick next has something to do, unless a message arrives
+        first.  until then, a run loop can wait for messages
+        """
+        waiting = (
+            self.log.durableIndex < self.log.lastLogIndex
+            or self.lastApplied < self._queuedForApply
+            or self._queuedForApply < self.commitIndex  # the applier was full
+        )
+        return self.now + BUSY_POLL_INTERVAL if waiting else float("inf")
+
+    def flush(self) -> None:
+        """
+        end-of-tick work: group-commit everything appended to the log this
+        tick, then release any responses that were waiting for it, apply
+        whatever is now committed, and compact the log if it has grown past
+        the snapshot threshold.
+        """
+        self.log.sync(self.now)
+        still_waiting = []
+        for index, msg in self._awaiting_sync:
+            if index <= self.log.durableIndex:
+                self.outbox.append(msg)
+            else:
+                still_waiting.append((index, msg))
+        self._awaiting_sync = still_waiting
+        self._advance_commit_index()
+        self._apply_committed()
+        self._compact_log_if_needed()
+
+    def _advance_commit_index(self) -> None:
+        """followers learn commitIndex from the leader, so there's nothing to do"""
+
+    def _apply_committed(self) -> None:
+        """hand newly committed entries to the applier, as many as it will take"""
+        snapshot = self.log.snapshot
+        if snapshot.lastIncludedIndex > self._queuedForApply:
+            # the entries we need have been compacted away, so start from the snapshot
+            if not self.applier.offer_snapshot(snapshot):
+                return
+            self._queuedForApply = snapshot.lastIncludedIndex
+        while self._queuedForApply < self.commitIndex:
+            index = self._queuedForApply + 1
+            if not self.applier.offer(index, self.log.entry_at(index)):
+                break  # applier is busy; try again next tick
+            self._queuedForApply = index
+
+    def _compact_log_if_needed(self) -> None:
+        if self.lastApplied - self.log.snapshot.lastIncludedIndex < self.snapshot_threshold:
+            return
+        snapshot = self.applier.snapshot()
+        if snapshot is None:
+            return  # still being taken
+        index, data = snapshot
+        if index <= self.log.snapshot.lastIncludedIndex:
+            return  # taken before a newer snapshot was installed
+        print(f"{self.name} compacting log up to {index}")
+        self.log.compact(Snapshot(
+            lastIncludedIndex=index,
+            lastIncludedTerm=self.log.entry_term(index),
+            data=data,
+        ))
+
+    def _send_when_durable(self, index: int, msg: Message) -> None:
+        """send msg once the log is durable up to (1-based) index"""
+        if index <= self.log.durableIndex:
+            self.outbox.append(msg)
+        else:
+            self._awaiting_sync.append((index, msg))
+
+    def _become_follower(self, leaderHint: Optional[str] = None) -> None:
         print(f"** {self.name} is becoming a Follower **")
         self.__class__ = Follower
+        self.leaderId = leaderHint
+        self._quiescent = False
+        self._pre_votes.clear()
+        # the leader we asked about these may be gone
+        self._redirect_clients([], leaderHint)
+
+    def _redirect_clients(self, reads: List[Tuple[str, Any, float]], leaderHint: Optional[str]) -> None:
+        """
+        send clients waiting on us elsewhere: for these reads, and for any
+        reads and commands we passed on to the leader
+        """
+        for _, _, asked in self._asked_reads.values():
+            reads = reads + asked
+        waiting = [(client, cmd.guid) for client, cmd, _ in reads]
+        waiting += [(client, guid) for guid, client in self._forwarded.items()]
+        self._asked_reads.clear()
+        self._forwarded.clear()
+        self.outbox.extend(
+            Message(frm=self.name, to=client, cmd=ClientRedirect(guid=guid, leaderHint=leaderHint))
+            for client, guid in waiting
+        )
 
 
 class Leader(Server):
@@ -79,14 +378,69 @@ class Leader(Server):
         log: Log,
         currentTerm: int,
         votedFor: Optional[str],
+        **kwargs: Any,
     ):
-        super().__init__(name, peers, now, log, currentTerm, votedFor)
+        super().__init__(name, peers, now, log, currentTerm, votedFor, **kwargs)
+        self.leaderId = name
         self._setup_follower_tracking_indexes()
 
-    def _become_follower(self) -> None:
-        super()._become_follower()
+    def _take_office(self) -> None:
+        """set up as a newly elected leader"""
+        self._setup_follower_tracking_indexes()
+        # commit an entry from our own term straight away, to learn what's
+        # committed from earlier terms
+        noop = Entry(term=self.currentTerm, cmd="")
+        ok = self.log.append_entries(self.log.lastLogIndex, self.log.last_log_term, [noop])
+        assert ok
+        for follower in self.nextIndex:
+            self._replicate_to(follower)
+
+    def _become_follower(self, leaderHint: Optional[str] = None) -> None:
+        super()._become_follower(leaderHint)
         self.matchIndex.clear()
         self.nextIndex.clear()
+        self._inflight.clear()
+        self._probing.clear()
+        self._probe_seq.clear()
+        self._snapshot_offset.clear()
+        # we can't say what will become of these any more, so send the
+        # clients to the new leader
+        waiting = [(client, cmd.guid) for client, cmd, _ in self._proposals]
+        waiting += [(client, guid) for _, client, guid, _ in self._pending]
+        for _, _, reads in self._read_rounds:
+            self._new_reads.extend(reads)
+        # followers asking for a read index find out about the new term for themselves
+        waiting += [
+            (client, cmd.guid) for client, cmd, _ in self._new_reads
+            if isinstance(cmd, ClientGetCommand)
+        ]
+        self.outbox.extend(
+            Message(frm=self.name, to=client, cmd=ClientRedirect(guid=guid, leaderHint=leaderHint))
+            for client, guid in waiting
+        )
+        self._proposals.clear()
+        self._pending.clear()
+        self._new_reads.clear()
+        self._read_rounds.clear()
+        self._rounds_sent.clear()
+        self._round_trips.clear()
+
+    def flush(self) -> None:
+        if self._proposals and self.now - self._proposed_at >= self.max_batch_delay:
+            self._propose_buffered()
+        super().flush()
+        self._start_read_round()
+        self._reply_to_clients()
+        self._serve_reads()
+
+    def _reply_to_clients(self) -> None:
+        """tell clients about their commands that have been applied"""
+        while self._pending and self._pending[0][0] <= self.lastApplied:
+            _, client, guid, received_at = self._pending.popleft()
+            self.outbox.append(
+                Message(frm=self.name, to=client, cmd=ClientSetSucceeded(guid=guid))
+            )
+            self.commit_latency.record(self.now - received_at)
 
     def _setup_follower_tracking_indexes(self) -> None:
         # Raft leader volatile state
@@ -95,85 +449,415 @@ class Leader(Server):
             for server_name in self.peers
             if server_name != self.name
         }  # type: Dict[str, int]
-        self.matchIndex = {
-            server_name: 0 for server_name in self.peers if server_name != self.name
+        self.matchIndex = MatchIndexes(list(self.nextIndex))
+        # replication pipeline: the last index and send time of each unacked
+        # AppendEntries.  while probing, ie until we know where a follower's
+        # log matches ours, only one is allowed in flight.
+        self._inflight = {
+            server_name: deque() for server_name in self.nextIndex
+        }  # type: Dict[str, Deque[Tuple[int, float]]]
+        self._probing = {
+            server_name: True for server_name in self.nextIndex
+        }  # type: Dict[str, bool]
+        # the round each follower's latest probe went out in.  failures from
+        # before it are to AppendEntries we've already given up on
+        self._probe_seq = {
+            server_name: 0 for server_name in self.nextIndex
+        }  # type: Dict[str, int]
+        # how much of our snapshot each follower has acknowledged, for those
+        # whose nextIndex has fallen into the compacted part of the log
+        self._snapshot_offset = {
+            server_name: 0 for server_name in self.nextIndex
         }  # type: Dict[str, int]
+        # ReadIndex: reads are answered once a majority have responded to a
+        # round of AppendEntries sent after they arrived, which shows we were
+        # still leader then.  rounds are numbered by the seq the AppendEntries
+        # carry, and each holds the commitIndex its reads must wait to see
+        # applied.  reads arriving in the same tick share a round.
+        self._acked_seq = {
+            server_name: 0 for server_name in self.nextIndex
+        }  # type: Dict[str, int]
+        self._new_reads = []
+        self._read_rounds = (
+            deque()
+        )  # type: Deque[Tuple[int, int, List[Tuple[str, Any, float]]]]
+        # every heartbeat starts a round too.  we keep when we sent the
+        # recent ones, to time round trips and to start leases from
+        self._rounds_sent = deque(maxlen=RTT_SAMPLES)  # type: Deque[Tuple[int, float]]
+        self._lease_start = float("-inf")
+        self._round_trips = {
+            server_name: deque(maxlen=RTT_SAMPLES) for server_name in self.nextIndex
+        }  # type: Dict[str, Deque[float]]
+        # 0 until we've measured something to pick an election timeout from
+        self._advertised_timeout = 0.0
+        # when we last heard from each follower, for check_quorum
+        self._heard_from = {
+            server_name: self.now for server_name in self.nextIndex
+        }  # type: Dict[str, float]
+        # when we last sent each follower anything.  those we've sent
+        # AppendEntries to within the heartbeat interval don't need a heartbeat
+        self._last_sent = {
+            server_name: float("-inf") for server_name in self.nextIndex
+        }  # type: Dict[str, float]
+        # the round whose heartbeat each was last sent.  a round can also reach
+        # a follower in a later AppendEntries, so only answers to the
+        # heartbeat itself time round trips
+        self._timed_seq = {
+            server_name: 0 for server_name in self.nextIndex
+        }  # type: Dict[str, int]
+        self._quiescent = False
+        # when we ran out of things to do, if we have
+        self._idle_since = None  # type: Optional[float]
 
     def clock_tick(self, now: float) -> None:
         self.now = now
-        if self.now > (self._last_heartbeat + HEARTBEAT_FREQUENCY):
+        if self.quiesce:
+            self._update_quiescence()
+        if self.check_quorum and not self._in_touch_with_majority():
+            print(f"{self.name} has lost touch with a majority, stepping down")
+            self._become_follower()
+            self._reset_election_timeout()
+            return
+        for follower, inflight in self._inflight.items():
+            if inflight and inflight[0][1] + REPLICATION_TIMEOUT < self.now:
+                print(f"replication to {follower} timed out, probing")
+                self._start_probing(follower, self.matchIndex[follower] + 1)
+                self._replicate_to(follower)
+        interval = self._heartbeat_interval()
+        if self.now > (self._last_heartbeat + interval):
             self._last_heartbeat = self.now
-            self.outbox.extend(
-                Message(frm=self.name, to=s, cmd=self._heartbeat_for(s))
-                for s in self.peers
-                if s != self.name
+            self._adapt_timeouts()
+            # a new round even if nobody needs a heartbeat, so leases keep
+            # being renewed under load: the AppendEntries carry it instead.
+            # followers being sent a snapshot hear from us with each chunk
+            self._next_round()
+            self._send_heartbeats(
+                f for f in self.nextIndex
+                if self.now > self._last_sent[f] + interval and not self._needs_snapshot(f)
             )
 
+    def _heartbeat_interval(self) -> float:
+        return QUIESCENT_HEARTBEAT_INTERVAL if self._quiescent else self.heartbeat_interval
+
+    def next_deadline(self) -> float:
+        # going quiet, and check_quorum, can wait for the next heartbeat
+        deadline = min(super().next_deadline(), self._last_heartbeat + self._heartbeat_interval())
+        for inflight in self._inflight.values():
+            if inflight:
+                deadline = min(deadline, inflight[0][1] + REPLICATION_TIMEOUT)
+        if self._proposals:
+            deadline = min(deadline, self._proposed_at + self.max_batch_delay)
+        return deadline
+
+    def _update_quiescence(self) -> None:
+        if not self._is_idle():
+            self._wake()
+            return
+        if self._idle_since is None:
+            self._idle_since = self.now
+        # waiting a while first means a steady trickle of commands doesn't
+        # have us going quiet and waking up again all the time
+        if not self._quiescent and self.now >= self._idle_since + self.election_timeout:
+            print(f"{self.name} has nothing to do, going quiet")
+            self._quiescent = True
+            # everyone hears so straight away, before they expect our next heartbeat
+            self._last_heartbeat = float("-inf")
+            for follower in self._last_sent:
+                self._last_sent[follower] = float("-inf")
+
+    def _is_idle(self) -> bool:
+        """nothing to propose, replicate, apply or answer"""
+        last = self.log.lastLogIndex
+        return (
+            not self._proposals
+            and not self._pending
+            and not self._new_reads
+            and not self._read_rounds
+            and self.commitIndex == last
+            and self.lastApplied == last
+            and all(index == last for index in self.matchIndex.values())
+        )
+
+    def _wake(self) -> None:
+        self._idle_since = None
+        if not self._quiescent:
+            return
+        print(f"{self.name} has work to do, waking up")
+        self._quiescent = False
+        # followers haven't been answering as often, so give them a normal
+        # election timeout from now to show they're still there
+        for follower, heard in self._heard_from.items():
+            self._heard_from[follower] = max(heard, self.now)
+
+    def _adapt_timeouts(self) -> None:
+        if self.min_election_timeout == self.max_election_timeout:
+            return
+        p99s = [self._p99(rtts) for rtts in self._round_trips.values() if rtts]
+        if not p99s:
+            return
+        self._set_election_timeout(RTT_MULTIPLIER * max(p99s))
+        self._advertised_timeout = self.election_timeout
+
+    @staticmethod
+    def _p99(samples: Deque[float]) -> float:
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+
+    def round_trip_p99s(self) -> Dict[str, float]:
+        """recent p99 heartbeat round trip to each follower we've heard back from, for monitoring"""
+        return {f: self._p99(rtts) for f, rtts in self._round_trips.items() if rtts}
+
+    def _in_touch_with_majority(self) -> bool:
+        cutoff = self.now - (self._leader_timeout() + self.election_timeout_jitter)
+        recent = sum(1 for heard in self._heard_from.values() if heard >= cutoff)
+        return recent + 1 > len(self.peers) / 2
+
     def _handle_message(self, msg: Message) -> None:
+        if msg.frm in self._heard_from:
+            self._heard_from[msg.frm] = self.now
+
+        if isinstance(msg.cmd, PreVote):
+            # they can't have heard from us lately, but we're still here
+            self.outbox.append(
+                Message(frm=self.name, to=msg.frm, cmd=PreVoteDenied(term=self.currentTerm))
+            )
+
         if isinstance(msg.cmd, ClientSetCommand):
             self._handleClientSetCommand(frm=msg.frm, cmd=msg.cmd)
 
+        if isinstance(msg.cmd, (ClientGetCommand, ReadIndexRequest)):
+            self._wake()
+            self._new_reads.append((msg.frm, msg.cmd, self.now))
+
         if isinstance(msg.cmd, AppendEntriesSucceeded):
             self._handleAppendEntriesSucceeded(frm=msg.frm, cmd=msg.cmd)
 
         if isinstance(msg.cmd, AppendEntriesFailed):
-            self._handleAppendEntriesFailed(frm=msg.frm)
+            self._handleAppendEntriesFailed(frm=msg.frm, cmd=msg.cmd)
+
+        if isinstance(msg.cmd, InstallSnapshotSucceeded):
+            self._handleInstallSnapshotSucceeded(frm=msg.frm, cmd=msg.cmd)
 
     def _handleClientSetCommand(self, frm: str, cmd: ClientSetCommand):
+        if cmd.clientId is not None and cmd.seq <= self.applier.last_seq(cmd.clientId):
+            # a retry of something already applied
+            self.outbox.append(Message(frm=self.name, to=frm, cmd=ClientSetSucceeded(guid=cmd.guid)))
+            return
+        self._wake()
+        if not self._proposals:
+            self._proposed_at = self.now
+        self._proposals.append((frm, cmd, self.now))
+        if len(self._proposals) >= self.batch_size:
+            self._propose_buffered()
+
+    def _propose_buffered(self) -> None:
+        """append the buffered client commands in one go, then replicate them"""
         prevLogIndex = self.log.lastLogIndex
-        prevLogTerm = self.log.last_log_term
-        new_entry = Entry(term=self.currentTerm, cmd=cmd.cmd)
-        assert self.log.add_entry(
-            entry=new_entry,
-            prevLogIndex=prevLogIndex,
-            prevLogTerm=prevLogTerm,
-            leaderCommit=1,
-        )
-        print(f"server added {cmd} at position {prevLogIndex + 1}")
-        ae = AppendEntries(
-            term=self.currentTerm,
-            leaderId=self.name,
+        new_entries = [
+            Entry(term=self.currentTerm, cmd=cmd.cmd, session=self._session_for(cmd, received_at))
+            for _, cmd, received_at in self._proposals
+        ]
+        ok = self.log.append_entries(
             prevLogIndex=prevLogIndex,
-            prevLogTerm=prevLogTerm,
-            leaderCommit=0,
-            entries=[new_entry],
+            prevLogTerm=self.log.last_log_term,
+            entries=new_entries,
         )
-        self.outbox.extend(
-            Message(frm=self.name, to=s, cmd=ae) for s in self.peers if s != self.name
-        )
-        if False:  # TODO:
-            self.outbox.append(
-                Message(frm=self.name, to=frm, cmd=ClientSetSucceeded(guid=cmd.guid))
-            )
+        assert ok
+        print(f"server added {len(new_entries)} entries after position {prevLogIndex}")
+        for index, (client, cmd, received_at) in enumerate(self._proposals, prevLogIndex + 1):
+            self._pending.append((index, client, cmd.guid, received_at))
+        self._proposals.clear()
+        for follower in self.nextIndex:
+            self._replicate_to(follower)
+
+    def _session_for(self, cmd: ClientSetCommand, received_at: float) -> Optional[Session]:
+        if cmd.clientId is None:
+            return None
+        return Session(clientId=cmd.clientId, seq=cmd.seq, timestamp=received_at)
+
+    def _start_read_round(self) -> None:
+        if not self._new_reads:
+            return
+        if self.log.entry_term(self.commitIndex) != self.currentTerm:
+            # until an entry from our term commits (there's a no-op for that),
+            # we don't know for sure what's committed, so reads must wait
+            return
+        if self.lease_reads and self._holds_lease():
+            # nobody else can have been elected, so no need to check
+            self._read_rounds.append((0, self.commitIndex, self._new_reads))
+            self._new_reads = []
+            return
+        self._next_round()
+        self._read_rounds.append((self._read_seq, self.commitIndex, self._new_reads))
+        self._new_reads = []
+        self._last_heartbeat = self.now
+        self._send_heartbeats(f for f in self.nextIndex if not self._needs_snapshot(f))
+
+    def _next_round(self) -> None:
+        self._read_seq += 1
+        self._rounds_sent.append((self._read_seq, self.now))
+
+    def _round_sent_at(self, seq: int) -> Optional[float]:
+        """when we started round seq, if it's recent enough that we still know"""
+        if not self._rounds_sent or seq < self._rounds_sent[0][0]:
+            return None
+        offset = seq - self._rounds_sent[0][0]  # rounds are numbered consecutively
+        return self._rounds_sent[offset][1] if offset < len(self._rounds_sent) else None
+
+    def _record_ack(self, frm: str, seq: int) -> None:
+        if seq <= self._acked_seq[frm]:
+            return
+        self._acked_seq[frm] = seq
+        # the first answer in a round is to the heartbeat that started it
+        sent_at = self._round_sent_at(seq)
+        if sent_at is not None and seq == self._timed_seq[frm]:
+            self._round_trips[frm].append(self.now - sent_at)
+
+    def _holds_lease(self) -> bool:
+        # followers' timeouts never go below min_election_timeout
+        sent_at = self._round_sent_at(self._confirmed_read_seq())
+        if sent_at is not None:
+            self._lease_start = max(self._lease_start, sent_at)
+        return self.now < self._lease_start + self.min_election_timeout - MAX_CLOCK_DRIFT
+
+    def _confirmed_read_seq(self) -> int:
+        """the latest read round a majority of us have answered"""
+        others_needed = len(self.peers) // 2
+        if others_needed == 0:
+            return self._read_seq
+        return sorted(self._acked_seq.values(), reverse=True)[others_needed - 1]
+
+    def _serve_reads(self) -> None:
+        confirmed = self._confirmed_read_seq()
+        while self._read_rounds:
+            seq, readIndex, reads = self._read_rounds[0]
+            if seq > confirmed or readIndex > self.lastApplied:
+                return
+            self._read_rounds.popleft()
+            for client, cmd, received_at in reads:
+                if isinstance(cmd, ReadIndexRequest):
+                    # a follower's reads; it answers them once it has applied this far
+                    self.outbox.append(Message(frm=self.name, to=client, cmd=ReadIndexReply(
+                        term=self.currentTerm, readId=cmd.readId, readIndex=readIndex,
+                    )))
+                    continue
+                value = self.applier.read(cmd.key)
+                self.outbox.append(
+                    Message(frm=self.name, to=client, cmd=ClientGetSucceeded(guid=cmd.guid, value=value))
+                )
+                self.read_latency.record(self.now - received_at)
 
     def _handleAppendEntriesSucceeded(self, frm: str, cmd: AppendEntriesSucceeded):
-        self.matchIndex[frm] = cmd.matchIndex
-        self.nextIndex[frm] = cmd.matchIndex + 1
+        self._record_ack(frm, cmd.seq)
+        # acks can arrive out of date, so indexes only ever move forwards
+        self.matchIndex[frm] = max(self.matchIndex[frm], cmd.matchIndex)
+        inflight = self._inflight[frm]
+        while inflight and inflight[0][0] <= cmd.matchIndex:
+            inflight.popleft()
+        if self._probing[frm]:
+            # found where our logs match, so we can start pipelining from there
+            self._probing[frm] = False
+            self.nextIndex[frm] = self.matchIndex[frm] + 1
+        else:
+            self.nextIndex[frm] = max(self.nextIndex[frm], self.matchIndex[frm] + 1)
         print(self.matchIndex)
-        if self.matchIndex[frm] < self.log.lastLogIndex:
-            self._send_next_entry(frm)
-        self._commit_if_possible(cmd.matchIndex)
-
-    def _handleAppendEntriesFailed(self, frm: str):
-        self.nextIndex[frm] = max(self.nextIndex[frm] - 1, 1)
-        index_to_resend = self.nextIndex[frm]
-        print(f"{frm} failed, resending entry at {index_to_resend}")
-        prevLogIndex = index_to_resend - 1
-        prevLogTerm = self.log.entry_term(prevLogIndex)
-        self.outbox.append(
-            Message(
-                frm=self.name,
-                to=frm,
-                cmd=AppendEntries(
-                    term=self.currentTerm,
-                    leaderId=self.name,
-                    prevLogIndex=prevLogIndex,
-                    prevLogTerm=prevLogTerm,
-                    leaderCommit=0,
-                    entries=[self.log.entry_at(index_to_resend)],
-                ),
+        self._replicate_to(frm)
+        self._advance_commit_index()
+
+    def _handleAppendEntriesFailed(self, frm: str, cmd: AppendEntriesFailed):
+        if cmd.term < self.currentTerm:
+            return  # to something we sent in an earlier term
+        self._record_ack(frm, cmd.seq)
+        if cmd.seq < self._probe_seq[frm]:
+            # the rest of a window we've already started probing again for
+            return
+        # skip back a whole term at a time: past our own entries from the
+        # conflicting term if we have any, otherwise to where the follower's
+        # entries from that term begin.
+        next_to_try = cmd.conflictIndex
+        if cmd.conflictTerm:
+            last_of_term = self.log.last_index_of_term(cmd.conflictTerm)
+            if last_of_term:
+                next_to_try = last_of_term + 1
+        self._start_probing(frm, min(next_to_try, self.log.lastLogIndex + 1))
+        print(f"{frm} failed, resending from {self.nextIndex[frm]}")
+        self._replicate_to(frm)
+
+    def _handleInstallSnapshotSucceeded(self, frm: str, cmd: InstallSnapshotSucceeded):
+        if cmd.term < self.currentTerm:
+            return  # about a snapshot we sent in an earlier term
+        self._inflight[frm].clear()
+        if cmd.done:
+            self._snapshot_offset[frm] = 0
+            self._handleAppendEntriesSucceeded(
+                frm, AppendEntriesSucceeded(matchIndex=cmd.lastIncludedIndex)
             )
-        )
+            return
+        if cmd.lastIncludedIndex == self.log.snapshot.lastIncludedIndex:
+            self._snapshot_offset[frm] = cmd.offset
+        else:
+            # we've taken a newer snapshot since, so start again with that
+            self._snapshot_offset[frm] = 0
+        self._replicate_to(frm)
+
+    def _start_probing(self, follower: str, nextIndex: int) -> None:
+        # no point going back past entries we know the follower has
+        self.nextIndex[follower] = max(nextIndex, self.matchIndex[follower] + 1, 1)
+        self._inflight[follower].clear()
+        self._probing[follower] = True
+        # a round of its own, so answers to what was in flight can be told apart
+        self._next_round()
+        self._probe_seq[follower] = self._read_seq
+
+    def _replicate_to(self, follower: str) -> None:
+        """
+        send the follower batches of entries it doesn't have yet, as far as its
+        in-flight window allows.  nextIndex moves on optimistically as each batch
+        goes out, unless we're still probing for where the logs match.
+        """
+        inflight = self._inflight[follower]
+        if self._needs_snapshot(follower):
+            if not inflight:
+                self._send_snapshot_chunk(follower)
+            return
+        window = 1 if self._probing[follower] else self.max_inflight
+        while self.nextIndex[follower] <= self.log.lastLogIndex and len(inflight) < window:
+            ae = self._append_entries_for(follower)
+            self._send(follower, ae)
+            last_sent = ae.prevLogIndex + len(ae.entries)
+            inflight.append((last_sent, self.now))
+            if not self._probing[follower]:
+                self.nextIndex[follower] = last_sent + 1
+
+    def _needs_snapshot(self, follower: str) -> bool:
+        """whether entries the follower needs next have been compacted away"""
+        return self.nextIndex[follower] <= self.log.snapshot.lastIncludedIndex
+
+    def _send_snapshot_chunk(self, follower: str) -> None:
+        """send the next chunk of the snapshot, max_bytes at a time, one at a time"""
+        snapshot = self.log.snapshot
+        offset = self._snapshot_offset[follower]
+        data = snapshot.data[offset:offset + self.max_bytes]
+        self._send(follower, InstallSnapshot(
+            term=self.currentTerm,
+            leaderId=self.name,
+            lastIncludedIndex=snapshot.lastIncludedIndex,
+            lastIncludedTerm=snapshot.lastIncludedTerm,
+            offset=offset,
+            data=data,
+            done=offset + len(data) >= len(snapshot.data),
+        ))
+        self._inflight[follower].append((snapshot.lastIncludedIndex, self.now))
+
+    def _send(self, follower: str, cmd: Any) -> None:
+        self.outbox.append(Message(frm=self.name, to=follower, cmd=cmd))
+        self._last_sent[follower] = self.now
+
+    def _send_heartbeats(self, followers: Iterable[str]) -> None:
+        """heartbeats for the current round"""
+        for follower in followers:
+            self._send(follower, self._heartbeat_for(follower))
+            self._timed_seq[follower] = self._read_seq
 
     def _heartbeat_for(self, follower) -> AppendEntries:
         print(f"making heartbeat for {follower}")
@@ -184,59 +868,63 @@ class Leader(Server):
             leaderId=self.name,
             prevLogIndex=prevLogIndex,
             prevLogTerm=prevLogTerm,
-            leaderCommit=0,
+            leaderCommit=self.commitIndex,
             entries=[],
+            seq=self._read_seq,
+            electionTimeout=self._advertised_timeout,
+            quiescent=self._quiescent,
         )
 
-    def _next_entry_for(self, follower) -> AppendEntries:
+    def _append_entries_for(self, follower) -> AppendEntries:
         prevLogIndex = self.nextIndex[follower] - 1
         prevLogTerm = self.log.entry_term(prevLogIndex)
-        entry = self.log.entry_at(self.nextIndex[follower])
         return AppendEntries(
             term=self.currentTerm,
             leaderId=self.name,
             prevLogIndex=prevLogIndex,
             prevLogTerm=prevLogTerm,
-            leaderCommit=0,
-            entries=[entry],
+            leaderCommit=self.commitIndex,
+            entries=self._batch_from(self.nextIndex[follower]),
+            seq=self._read_seq,
+            electionTimeout=self._advertised_timeout,
+            quiescent=self._quiescent,
         )
 
+    def _batch_from(self, index: int) -> List[Entry]:
+        """
+        as many consecutive entries from (1-based) index as fit in the
+        max_entries / max_bytes budget.  always at least one, if there is one.
+        """
+        batch = []  # type: List[Entry]
+        size = 0
+        last = min(self.log.lastLogIndex, index + self.max_entries - 1)
+        for i in range(index, last + 1):
+            entry = self.log.entry_at(i)
+            size += len(entry.cmd.encode())
+            if batch and size > self.max_bytes:
+                break
+            batch.append(entry)
+        return batch
 
-    def _commit_if_possible(self, matchIndex: int):
-        if self.commitIndex > matchIndex:
-            return
-        if self._have_quorum_at(matchIndex):
-            self.commitIndex += 1
-            # TODOs:
-            # self.log.apply_state_machine_up_to(self.commitIndex)
-            # self._send_any_pending_client_responses()
-
-    def _have_quorum_at(self, matchIndex) -> bool:
-        quorum = len(self.peers) // 2
-        matching_follwers = len(
-            [f for f, ix in self.matchIndex.items() if ix >= matchIndex]
-        )
-        me = 1
-        return (matching_follwers + me) > quorum
+    def _advance_commit_index(self) -> None:
+        # runs on every ack, and at the end of each tick in case our own
+        # entries have only just become durable.  only entries from our own
+        # term are committed by counting replicas; earlier ones are committed
+        # along with them (§5.4.2)
+        index = min(self._quorum_index(), self.log.last_index_of_term(self.currentTerm))
+        if index > self.commitIndex and self.log.entry_term(index) == self.currentTerm:
+            self.commitIndex = index
 
-    def _send_next_entry(self, follower: str):
-        next_to_send = self.log.entry_at(self.matchIndex[follower] + 1)
-        prevLogIndex = self.matchIndex[follower]
-        prevLogTerm = self.log.entry_term(prevLogIndex)
-        self.outbox.append(
-            Message(
-                frm=self.name,
-                to=follower,
-                cmd=AppendEntries(
-                    term=self.currentTerm,
-                    leaderId=self.name,
-                    prevLogIndex=prevLogIndex,
-                    prevLogTerm=prevLogTerm,
-                    leaderCommit=0,
-                    entries=[next_to_send],
-                ),
-            )
-        )
+    def _quorum_index(self) -> int:
+        """the highest index that a majority of servers, us included, have durably"""
+        majority = len(self.peers) // 2 + 1
+        # it's the majority-th highest of the followers' indexes and our own
+        # durableIndex: ours counts if it falls between theirs
+        below = self.matchIndex.nth_highest(majority)
+        if majority == 1:
+            return max(below, self.log.durableIndex)
+        above = self.matchIndex.nth_highest(majority - 1)
+        return max(below, min(above, self.log.durableIndex))
 
 
 class Follower(Server):
@@ -246,17 +934,123 @@ class Follower(Server):
             print(
                 f"election timeout!  {self.now} was greater than {self._election_timeout}"
             )
+            # the leader has gone quiet for longer than it said it would
+            self._quiescent = False
             self._reset_election_timeout()
-            self._become_candidate()
+            if self.pre_vote:
+                self._call_pre_vote()
+            else:
+                self._become_candidate()
+            return
+        for readId, (asked_at, readIndex, reads) in list(self._asked_reads.items()):
+            if readIndex is None and asked_at + REPLICATION_TIMEOUT < self.now:
+                print(f"read index request {readId} timed out")
+                del self._asked_reads[readId]
+                self._redirect_clients(reads, self.leaderId)
+
+    def next_deadline(self) -> float:
+        deadline = min(super().next_deadline(), self._election_timeout)
+        for asked_at, readIndex, _ in self._asked_reads.values():
+            if readIndex is None:
+                deadline = min(deadline, asked_at + REPLICATION_TIMEOUT)
+        return deadline
+
+    def flush(self) -> None:
+        super().flush()
+        self._ask_for_read_index()
+        self._serve_reads()
 
     def _handle_message(self, msg: Message) -> None:
         if isinstance(msg.cmd, AppendEntries):
             kvcmd = msg.cmd.entries[0].cmd if msg.cmd.entries else "HeArtBeAt"
             self._handle_AppendEntries(frm=msg.frm, cmd=msg.cmd)
 
+        if isinstance(msg.cmd, PreVote):
+            self._handle_PreVote(frm=msg.frm, cmd=msg.cmd)
+
+        if isinstance(msg.cmd, PreVoteGranted):
+            self._handle_PreVoteGranted(frm=msg.frm, cmd=msg.cmd)
+
+        if isinstance(msg.cmd, ClientSetCommand):
+            self._handle_ClientSetCommand(frm=msg.frm, cmd=msg.cmd)
+
+        if isinstance(msg.cmd, (ClientSetSucceeded, ClientRedirect)):
+            # the leader's answer to a command we forwarded
+            client = self._forwarded.pop(msg.cmd.guid, None)
+            if client is not None:
+                self.outbox.append(Message(frm=self.name, to=client, cmd=msg.cmd))
+
+        if isinstance(msg.cmd, ClientGetCommand):
+            self._handle_ClientGetCommand(frm=msg.frm, cmd=msg.cmd)
+
+        if isinstance(msg.cmd, ReadIndexReply):
+            self._handle_ReadIndexReply(cmd=msg.cmd)
+
+        if isinstance(msg.cmd, InstallSnapshot):
+            self._handle_InstallSnapshot(frm=msg.frm, cmd=msg.cmd)
+
         if isinstance(msg.cmd, RequestVote):
             self._handle_RequestVote(frm=msg.frm, cmd=msg.cmd)
 
+    def _handle_ClientSetCommand(self, frm: str, cmd: ClientSetCommand) -> None:
+        # and a command forwarded to us by a peer with out-of-date ideas
+        # about who's leader isn't passed on again, so it can't go round in circles
+        if self.leaderId is None or not self.forward_client_commands or frm in self.peers:
+            self.outbox.append(Message(
+                frm=self.name, to=frm, cmd=ClientRedirect(guid=cmd.guid, leaderHint=self.leaderId),
+            ))
+            return
+        self._forwarded[cmd.guid] = frm
+        self.outbox.append(Message(frm=self.name, to=self.leaderId, cmd=cmd))
+
+    def _handle_ClientGetCommand(self, frm: str, cmd: ClientGetCommand) -> None:
+        fresh_enough = (
+            cmd.max_staleness is not None
+            and self.now - self._leader_seen_at <= cmd.max_staleness
+            and self.lastApplied >= self.commitIndex
+        )
+        if fresh_enough:
+            value = self.applier.read(cmd.key)
+            self.outbox.append(
+                Message(frm=self.name, to=frm, cmd=ClientGetSucceeded(guid=cmd.guid, value=value))
+            )
+            self.read_latency.record(0)
+            return
+        self._new_reads.append((frm, cmd, self.now))
+
+    def _ask_for_read_index(self) -> None:
+        """one request to the leader covers all the reads that arrived this tick"""
+        if not self._new_reads:
+            return
+        reads, self._new_reads = self._new_reads, []
+        if self.leaderId is None:
+            self._redirect_clients(reads, leaderHint=None)
+            return
+        self._read_id += 1
+        self._asked_reads[self._read_id] = (self.now, None, reads)
+        self.outbox.append(Message(
+            frm=self.name,
+            to=self.leaderId,
+            cmd=ReadIndexRequest(term=self.currentTerm, readId=self._read_id),
+        ))
+
+    def _handle_ReadIndexReply(self, cmd: ReadIndexReply) -> None:
+        if cmd.readId in self._asked_reads:
+            asked_at, _, reads = self._asked_reads[cmd.readId]
+            self._asked_reads[cmd.readId] = (asked_at, cmd.readIndex, reads)
+
+    def _serve_reads(self) -> None:
+        for readId, (_, readIndex, reads) in list(self._asked_reads.items()):
+            if readIndex is None or readIndex > self.lastApplied:
+                continue
+            del self._asked_reads[readId]
+            for client, cmd, received_at in reads:
+                value = self.applier.read(cmd.key)
+                self.outbox.append(
+                    Message(frm=self.name, to=client, cmd=ClientGetSucceeded(guid=cmd.guid, value=value))
+                )
+                self.read_latency.record(self.now - received_at)
+
     def _handle_RequestVote(self, frm: str, cmd: RequestVote) -> None:
         assert frm == cmd.candidateId
         if self._should_grant_vote(cmd):
@@ -269,43 +1063,152 @@ class Follower(Server):
     def _should_grant_vote(self, cmd: RequestVote) -> bool:
         if cmd.term < self.currentTerm:
             return False
-        if cmd.lastLogTerm < self.log.last_log_term:
-            return False
-        if cmd.lastLogIndex < self.log.lastLogIndex:
+        if not self._log_is_up_to_date(cmd.lastLogIndex, cmd.lastLogTerm):
             return False
         if self.votedFor and self.votedFor != cmd.candidateId:
             return False
         return True
 
+    def _call_pre_vote(self) -> None:
+        self._pre_votes = {self.name}
+        self.outbox.extend(
+            Message(
+                frm=self.name,
+                to=p,
+                cmd=PreVote(
+                    proposedTerm=self.currentTerm + 1,
+                    candidateId=self.name,
+                    lastLogIndex=self.log.lastLogIndex,
+                    lastLogTerm=self.log.last_log_term,
+                ),
+            )
+            for p in self.peers
+            if p != self.name
+        )
+        self._count_pre_votes()
+
+    def _handle_PreVoteGranted(self, frm: str, cmd: PreVoteGranted) -> None:
+        if self._pre_votes and cmd.proposedTerm == self.currentTerm + 1:
+            self._pre_votes.add(frm)
+            self._count_pre_votes()
+
+    def _count_pre_votes(self) -> None:
+        if len(self._pre_votes) > len(self.peers) / 2:
+            self._pre_votes.clear()
+            self._become_candidate()
+
     def _handle_AppendEntries(self, frm: str, cmd: AppendEntries) -> None:
-        # TODO: this log.check_log() is rough.
-        #       lets convert to appendentries taking a list.
-        if not self.log.check_log(cmd.prevLogIndex, cmd.prevLogTerm):
-            self.outbox.append(
-                Message(
-                    frm=self.name,
-                    to=frm,
-                    cmd=AppendEntriesFailed(term=self.currentTerm),
-                )
+        # an old leader mustn't take an answer as support, eg for its reads;
+        # our failure tells it about our newer term
+        stale = cmd.term < self.currentTerm
+        if not stale:
+            self._leader_seen_at = self.now
+            self.leaderId = cmd.leaderId
+            self._pre_votes.clear()
+            self._quiescent = cmd.quiescent
+            if cmd.electionTimeout:
+                self._set_election_timeout(cmd.electionTimeout)
+        if stale:
+            # no use looking in our log: its prevLogIndex may be long compacted away
+            failure = AppendEntriesFailed(
+                term=self.currentTerm, conflictTerm=0, conflictIndex=0, seq=cmd.seq
             )
+            self.outbox.append(Message(frm=self.name, to=frm, cmd=failure))
+            return
+        if not self.log.append_entries(cmd.prevLogIndex, cmd.prevLogTerm, cmd.entries):
+            failure = self._conflict_with(cmd.prevLogIndex)
+            failure.seq = cmd.seq
+            self.outbox.append(Message(frm=self.name, to=frm, cmd=failure))
             return
         self._reset_election_timeout()
-        matchIndex = cmd.prevLogIndex
-        for entry in cmd.entries:
-            assert self.log.add_entry(
-                entry, cmd.prevLogIndex, cmd.prevLogTerm, cmd.leaderCommit
-            )
-            matchIndex += 1
-        self.outbox.append(
+        matchIndex = cmd.prevLogIndex + len(cmd.entries)
+        # everything up to matchIndex now matches the leader's log
+        self.commitIndex = max(self.commitIndex, min(cmd.leaderCommit, matchIndex))
+        # only acknowledge entries once they are durable
+        self._send_when_durable(
+            matchIndex,
             Message(
                 frm=self.name,
                 to=frm,
-                cmd=AppendEntriesSucceeded(matchIndex=matchIndex),
+                cmd=AppendEntriesSucceeded(matchIndex=matchIndex, seq=cmd.seq),
+            ),
+        )
+
+    def _conflict_with(self, prevLogIndex: int) -> AppendEntriesFailed:
+        if prevLogIndex > self.log.lastLogIndex:
+            return AppendEntriesFailed(
+                term=self.currentTerm,
+                conflictTerm=0,
+                conflictIndex=self.log.lastLogIndex + 1,
+            )
+        # everything in the snapshot was committed, so can't conflict, and
+        # its entries can't be looked at anyway
+        after_snapshot = self.log.snapshot.lastIncludedIndex + 1
+        if prevLogIndex < after_snapshot:
+            return AppendEntriesFailed(
+                term=self.currentTerm, conflictTerm=0, conflictIndex=after_snapshot
             )
+        conflictTerm = self.log.entry_term(prevLogIndex)
+        return AppendEntriesFailed(
+            term=self.currentTerm,
+            conflictTerm=conflictTerm,
+            conflictIndex=max(self.log.first_index_of_term(conflictTerm), after_snapshot),
         )
 
+    def _handle_InstallSnapshot(self, frm: str, cmd: InstallSnapshot) -> None:
+        if cmd.term < self.currentTerm:
+            # from a deposed leader, which our failure tells about our newer term
+            self.outbox.append(
+                Message(frm=self.name, to=frm, cmd=InstallSnapshotFailed(term=self.currentTerm))
+            )
+            return
+        self.leaderId = cmd.leaderId
+        self._quiescent = False
+        self._reset_election_timeout()
+        if cmd.offset == 0:
+            self._incoming_snapshot = (cmd.lastIncludedIndex, bytearray())
+        index, received = self._incoming_snapshot or (0, bytearray())
+        if index != cmd.lastIncludedIndex:
+            received = bytearray()
+        if cmd.offset != len(received):
+            # missed a chunk; tell the leader where we're up to
+            self.outbox.append(Message(
+                frm=self.name,
+                to=frm,
+                cmd=InstallSnapshotSucceeded(
+                    term=self.currentTerm, lastIncludedIndex=cmd.lastIncludedIndex,
+                    offset=len(received), done=False,
+                ),
+            ))
+            return
+        received += cmd.data
+        if cmd.done:
+            self._incoming_snapshot = None
+            self._install_snapshot(
+                Snapshot(cmd.lastIncludedIndex, cmd.lastIncludedTerm, bytes(received))
+            )
+        self.outbox.append(Message(
+            frm=self.name,
+            to=frm,
+            cmd=InstallSnapshotSucceeded(
+                term=self.currentTerm, lastIncludedIndex=cmd.lastIncludedIndex,
+                offset=len(received), done=cmd.done,
+            ),
+        ))
+
+    def _install_snapshot(self, snapshot: Snapshot) -> None:
+        if snapshot.lastIncludedIndex <= self._queuedForApply:
+            # we already have everything it covers
+            return
+        self.log.install_snapshot(snapshot)
+        # the state machine is restored from it once we flush
+        self.commitIndex = max(self.commitIndex, snapshot.lastIncludedIndex)
+
     def _become_candidate(self) -> None:
         print(f"** {self.name} is becoming Candidate **")
+        self._redirect_clients(self._new_reads, leaderHint=None)
+        self._new_reads = []
+        self.leaderId = None
         self.__class__ = Candidate
         self._call_election()  # pylint: disable=no-member
 
@@ -313,6 +1216,13 @@ class Follower(Server):
 class Candidate(Server):
     def clock_tick(self, now: float) -> None:
         self.now = now
+        if self.now > self._election_timeout:
+            print(f"{self.name} election timed out, trying again")
+            self._reset_election_timeout()
+            self._call_election()
+
+    def next_deadline(self) -> float:
+        return min(super().next_deadline(), self._election_timeout)
 
     def _handle_message(self, msg: Message) -> None:
         if isinstance(msg.cmd, VoteGranted):
@@ -320,7 +1230,13 @@ class Candidate(Server):
             if len(self._votes) > len(self.peers) / 2:
                 self._become_leader()
 
-    def _call_election(self):
+        if isinstance(msg.cmd, (ClientSetCommand, ClientGetCommand)):
+            # there may be no leader yet; clients should try again shortly
+            self.outbox.append(Message(
+                frm=self.name, to=msg.frm, cmd=ClientRedirect(guid=msg.cmd.guid, leaderHint=None),
+            ))
+
+    def _call_election(self) -> None:
         self.currentTerm += 1
         self.votedFor = self.name
         self._votes = set([self.votedFor])
@@ -342,4 +1258,5 @@ class Candidate(Server):
     def _become_leader(self) -> None:
         print(f"** {self.name} is becoming Leader **")
         self.__class__ = Leader
-        self._setup_follower_tracking_indexes()
+        self.leaderId = self.name
+        self._take_office()  # pylint: disable=no-member
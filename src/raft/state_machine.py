@@ -0,0 +1,295 @@
+import json
+import queue
+import struct
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Protocol, Tuple, Union
+
+from raft.log import Entry, Session, Snapshot
+
+APPLY_QUEUE_SIZE = 1024
+MAX_SESSIONS = 10_000
+SESSION_TIMEOUT = 3600.0
+
+# an applier's snapshot is its sessions, then the state machine's own snapshot:
+#
+#     sessions length (u32) | sessions (json) | state machine snapshot
+_SESSIONS_LENGTH = struct.Struct('>I')
+
+
+def pack_snapshot(state: bytes, sessions: bytes = b'[]') -> bytes:
+    return _SESSIONS_LENGTH.pack(len(sessions)) + sessions + state
+
+
+def unpack_snapshot(data: bytes) -> Tuple[bytes, bytes]:
+    """the state machine's snapshot and the sessions'"""
+    (length,) = _SESSIONS_LENGTH.unpack_from(data)
+    start = _SESSIONS_LENGTH.size
+    return data[start + length:], data[start:start + length]
+
+
+class StateMachine(Protocol):
+
+    def apply(self, cmd: str) -> None:
+        """apply a committed command"""
+        ...
+
+    def get(self, key: str) -> Optional[str]:
+        """may be called while an apply is going on, from another thread"""
+        ...
+
+    def snapshot(self) -> bytes:
+        """everything applied so far, serialized"""
+        ...
+
+    def restore(self, data: bytes) -> None:
+        """replace the current state with a snapshot's"""
+        ...
+
+
+class KeyValueStore:
+    """the default state machine, for the key=value commands clients send"""
+
+    def __init__(self) -> None:
+        self.data = {}  # type: Dict[str, str]
+
+    def apply(self, cmd: str) -> None:
+        key, sep, value = cmd.partition('=')
+        if sep:
+            self.data[key] = value
+
+    def get(self, key: str) -> Optional[str]:
+        return self.data.get(key)
+
+    def snapshot(self) -> bytes:
+        return json.dumps(self.data).encode()
+
+    def restore(self, data: bytes) -> None:
+        self.data = json.loads(data) if data else {}
+
+
+class Sessions:
+    """
+    the last command applied for each client session, to spot retries.  a
+    session expires SESSION_TIMEOUT after its last command, by the leader
+    timestamps in the log, and the least recently used go once there are
+    more than max_sessions, so every server forgets the same ones at the
+    same point in the log.  clients must have their commands applied in
+    seq order (eg by having one outstanding at a time): anything at or
+    below a session's last seq is taken to be a retry.
+    """
+
+    def __init__(self, max_sessions: int = MAX_SESSIONS, timeout: float = SESSION_TIMEOUT) -> None:
+        self.max_sessions = max_sessions
+        self.timeout = timeout
+        # least recently used first
+        self._sessions = OrderedDict()  # type: OrderedDict[str, Tuple[int, float]]
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def last_seq(self, clientId: str) -> int:
+        seq, _ = self._sessions.get(clientId, (0, 0.0))
+        return seq
+
+    def is_duplicate(self, session: Session) -> bool:
+        return session.seq <= self.last_seq(session.clientId)
+
+    def record(self, session: Session) -> None:
+        self._sessions[session.clientId] = (session.seq, session.timestamp)
+        self._sessions.move_to_end(session.clientId)
+        expired_before = session.timestamp - self.timeout
+        # least recently used first, so only ever look at the front
+        while len(self._sessions) > self.max_sessions or (
+            self._sessions and next(iter(self._sessions.values()))[1] < expired_before
+        ):
+            self._sessions.popitem(last=False)
+
+    def snapshot(self) -> bytes:
+        return json.dumps(list(self._sessions.items())).encode()
+
+    def restore(self, data: bytes) -> None:
+        self._sessions = OrderedDict(
+            (clientId, (seq, timestamp)) for clientId, (seq, timestamp) in json.loads(data)
+        )
+
+
+class Watermark:
+    """an index that only goes up, which other threads can wait for"""
+
+    def __init__(self, value: int = 0) -> None:
+        self._value = value
+        self._changed = threading.Condition()
+
+    @property
+    def value(self) -> int:
+        return self._value
+
+    def advance(self, value: int) -> None:
+        with self._changed:
+            if value > self._value:
+                self._value = value
+                self._changed.notify_all()
+
+    def wait_for(self, value: int, timeout: Optional[float] = None) -> bool:
+        """block until the watermark reaches value.  False if we timed out"""
+        with self._changed:
+            return self._changed.wait_for(lambda: self._value >= value, timeout)
+
+
+class Applier(Protocol):
+    """applies committed entries to a state machine, in log order"""
+
+    @property
+    def applied(self) -> Watermark:
+        """(1-based) index of the last entry applied"""
+        ...
+
+    def offer(self, index: int, entry: Entry) -> bool:
+        """queue the entry at (1-based) index to be applied.  False if there's no room"""
+        ...
+
+    def offer_snapshot(self, snapshot: Snapshot) -> bool:
+        """queue a snapshot to restore the state machine from.  False if there's no room"""
+        ...
+
+    def snapshot(self) -> Optional[Tuple[int, bytes]]:
+        """
+        the index of the last entry applied, and the state as of then.  None
+        if it isn't ready yet, in which case ask again later
+        """
+        ...
+
+    def last_seq(self, clientId: str) -> int:
+        """the seq of the client session's last applied command, 0 if none"""
+        ...
+
+    def read(self, key: str) -> Optional[str]:
+        """look key up in the state machine, as of at least applied.value"""
+        ...
+
+    def close(self) -> None:
+        ...
+
+
+class InlineApplier:
+    """applies entries as soon as they're offered, on the caller's thread"""
+
+    def __init__(self, state_machine: StateMachine, sessions: Optional[Sessions] = None) -> None:
+        self.state_machine = state_machine
+        self.sessions = sessions or Sessions()
+        self.applied = Watermark()
+
+    def offer(self, index: int, entry: Entry) -> bool:
+        self._apply(index, entry)
+        return True
+
+    def offer_snapshot(self, snapshot: Snapshot) -> bool:
+        self._restore(snapshot)
+        return True
+
+    def snapshot(self) -> Optional[Tuple[int, bytes]]:
+        return self.applied.value, pack_snapshot(self.state_machine.snapshot(), self.sessions.snapshot())
+
+    def last_seq(self, clientId: str) -> int:
+        return self.sessions.last_seq(clientId)
+
+    def read(self, key: str) -> Optional[str]:
+        return self.state_machine.get(key)
+
+    def close(self) -> None:
+        pass
+
+    def _apply(self, index: int, entry: Entry) -> None:
+        if index <= self.applied.value:
+            return  # already covered by a snapshot
+        if entry.session is None:
+            self.state_machine.apply(entry.cmd)
+        elif not self.sessions.is_duplicate(entry.session):
+            self.state_machine.apply(entry.cmd)
+            self.sessions.record(entry.session)
+        self.applied.advance(index)
+
+    def _restore(self, snapshot: Snapshot) -> None:
+        if snapshot.lastIncludedIndex <= self.applied.value:
+            return
+        state, sessions = unpack_snapshot(snapshot.data)
+        self.sessions.restore(sessions)
+        self.state_machine.restore(state)
+        self.applied.advance(snapshot.lastIncludedIndex)
+
+
+class _TakeSnapshot:
+    """queued to have the applier's worker snapshot the state between entries"""
+
+
+_TAKE_SNAPSHOT = _TakeSnapshot()
+
+
+class ThreadedApplier(InlineApplier):
+    """
+    applies entries on a worker thread, fed through a bounded queue, so a slow
+    state machine can't hold up heartbeats.  offers are refused while the
+    queue is full, and the server tries again next tick.  nothing waits on
+    the worker: snapshots are taken by it, in between entries, and reads and
+    session lookups go straight to the state machine and sessions, which
+    only ever move forwards.
+    """
+
+    def __init__(
+        self,
+        state_machine: StateMachine,
+        queue_size: int = APPLY_QUEUE_SIZE,
+        sessions: Optional[Sessions] = None,
+    ) -> None:
+        super().__init__(state_machine, sessions)
+        self._queue = queue.Queue(
+            maxsize=queue_size
+        )  # type: queue.Queue[Union[Tuple[int, Entry], Snapshot, _TakeSnapshot, None]]
+        self._snapshot_requested = False
+        # handed from the worker to snapshot(); there's only ever one asked for
+        self._taken = queue.Queue(maxsize=1)  # type: queue.Queue[Optional[Tuple[int, bytes]]]
+        self._thread = threading.Thread(target=self._run, name='applier', daemon=True)
+        self._thread.start()
+
+    def offer(self, index: int, entry: Entry) -> bool:
+        return self._put((index, entry))
+
+    def offer_snapshot(self, snapshot: Snapshot) -> bool:
+        return self._put(snapshot)
+
+    def snapshot(self) -> Optional[Tuple[int, bytes]]:
+        """the first call asks the worker for one, and a later one gets it"""
+        try:
+            taken = self._taken.get_nowait()
+        except queue.Empty:
+            pass
+        else:
+            self._snapshot_requested = False
+            return taken
+        if not self._snapshot_requested:
+            self._snapshot_requested = self._put(_TAKE_SNAPSHOT)
+        return None
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._thread.join()
+
+    def _put(self, item: Union[Tuple[int, Entry], Snapshot, _TakeSnapshot]) -> bool:
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            return False
+        return True
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            if isinstance(item, Snapshot):
+                self._restore(item)
+            elif isinstance(item, _TakeSnapshot):
+                self._taken.put(super().snapshot())
+            else:
+                self._apply(*item)
@@ -34,17 +34,19 @@ def test_replication_with_tcp_servers():
     peers = ["S1", "S2", "S3"]
     leader = Leader(
         name="S1",
+        now=time.time(),
         log=InMemoryLog(leader_entries),
         peers=peers,
         currentTerm=2,
         votedFor=None,
     )
     f1 = Follower(
-        name="S2", peers=peers, log=InMemoryLog([]), currentTerm=2, votedFor=None
+        name="S2", peers=peers, now=time.time(), log=InMemoryLog([]), currentTerm=2, votedFor=None
     )
     f2 = Follower(
         name="S3",
         peers=peers,
+        now=time.time(),
         log=InMemoryLog(one_wrong_entry),
         currentTerm=2,
         votedFor=None,
@@ -0,0 +1,131 @@
+import asyncio
+import time
+from typing import List
+
+from raft.adapters import transport
+from raft.adapters.network import AsyncRaftNet
+from raft.adapters.run_server import run_async_server
+from raft.log import InMemoryLog, Entry
+from raft.messages import Message, AppendEntriesSucceeded, ClientSetCommand
+from raft.server import Leader, Follower
+
+# clear of the ports the TCPRaftNet tests use
+SERVERS = {
+    'S1': ('localhost', 16101),
+    'S2': ('localhost', 16102),
+    'S3': ('localhost', 16103),
+}
+
+
+async def _wait_for_messages(net: AsyncRaftNet, timeout: float = 1.0) -> List[Message]:
+    assert net.arrived is not None
+    await asyncio.wait_for(net.arrived.wait(), timeout)
+    return net.get_messages(net.name)
+
+
+def test_sending_messages():
+    async def main() -> None:
+        s1net = AsyncRaftNet('S1', SERVERS)
+        s2net = AsyncRaftNet('S2', SERVERS)
+        await s1net.start()
+        await s2net.start()
+        try:
+            msgs = [Message(frm='S1', to='S2', cmd=AppendEntriesSucceeded(i)) for i in range(3)]
+            for msg in msgs:
+                s1net.dispatch(msg)
+            received = []  # type: List[Message]
+            while len(received) < len(msgs):
+                received += await _wait_for_messages(s2net)
+            assert received == msgs
+        finally:
+            await s1net.close()
+            await s2net.close()
+
+    asyncio.run(main())
+
+
+def test_messages_for_an_unreachable_peer_are_bounded():
+    async def main() -> None:
+        net = AsyncRaftNet('S1', SERVERS, max_queued=10)
+        for i in range(100):
+            net.dispatch(Message(frm='S1', to='S3', cmd=AppendEntriesSucceeded(i)))
+        net.dispatch(Message(frm='S1', to='client.id', cmd=AppendEntriesSucceeded(0)))
+        assert [m.cmd for m in net._outgoing['S3']] == [AppendEntriesSucceeded(i) for i in range(90, 100)]
+        await net.start()
+        try:
+            await asyncio.sleep(0.1)  # S3 isn't listening, so they're dropped
+            assert not net._outgoing['S3']
+        finally:
+            await net.close()
+
+    asyncio.run(main())
+
+
+def test_replication_with_servers_on_one_event_loop():
+    async def main() -> None:
+        peers = list(SERVERS)
+        nets = {name: AsyncRaftNet(name, SERVERS) for name in peers}
+        for net in nets.values():
+            await net.start()
+        leader = Leader(
+            name="S1", peers=peers, now=time.time(), log=InMemoryLog([Entry(term=1, cmd="monkeys=1")]),
+            currentTerm=1, votedFor=None,
+        )
+        followers = [
+            Follower(name=n, peers=peers, now=time.time(), log=InMemoryLog([]), currentTerm=1, votedFor=None)
+            for n in peers[1:]
+        ]
+        nets["S1"]._incoming.append(
+            Message(frm="client.id", to="S1", cmd=ClientSetCommand(guid='guid', cmd="gherkins=2"))
+        )
+        tasks = [
+            asyncio.create_task(run_async_server(s, nets[s.name])) for s in [leader] + followers
+        ]
+        try:
+            await asyncio.sleep(0.3)
+        finally:
+            for task in tasks:
+                task.cancel()
+            for net in nets.values():
+                await net.close()
+        expected = [Entry(term=1, cmd="monkeys=1"), Entry(term=1, cmd="gherkins=2")]
+        assert [s.log.read() for s in [leader] + followers] == [expected] * 3
+
+    asyncio.run(main())
+
+
+def test_waiting_for_messages_times_out():
+    async def main() -> None:
+        net = AsyncRaftNet('S1', SERVERS)
+        await net.start()
+        try:
+            start = time.time()
+            await net.wait_for_messages(timeout=0.05)
+            assert time.time() - start >= 0.05
+            assert net.get_messages('S1') == []
+        finally:
+            await net.close()
+
+    asyncio.run(main())
+
+
+def test_a_malformed_message_closes_its_connection_but_not_the_network():
+    async def main() -> None:
+        s1net = AsyncRaftNet('S1', SERVERS)
+        s2net = AsyncRaftNet('S2', SERVERS)
+        await s1net.start()
+        await s2net.start()
+        try:
+            host, port = SERVERS['S2']
+            reader, writer = await asyncio.open_connection(host, port)
+            writer.write(transport.frame(b'\x00not a message'))
+            assert await asyncio.wait_for(reader.read(), 1) == b''  # hung up on
+            writer.close()
+            msg = Message(frm='S1', to='S2', cmd=AppendEntriesSucceeded(1))
+            s1net.dispatch(msg)
+            assert await _wait_for_messages(s2net) == [msg]
+        finally:
+            await s1net.close()
+            await s2net.close()
+
+    asyncio.run(main())
@@ -1,25 +1,76 @@
 import socket
+import threading
 import time
-from raft.adapters.network import TCPRaftNet
+from raft.adapters import transport
+from raft.adapters.network import TCPRaftNet, encode
 from raft.messages import Message, AppendEntriesSucceeded
-from raft.adapters.transport import connect_tenaciously
+
+# clear of the ports TCPRaftNet.SERVERS, the end-to-end test and the
+# AsyncRaftNet tests use
+SERVERS = {
+    'S1': ('localhost', 16401),
+    'S2': ('localhost', 16402),
+}
+
 
 def test_sending_message():
-    s1net = TCPRaftNet('S1')
-    s2net = TCPRaftNet('S2')
+    s1net = TCPRaftNet('S1', SERVERS)
+    s2net = TCPRaftNet('S2', SERVERS)
+    s1net.start()
+    s2net.start()
+    try:
+        msg = Message(frm='S1', to='S2', cmd=AppendEntriesSucceeded(3))
+        s1net.dispatch(msg)
+        time.sleep(0.2)
+        msgs = s2net.get_messages('S2')
+        assert msgs == [msg]
+    finally:
+        s1net.close()
+        s2net.close()
+
+
+def test_waiting_for_messages_wakes_as_soon_as_one_arrives():
+    s1net = TCPRaftNet('S1', SERVERS)
+    s2net = TCPRaftNet('S2', SERVERS)
     s1net.start()
     s2net.start()
+    try:
+        start = time.time()
+        s2net.wait_for_messages(timeout=0.05)
+        assert time.time() - start >= 0.05
+
+        msg = Message(frm='S1', to='S2', cmd=AppendEntriesSucceeded(3))
+        s1net.dispatch(msg)
+        start = time.time()
+        s2net.wait_for_messages(timeout=5)
+        assert time.time() - start < 1
+        assert s2net.get_messages('S2') == [msg]
+    finally:
+        s1net.close()
+        s2net.close()
+
+
+def test_closing_frees_the_port():
+    for _ in range(2):
+        net = TCPRaftNet('S1', SERVERS)
+        net.start()
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.connect(SERVERS['S1'])
+            while not net._connections:  # accepted
+                time.sleep(0.001)
+            net.close()
+            assert sock.recv(1) == b''  # hung up on
+
 
-    # check servers are up and listening
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-        host, port = s1net.host
-        connect_tenaciously(sock, host=host, port=port)
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-        host, port = s2net.host
-        connect_tenaciously(sock, host=host, port=port)
-
-    msg = Message(frm='S1', to='S2', cmd=AppendEntriesSucceeded(3))
-    s1net.dispatch(msg)
-    time.sleep(0.2)
-    msgs = s2net.get_messages('S2')
-    assert msgs == [msg]
+def test_a_malformed_message_closes_the_connection():
+    net = TCPRaftNet('S1')
+    ours, theirs = socket.socketpair()
+    msg = Message(frm='S2', to='S1', cmd=AppendEntriesSucceeded(3))
+    with ours:
+        ours.sendall(transport.frame(encode(msg)) + transport.frame(b'\x00not a message'))
+        receiver = threading.Thread(target=net.receiver_thread, args=(theirs,))
+        receiver.start()
+        receiver.join(timeout=1)
+        assert not receiver.is_alive()
+        assert theirs.fileno() == -1  # closed
+        assert net.get_messages('S1') == [msg]
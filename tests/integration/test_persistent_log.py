@@ -2,7 +2,8 @@
 from pathlib import Path
 import tempfile
 import pytest
-from raft.log import Log
+from raft.adapters import persistent_log
+from raft.log import Log, Session, Snapshot
 from raft.adapters.persistent_log import PersistentLog, Entry
 
 @pytest.fixture
@@ -10,6 +11,7 @@ def temp_path():
     tf = Path(tempfile.NamedTemporaryFile().name)
     yield tf
     tf.unlink()
+    tf.with_name(tf.name + '.snapshot').unlink(missing_ok=True)
 
 
 
@@ -19,5 +21,219 @@ def test_can_round_trip_a_log(temp_path):
     entry2 = Entry(2, 'foo=2')
     log.add_entry(entry1, 0, 0, 0)
     log.add_entry(entry2, 1, 1, 0)
+    log.sync(now=0)
     new_log = PersistentLog(temp_path)
     assert new_log.read() == [entry1, entry2]
+
+
+def test_overwriting_a_suffix_survives_a_restart(temp_path):
+    log = PersistentLog(temp_path)
+    entries = [Entry(1, 'foo=1'), Entry(1, 'foo=2'), Entry(1, 'foo=3')]
+    for i, entry in enumerate(entries):
+        log.add_entry(entry, i, log.entry_term(i), 0)
+    new_entry = Entry(2, 'bar=1')
+    assert log.add_entry(new_entry, 1, 1, 0)
+    assert log.read() == [entries[0], new_entry]
+    log.close()
+    new_log = PersistentLog(temp_path)
+    assert new_log.read() == [entries[0], new_entry]
+    assert new_log.entry_term(2) == 2
+    assert new_log.entry_at(1) == entries[0]
+
+
+def test_matching_entry_does_not_truncate(temp_path):
+    log = PersistentLog(temp_path)
+    entry1 = Entry(1, 'foo=1')
+    entry2 = Entry(1, 'foo=2')
+    log.add_entry(entry1, 0, 0, 0)
+    log.add_entry(entry2, 1, 1, 0)
+    log.sync(now=0)
+    size = temp_path.stat().st_size
+    assert log.add_entry(entry1, 0, 0, 0)
+    log.sync(now=0)
+    assert temp_path.stat().st_size == size
+    assert PersistentLog(temp_path).read() == [entry1, entry2]
+
+
+def test_torn_last_record_is_dropped_on_recovery(temp_path):
+    log = PersistentLog(temp_path)
+    entry1 = Entry(1, 'foo=1')
+    log.add_entry(entry1, 0, 0, 0)
+    log.add_entry(Entry(1, 'foo=2'), 1, 1, 0)
+    log.close()
+    with temp_path.open('r+b') as f:
+        f.truncate(temp_path.stat().st_size - 3)
+
+    recovered = PersistentLog(temp_path)
+    assert recovered.read() == [entry1]
+    entry2 = Entry(2, 'foo=3')
+    recovered.add_entry(entry2, 1, 1, 0)
+    recovered.sync(now=0)
+    assert PersistentLog(temp_path).read() == [entry1, entry2]
+
+
+def test_corrupt_record_is_dropped_on_recovery(temp_path):
+    log = PersistentLog(temp_path)
+    entry1 = Entry(1, 'foo=1')
+    log.add_entry(entry1, 0, 0, 0)
+    log.add_entry(Entry(1, 'foo=2'), 1, 1, 0)
+    log.close()
+    data = bytearray(temp_path.read_bytes())
+    data[-1] ^= 0xff
+    temp_path.write_bytes(bytes(data))
+    assert PersistentLog(temp_path).read() == [entry1]
+
+
+@pytest.fixture
+def fsyncs(monkeypatch):
+    calls = []
+    real_fsync = persistent_log.os.fsync
+    def counting_fsync(fd):
+        calls.append(fd)
+        real_fsync(fd)
+    monkeypatch.setattr(persistent_log.os, 'fsync', counting_fsync)
+    return calls
+
+
+def test_appends_are_not_written_or_durable_until_sync(temp_path):
+    log = PersistentLog(temp_path)
+    log.add_entry(Entry(1, 'foo=1'), 0, 0, 0)
+    log.add_entry(Entry(1, 'foo=2'), 1, 1, 0)
+    assert log.lastLogIndex == 2
+    assert log.durableIndex == 0
+    assert PersistentLog(temp_path).read() == []
+    log.sync(now=0)
+    assert log.durableIndex == 2
+    assert len(PersistentLog(temp_path).read()) == 2
+
+
+def test_per_batch_fsyncs_once_per_sync(temp_path, fsyncs):
+    log = PersistentLog(temp_path, durability='per-batch')
+    for i in range(10):
+        log.add_entry(Entry(1, f'foo={i}'), i, log.entry_term(i), 0)
+    log.sync(now=0)
+    assert len(fsyncs) == 1
+    log.sync(now=1)
+    assert len(fsyncs) == 1  # nothing new to fsync
+
+
+def test_durability_none_never_fsyncs(temp_path, fsyncs):
+    log = PersistentLog(temp_path, durability='none')
+    log.add_entry(Entry(1, 'foo=1'), 0, 0, 0)
+    log.sync(now=0)
+    assert fsyncs == []
+    assert log.durableIndex == 1
+
+
+def test_interval_durability_waits_for_interval_before_fsyncing(temp_path, fsyncs):
+    log = PersistentLog(temp_path, durability='interval=10ms')
+    log.add_entry(Entry(1, 'foo=1'), 0, 0, 0)
+    log.sync(now=1)
+    assert len(fsyncs) == 1
+    assert log.durableIndex == 1
+
+    log.add_entry(Entry(1, 'foo=2'), 1, 1, 0)
+    log.sync(now=1.005)
+    assert len(fsyncs) == 1
+    assert log.durableIndex == 1
+    log.sync(now=1.011)
+    assert len(fsyncs) == 2
+    assert log.durableIndex == 2
+
+
+def test_truncating_unsynced_entries_only_touches_the_buffer(temp_path):
+    log = PersistentLog(temp_path)
+    entry1 = Entry(1, 'foo=1')
+    log.add_entry(entry1, 0, 0, 0)
+    log.sync(now=0)
+    log.add_entry(Entry(1, 'foo=2'), 1, 1, 0)
+    entry3 = Entry(2, 'foo=3')
+    log.add_entry(entry3, 1, 1, 0)
+    log.sync(now=0)
+    assert PersistentLog(temp_path).read() == [entry1, entry3]
+
+
+def test_unknown_durability_policy():
+    with pytest.raises(ValueError):
+        PersistentLog(Path('/tmp/never-created'), durability='sometimes')
+
+
+def test_append_entries_batch_round_trips(temp_path):
+    log = PersistentLog(temp_path)
+    entries = [Entry(1, 'foo=1'), Entry(1, 'foo=2'), Entry(1, 'foo=3')]
+    assert log.append_entries(0, 0, entries)
+    log.sync(now=0)
+    replacements = [entries[1], Entry(2, 'bar=1')]
+    assert log.append_entries(1, 1, replacements)
+    log.sync(now=0)
+    assert PersistentLog(temp_path).read() == [entries[0]] + replacements
+
+
+def test_client_sessions_survive_a_restart(temp_path):
+    log = PersistentLog(temp_path)
+    entries = [
+        Entry(1, 'foo=1', session=Session('client-ü', seq=7, timestamp=1.5)),
+        Entry(1, 'foo=2'),
+    ]
+    log.append_entries(0, 0, entries)
+    log.sync(now=0)
+    assert PersistentLog(temp_path).read() == entries
+
+
+def test_compacted_log_survives_a_restart(temp_path):
+    log = PersistentLog(temp_path)
+    entries = [Entry(1, f'foo={i}') for i in range(5)]
+    log.append_entries(0, 0, entries)
+    log.sync(now=0)
+    log.compact(Snapshot(lastIncludedIndex=3, lastIncludedTerm=1, data=b'state'))
+    log.add_entry(Entry(2, 'foo=5'), 5, 1, 0)
+    log.sync(now=0)
+    log.close()
+    new_log = PersistentLog(temp_path)
+    assert new_log.snapshot == Snapshot(lastIncludedIndex=3, lastIncludedTerm=1, data=b'state')
+    assert new_log.read() == entries[3:] + [Entry(2, 'foo=5')]
+    assert new_log.lastLogIndex == 6
+
+
+def test_compacting_shrinks_the_segment(temp_path):
+    log = PersistentLog(temp_path)
+    log.append_entries(0, 0, [Entry(1, f'foo={i}') for i in range(100)])
+    log.sync(now=0)
+    size_before = temp_path.stat().st_size
+    log.compact(Snapshot(lastIncludedIndex=99, lastIncludedTerm=1, data=b''))
+    assert temp_path.stat().st_size < size_before / 10
+
+
+def test_truncating_after_compaction(temp_path):
+    log = PersistentLog(temp_path)
+    log.append_entries(0, 0, [Entry(1, f'foo={i}') for i in range(5)])
+    log.sync(now=0)
+    log.compact(Snapshot(lastIncludedIndex=2, lastIncludedTerm=1, data=b''))
+    log.add_entry(Entry(2, 'new'), 3, 1, 0)
+    log.sync(now=0)
+    log.close()
+    assert PersistentLog(temp_path).read() == [Entry(1, 'foo=2'), Entry(2, 'new')]
+
+
+def test_installed_snapshot_survives_a_restart(temp_path):
+    log = PersistentLog(temp_path)
+    log.append_entries(0, 0, [Entry(1, f'foo={i}') for i in range(3)])
+    log.sync(now=0)
+    log.install_snapshot(Snapshot(lastIncludedIndex=10, lastIncludedTerm=4, data=b'state'))
+    log.close()
+    new_log = PersistentLog(temp_path)
+    assert new_log.read() == []
+    assert new_log.lastLogIndex == 10
+    assert new_log.last_log_term == 4
+
+
+def test_crash_between_saving_snapshot_and_rewriting_segment(temp_path):
+    log = PersistentLog(temp_path)
+    entries = [Entry(1, f'foo={i}') for i in range(5)]
+    log.append_entries(0, 0, entries)
+    log.sync(now=0)
+    log._save_snapshot(Snapshot(lastIncludedIndex=3, lastIncludedTerm=1, data=b''))
+    log.close()
+    new_log = PersistentLog(temp_path)
+    assert new_log.read() == entries[3:]
+    assert new_log.lastLogIndex == 5
@@ -0,0 +1,17 @@
+from typing import List
+
+from raft.log import Entry, InMemoryLog
+
+
+class SlowToSyncLog(InMemoryLog):
+    """a log whose entries only become durable on sync()"""
+    def __init__(self, log: List[Entry]) -> None:
+        super().__init__(log)
+        self._durable = len(log)
+
+    @property
+    def durableIndex(self) -> int:
+        return min(self._durable, self.lastLogIndex)
+
+    def sync(self, now: float) -> None:
+        self._durable = self.lastLogIndex
@@ -21,8 +21,10 @@ def make_servers() -> Dict[str, Server]:
             Entry(term=int(c), cmd=f'foo={c}')
             for c in entries
         ])
+        # in the paper, the leader has just come to power in term 8
+        currentTerm = 8 if name == 'l' else int(entries[-1])
         args = dict(
-            name=name, peers=peers, now=0, log=log, currentTerm=int(entries[-1]), votedFor=None
+            name=name, peers=peers, now=0, log=log, currentTerm=currentTerm, votedFor=None
         )
         if name == 'l':
             servers[name] = Leader(**args)
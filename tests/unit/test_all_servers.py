@@ -5,7 +5,7 @@ from raft.messages import Message, AppendEntries, AppendEntriesFailed, RequestVo
 
 some_messages = [
     Message(frm="S2", to="S1", cmd=AppendEntries(term=5, leaderId="S2", prevLogIndex=22, prevLogTerm=4, entries=[], leaderCommit=9)),
-    Message(frm="S2", to="S1", cmd=AppendEntriesFailed(term=5)),
+    Message(frm="S2", to="S1", cmd=AppendEntriesFailed(term=5, conflictTerm=4, conflictIndex=20)),
     Message(frm="S2", to="S1", cmd=RequestVote(term=5, candidateId="S2", lastLogIndex=22, lastLogTerm=4)),
     Message(frm="S2", to="S1", cmd=VoteDenied(term=5)),
 ]
@@ -1,7 +1,9 @@
 import pytest
 from raft.server import Follower, Leader, Candidate
 from raft.log import InMemoryLog, Entry
-from raft.messages import Message, RequestVote, VoteGranted, VoteDenied
+from raft.messages import (
+    Message, AppendEntries, RequestVote, VoteGranted, VoteDenied, ClientSetCommand, ClientRedirect,
+)
 
 def make_candidate(peers=None) -> Candidate:
     if peers is None:
@@ -42,5 +44,40 @@ def test_becoming_leader_resets_leader_state_matchindex_and_nextindex():
     c.nextIndex = {"S1": 1, "S2": 2, "S3": 3}
     c.handle_message(Message(frm="S2", to="S1", cmd=VoteGranted()))
     assert isinstance(c, Leader)
-    c.matchIndex = {"S1": 0, "S2": 0, "S3": 0}
-    c.nextIndex = {"S1": 3, "S2": 3, "S3": 3}
+    assert c.matchIndex == {"S2": 0, "S3": 0}
+    assert c.nextIndex == {"S2": 3, "S3": 3}
+
+
+def test_new_leader_appends_a_noop_from_its_term_and_replicates_it():
+    c = make_candidate(peers=["S1", "S2", "S3"])
+    c.outbox.clear()
+    c.handle_message(Message(frm="S2", to="S1", cmd=VoteGranted()))
+    assert isinstance(c, Leader)
+    assert c.log.read()[-1] == Entry(term=11, cmd="")
+    [to_s2] = [m.cmd for m in c.outbox if m.to == "S2"]
+    assert isinstance(to_s2, AppendEntries)
+    assert to_s2.entries == [Entry(term=11, cmd="")]
+
+
+def test_candidate_redirects_clients_without_a_hint():
+    c = make_candidate()
+    c.outbox.clear()
+    c.handle_message(Message(frm="client.a", to="S1", cmd=ClientSetCommand(guid='g1', cmd="foo=1")))
+    assert c.outbox == [
+        Message(frm="S1", to="client.a", cmd=ClientRedirect(guid='g1', leaderHint=None))
+    ]
+
+
+def test_candidate_stands_again_if_the_election_times_out():
+    c = make_candidate()
+    c.outbox.clear()
+    c.clock_tick(c._election_timeout + 0.001)
+    assert c.currentTerm == 12
+    votes = [m.cmd for m in c.outbox if isinstance(m.cmd, RequestVote)]
+    assert len(votes) == len(c.outbox)
+    assert {v.term for v in votes} == {12}
+
+
+def test_next_deadline_is_the_election_timeout():
+    c = make_candidate()
+    assert c.next_deadline() == c._election_timeout
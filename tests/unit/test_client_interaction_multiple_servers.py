@@ -1,4 +1,3 @@
-import pytest
 from raft.adapters.network import FakeRaftNetwork
 from raft.adapters.run_server import clock_tick
 from raft.log import InMemoryLog, Entry
@@ -6,7 +5,6 @@ from raft.messages import Message, ClientSetCommand, ClientSetSucceeded
 from raft.server import Leader, Follower, HEARTBEAT_FREQUENCY
 
 
-@pytest.mark.xfail
 def test_client_gets_response_but_only_when_new_entry_is_on_a_majority_of_servers():
     peers = ["S1", "S2", "S3"]
     leader = Leader(
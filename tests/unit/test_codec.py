@@ -0,0 +1,134 @@
+import dataclasses
+from typing import Any, List, get_args
+
+import pytest
+from raft.adapters import codec
+from raft.log import Entry, Session
+from raft.messages import (
+    Message,
+    ClientSetCommand,
+    ClientSetSucceeded,
+    ClientGetCommand,
+    ClientGetSucceeded,
+    ClientRedirect,
+    AppendEntries,
+    AppendEntriesSucceeded,
+    AppendEntriesFailed,
+    InstallSnapshot,
+    InstallSnapshotSucceeded,
+    InstallSnapshotFailed,
+    ReadIndexRequest,
+    ReadIndexReply,
+    RequestVote,
+    VoteGranted,
+    VoteDenied,
+    PreVote,
+    PreVoteGranted,
+    PreVoteDenied,
+)
+
+EXAMPLES = [  # type: List[Any]
+    ClientSetCommand(guid='g1', cmd='foo=1'),
+    ClientSetCommand(guid='g2', cmd='foo=2', clientId='c1', seq=7),
+    ClientSetSucceeded(guid='g1'),
+    ClientGetCommand(guid='g3', key='foo'),
+    ClientGetCommand(guid='g3', key='foo', max_staleness=0.5),
+    ClientGetSucceeded(guid='g3', value='1'),
+    ClientGetSucceeded(guid='g3', value=None),
+    ClientRedirect(guid='g4', leaderHint='S2'),
+    ClientRedirect(guid='g4', leaderHint=None),
+    AppendEntries(term=3, leaderId='S1', prevLogIndex=10, prevLogTerm=2, entries=[], leaderCommit=9),
+    AppendEntries(
+        term=2**40, leaderId='S1', prevLogIndex=300, prevLogTerm=2, leaderCommit=299, seq=12,
+        electionTimeout=0.25, quiescent=True,
+        entries=[
+            Entry(term=3, cmd='foo=1'),
+            Entry(term=3, cmd='bar=2', session=Session(clientId='c1', seq=4, timestamp=1234.5)),
+            Entry(term=4, cmd=''),
+        ],
+    ),
+    AppendEntriesSucceeded(matchIndex=12, seq=3),
+    AppendEntriesFailed(term=3, conflictTerm=2, conflictIndex=5, seq=1),
+    InstallSnapshot(
+        term=3, leaderId='S1', lastIncludedIndex=100, lastIncludedTerm=2, offset=0,
+        data=bytes(range(256)), done=True,
+    ),
+    InstallSnapshotSucceeded(term=3, lastIncludedIndex=100, offset=256, done=True),
+    InstallSnapshotFailed(term=4),
+    ReadIndexRequest(term=3, readId=1),
+    ReadIndexReply(term=3, readId=1, readIndex=12),
+    RequestVote(term=4, candidateId='S2', lastLogIndex=12, lastLogTerm=3),
+    VoteGranted(),
+    VoteDenied(term=4),
+    PreVote(proposedTerm=5, candidateId='S2', lastLogIndex=12, lastLogTerm=3),
+    PreVoteGranted(proposedTerm=5),
+    PreVoteDenied(term=4),
+]
+
+
+@pytest.mark.parametrize('cmd', EXAMPLES, ids=lambda cmd: type(cmd).__name__)
+def test_round_trip(cmd):
+    msg = Message(frm='S1', to='S2', cmd=cmd)
+    assert codec.decode(codec.encode(msg)) == msg
+
+
+def test_every_message_type_and_field_has_a_schema():
+    message_types = get_args(Message.__annotations__['cmd'])
+    assert set(codec._SCHEMAS) == set(message_types)
+    assert {type(cmd) for cmd in EXAMPLES} == set(message_types)
+    for cls, (_, fields) in codec._SCHEMAS.items():
+        assert [name for name, _ in fields] == [f.name for f in dataclasses.fields(cls)]
+    tags = [tag for tag, _ in codec._SCHEMAS.values()]
+    assert len(set(tags)) == len(tags)
+
+
+def test_entries_that_arent_ascii():
+    entries = [Entry(term=1, cmd='naïve=1'), Entry(term=1, cmd='b=☃'), Entry(term=2, cmd='c=3')]
+    msg = Message(frm='S1', to='S2', cmd=AppendEntries(
+        term=2, leaderId='S1', prevLogIndex=0, prevLogTerm=0, entries=entries, leaderCommit=0,
+    ))
+    decoded = codec.decode(codec.encode(msg))
+    assert isinstance(decoded.cmd, AppendEntries)
+    assert decoded.cmd.entries == entries
+
+
+def test_decodes_from_a_slice_of_a_bigger_buffer():
+    msg = Message(frm='S1', to='S2', cmd=AppendEntriesSucceeded(matchIndex=3, seq=1))
+    encoded = codec.encode(msg)
+    buffer = bytearray(b'junk' + encoded + b'more junk')
+    assert codec.decode(memoryview(buffer)[4:4 + len(encoded)]) == msg
+
+
+def test_is_smaller_than_a_pickle():
+    import pickle  # pylint: disable=import-outside-toplevel
+    heartbeat = Message(frm='S1', to='S2', cmd=EXAMPLES[9])
+    assert len(codec.encode(heartbeat)) < len(pickle.dumps(heartbeat)) / 4
+
+
+@pytest.mark.parametrize('data, error', [
+    (b'', 'malformed'),
+    (b'\x01\x07', 'version'),
+    (b'\x02\xff', 'tag'),
+    (b'\x02\x07\x02S1\x02S2', 'malformed'),  # no fields
+    (b'\x02\x07\x02S1\x02S2\x03\x01\x00', 'left over'),
+    (b'\x02\x0f\x02S1\x09S2', 'truncated'),
+])
+def test_rejects_bad_messages(data, error):
+    with pytest.raises(codec.DecodeError, match=error):
+        codec.decode(data)
+
+
+def test_rejects_endless_varints_quickly():
+    data = b'\x02\x0f\x02S1\x02S2' + b'\xff' * 1_000_000
+    with pytest.raises(codec.DecodeError, match='varint'):
+        codec.decode(data)
+
+
+def test_round_trips_the_biggest_64_bit_ints():
+    msg = Message(frm='S1', to='S2', cmd=VoteDenied(term=2**64 - 1))
+    assert codec.decode(codec.encode(msg)) == msg
+
+
+def test_refuses_to_encode_negative_ints():
+    with pytest.raises(ValueError):
+        codec.encode(Message(frm='S1', to='S2', cmd=VoteDenied(term=-1)))
@@ -1,9 +1,12 @@
+import random
+from typing import Any, Dict, Set, Tuple
+
 import pytest
 from raft.adapters.network import FakeRaftNetwork
 from raft.adapters.run_server import clock_tick
 from raft.log import InMemoryLog, Entry
 from raft.messages import Message, ClientSetCommand
-from raft.server import Leader, Follower, Candidate, MIN_ELECTION_TIMEOUT
+from raft.server import Leader, Follower, Candidate, MIN_ELECTION_TIMEOUT, QUIESCENT_ELECTION_TIMEOUT
 import figure_7
 
 def make_follower(name, peers) -> Follower:
@@ -58,3 +61,84 @@ def test_figure_7_elections_always_get_committed_logs():
                     if m.to == n or m.frm == n:
                         print(m)
             assert terms[:9] == list(map(int, '111445566'))
+
+
+@pytest.mark.parametrize('pre_vote', [True, False])
+def test_flapping_follower_does_not_disrupt_the_leader_with_pre_vote(pre_vote):
+    # without pre-vote, S3 only disrupts things if it happens to time out
+    # again while it's reachable, so fix the timeouts it picks
+    random.seed(1)
+    peers = ["S1", "S2", "S3"]
+    servers = [
+        Leader(name="S1", peers=peers, now=0, log=InMemoryLog([]), currentTerm=1, votedFor=None,
+               pre_vote=pre_vote)
+    ] + [
+        Follower(name=n, peers=peers, now=0, log=InMemoryLog([]), currentTerm=1, votedFor=None,
+                 pre_vote=pre_vote)
+        for n in ["S2", "S3"]
+    ]
+    raftnet = FakeRaftNetwork([])
+    leaders_seen = set()  # type: Set[Tuple[str, int]]
+    for ms in range(1, 3000):
+        # S3 is cut off for 400ms of every 500, long enough to time out
+        if ms % 500 == 50:
+            raftnet.isolate("S3")
+        if ms % 500 == 450:
+            raftnet.heal("S3")
+        for s in servers:
+            clock_tick(s, raftnet, ms / 1000)
+        leaders_seen.update((s.name, s.currentTerm) for s in servers if isinstance(s, Leader))
+
+    if pre_vote:
+        assert leaders_seen == {("S1", 1)}
+    else:
+        assert len(leaders_seen) > 1
+
+
+def test_failover_is_quicker_with_timeouts_adapted_to_a_fast_network():
+    peers = ["S1", "S2", "S3"]
+    bounds = dict(min_election_timeout=0.02, max_election_timeout=1.0)  # type: Dict[str, Any]
+    servers = [
+        Leader(name="S1", peers=peers, now=0, log=InMemoryLog([]), currentTerm=1, votedFor=None, **bounds)
+    ] + [
+        Follower(name=n, peers=peers, now=0, log=InMemoryLog([]), currentTerm=1, votedFor=None, **bounds)
+        for n in ["S2", "S3"]
+    ]
+    raftnet = FakeRaftNetwork([])
+    for ms in range(1, 1000):
+        for s in servers:
+            clock_tick(s, raftnet, ms / 1000)
+    assert [s.currentTerm for s in servers] == [1, 1, 1]
+    assert all(s.election_timeout < MIN_ELECTION_TIMEOUT for s in servers)
+
+    raftnet.isolate("S1")
+    for ms in range(1000, 1000 + int(MIN_ELECTION_TIMEOUT * 1000)):
+        for s in servers:
+            clock_tick(s, raftnet, ms / 1000)
+    assert any(isinstance(s, Leader) and s.name != "S1" for s in servers)
+
+
+def test_quiet_cluster_keeps_its_leader_and_still_fails_over():
+    peers = ["S1", "S2", "S3", "S4", "S5"]
+    servers = [
+        Leader(name="S1", peers=peers, now=0, log=InMemoryLog([]), currentTerm=1, votedFor=None, quiesce=True)
+    ] + [
+        Follower(name=n, peers=peers, now=0, log=InMemoryLog([]), currentTerm=1, votedFor=None, quiesce=True)
+        for n in peers[1:]
+    ]
+    raftnet = FakeRaftNetwork([])
+    raftnet.dispatch(Message(frm="client.id", to="S1", cmd=ClientSetCommand(guid="g1", cmd="foo=1")))
+    for ms in range(1, 5000):
+        for s in servers:
+            clock_tick(s, raftnet, ms / 1000)
+    assert [s.currentTerm for s in servers] == [1] * 5
+    assert [s.lastApplied for s in servers] == [1] * 5
+    # about a heartbeat and its answer to each follower every QUIESCENT_HEARTBEAT_INTERVAL,
+    # rather than every HEARTBEAT_FREQUENCY (which would be 2000)
+    assert len([m for m in raftnet._message_backups if m.frm in peers and m.to in peers]) < 200
+
+    raftnet.isolate("S1")
+    for ms in range(5000, 5000 + int(2 * QUIESCENT_ELECTION_TIMEOUT * 1000)):
+        for s in servers:
+            clock_tick(s, raftnet, ms / 1000)
+    assert any(isinstance(s, Leader) and s.name != "S1" for s in servers)
@@ -1,11 +1,30 @@
 import pytest
-from raft.server import Follower, ELECTION_TIMEOUT_JITTER, MIN_ELECTION_TIMEOUT
-from raft.log import InMemoryLog, Entry
+from raft.server import (
+    Follower, Candidate, ELECTION_TIMEOUT_JITTER, MIN_ELECTION_TIMEOUT, REPLICATION_TIMEOUT,
+    QUIESCENT_ELECTION_TIMEOUT,
+)
+from raft.log import InMemoryLog, Entry, Snapshot
+from raft.state_machine import pack_snapshot
+from fake_logs import SlowToSyncLog
 from raft.messages import (
     AppendEntries,
     AppendEntriesSucceeded,
     AppendEntriesFailed,
+    InstallSnapshot,
+    InstallSnapshotSucceeded,
+    InstallSnapshotFailed,
     RequestVote,
+    VoteGranted,
+    PreVote,
+    PreVoteGranted,
+    PreVoteDenied,
+    ClientSetCommand,
+    ClientSetSucceeded,
+    ClientGetCommand,
+    ClientGetSucceeded,
+    ClientRedirect,
+    ReadIndexRequest,
+    ReadIndexReply,
     Message,
 )
 
@@ -192,7 +211,7 @@ def test_append_entries_failed_response():
         )
     )
     assert s.log.read() == old_entries
-    expected_response = AppendEntriesFailed(term=2)
+    expected_response = AppendEntriesFailed(term=2, conflictTerm=2, conflictIndex=2)
     assert s.outbox == [Message(frm="S2", to="S1", cmd=expected_response)]
 
 
@@ -222,7 +241,7 @@ def test_append_entries_failed_response_to_heartbeat():
         )
     )
     assert s.log.read() == old_entries
-    expected_response = AppendEntriesFailed(term=2)
+    expected_response = AppendEntriesFailed(term=2, conflictTerm=2, conflictIndex=2)
     assert s.outbox == [Message(frm="S2", to="S1", cmd=expected_response)]
 
 
@@ -251,6 +270,7 @@ def test_calls_election_if_clock_tick_past_election_timeout():
         log=InMemoryLog(log),
         currentTerm=3,
         votedFor=None,
+        pre_vote=False,
     )
     a_tiny_amount_of_time = 0.001
     f.clock_tick(a_tiny_amount_of_time)
@@ -279,3 +299,420 @@ def test_calls_election_if_clock_tick_past_election_timeout():
     a_tiny_amount_of_time = 0.001
     f.clock_tick(past_timeout + a_tiny_amount_of_time)
     assert f.outbox == expected_messages  # ie no change
+
+
+def test_append_entries_success_is_only_sent_once_entries_are_durable():
+    s = Follower(
+        name="S2",
+        peers=["S1", "S2", "S3"],
+        now=1,
+        log=SlowToSyncLog([]),
+        currentTerm=1,
+        votedFor=None,
+    )
+    s.handle_message(
+        Message(
+            frm="S1",
+            to="S2",
+            cmd=AppendEntries(
+                term=1,
+                leaderId="S1",
+                prevLogIndex=0,
+                prevLogTerm=0,
+                leaderCommit=0,
+                entries=[Entry(term=1, cmd="foo=bar")],
+            ),
+        )
+    )
+    assert s.outbox == []
+    s.flush()
+    expected_response = AppendEntriesSucceeded(matchIndex=1)
+    assert s.outbox == [Message(frm="S2", to="S1", cmd=expected_response)]
+
+
+def test_append_entries_failed_gives_first_index_of_conflicting_term():
+    old_entries = [Entry(term=t, cmd=f"e={t}") for t in [1, 1, 2, 2, 2, 3]]
+    s = Follower(
+        name="S2", peers=["S1", "S2", "S3"], now=1, log=InMemoryLog(old_entries),
+        currentTerm=4, votedFor=None,
+    )
+    s.handle_message(
+        Message(
+            frm="S1",
+            to="S2",
+            cmd=AppendEntries(
+                term=4, leaderId="S1", prevLogIndex=5, prevLogTerm=4, leaderCommit=0, entries=[],
+            ),
+        )
+    )
+    expected_response = AppendEntriesFailed(term=4, conflictTerm=2, conflictIndex=3)
+    assert s.outbox == [Message(frm="S2", to="S1", cmd=expected_response)]
+
+
+def test_append_entries_failed_when_log_too_short_gives_log_length():
+    old_entries = [Entry(term=1, cmd="e=1"), Entry(term=1, cmd="e=2")]
+    s = Follower(
+        name="S2", peers=["S1", "S2", "S3"], now=1, log=InMemoryLog(old_entries),
+        currentTerm=4, votedFor=None,
+    )
+    s.handle_message(
+        Message(
+            frm="S1",
+            to="S2",
+            cmd=AppendEntries(
+                term=4, leaderId="S1", prevLogIndex=7, prevLogTerm=4, leaderCommit=0, entries=[],
+            ),
+        )
+    )
+    expected_response = AppendEntriesFailed(term=4, conflictTerm=0, conflictIndex=3)
+    assert s.outbox == [Message(frm="S2", to="S1", cmd=expected_response)]
+
+
+def _snapshot_chunk(offset: int, data: bytes, done: bool) -> Message:
+    return Message(
+        frm="S1",
+        to="S2",
+        cmd=InstallSnapshot(
+            term=2, leaderId="S1", lastIncludedIndex=5, lastIncludedTerm=2,
+            offset=offset, data=data, done=done,
+        ),
+    )
+
+
+def test_follower_installs_a_snapshot_sent_in_chunks():
+    s = Follower(
+        name="S2", peers=["S1", "S2"], now=1,
+        log=InMemoryLog([Entry(term=1, cmd="e=1")]), currentTerm=2, votedFor=None,
+    )
+    data = pack_snapshot(b'{"foo": "bar"}')
+    s.handle_message(_snapshot_chunk(0, data[:8], done=False))
+    assert s.log.snapshot.lastIncludedIndex == 0
+    s.handle_message(_snapshot_chunk(8, data[8:], done=True))
+    assert s.log.snapshot == Snapshot(lastIncludedIndex=5, lastIncludedTerm=2, data=data)
+    assert s.log.lastLogIndex == 5
+    assert s.commitIndex == 5
+    assert [m.cmd for m in s.outbox] == [
+        InstallSnapshotSucceeded(term=2, lastIncludedIndex=5, offset=8, done=False),
+        InstallSnapshotSucceeded(term=2, lastIncludedIndex=5, offset=len(data), done=True),
+    ]
+    s.flush()
+    assert s.lastApplied == 5
+    assert s.applier.read("foo") == "bar"
+
+
+def test_follower_asks_for_a_missed_snapshot_chunk_again():
+    s = Follower(
+        name="S2", peers=["S1", "S2"], now=1, log=InMemoryLog([]), currentTerm=2, votedFor=None,
+    )
+    s.handle_message(_snapshot_chunk(0, b'0123', done=False))
+    s.outbox.clear()
+    s.handle_message(_snapshot_chunk(8, b'89', done=True))
+    assert s.log.snapshot.lastIncludedIndex == 0
+    assert [m.cmd for m in s.outbox] == [
+        InstallSnapshotSucceeded(term=2, lastIncludedIndex=5, offset=4, done=False),
+    ]
+
+
+def test_follower_refuses_a_snapshot_from_a_deposed_leader():
+    s = Follower(
+        name="S2", peers=["S1", "S2"], now=1, log=InMemoryLog([]), currentTerm=5, votedFor=None,
+    )
+    election_timeout = s._election_timeout
+    s.handle_message(_snapshot_chunk(0, pack_snapshot(b'{}'), done=True))
+    assert s.leaderId is None
+    assert s._election_timeout == election_timeout
+    assert s.log.snapshot.lastIncludedIndex == 0
+    assert s.outbox == [Message(frm="S2", to="S1", cmd=InstallSnapshotFailed(term=5))]
+
+
+def test_follower_refuses_entries_from_a_deposed_leader_from_before_its_snapshot():
+    log = InMemoryLog([Entry(term=1, cmd=f"e={i}") for i in range(5)])
+    log.compact(Snapshot(lastIncludedIndex=4, lastIncludedTerm=1, data=b''))
+    s = Follower(name="S2", peers=["S1", "S2"], now=1, log=log, currentTerm=3, votedFor=None)
+    s.handle_message(Message(
+        frm="S1",
+        to="S2",
+        cmd=AppendEntries(
+            term=2, leaderId="S1", prevLogIndex=2, prevLogTerm=1, leaderCommit=2,
+            entries=[Entry(term=2, cmd="old=news")], seq=7,
+        ),
+    ))
+    assert s.leaderId is None
+    assert s.log.lastLogIndex == 5
+    expected_response = AppendEntriesFailed(term=3, conflictTerm=0, conflictIndex=0, seq=7)
+    assert s.outbox == [Message(frm="S2", to="S1", cmd=expected_response)]
+
+
+def test_follower_never_points_a_leader_into_its_snapshot():
+    log = InMemoryLog([Entry(term=1, cmd=f"e={i}") for i in range(5)])
+    log.compact(Snapshot(lastIncludedIndex=4, lastIncludedTerm=1, data=b''))
+    s = Follower(name="S2", peers=["S1", "S2"], now=1, log=log, currentTerm=3, votedFor=None)
+    assert s._conflict_with(2) == AppendEntriesFailed(term=3, conflictTerm=0, conflictIndex=5)
+    assert s._conflict_with(5) == AppendEntriesFailed(term=3, conflictTerm=1, conflictIndex=5)
+
+
+def test_follower_advances_commitIndex_up_to_its_last_new_entry():
+    old_entries = [Entry(term=1, cmd=f"e={i}") for i in range(5)]
+    s = Follower(
+        name="S2", peers=["S1", "S2", "S3"], now=1, log=InMemoryLog(old_entries),
+        currentTerm=2, votedFor=None,
+    )
+    s.handle_message(
+        Message(
+            frm="S1",
+            to="S2",
+            cmd=AppendEntries(
+                term=2, leaderId="S1", prevLogIndex=2, prevLogTerm=1, leaderCommit=4,
+                entries=[Entry(term=1, cmd="e=2")],
+            ),
+        )
+    )
+    # entries after 3 might not match the leader's, so they can't be committed yet
+    assert s.commitIndex == 3
+    s.handle_message(
+        Message(
+            frm="S1",
+            to="S2",
+            cmd=AppendEntries(
+                term=2, leaderId="S1", prevLogIndex=5, prevLogTerm=1, leaderCommit=4, entries=[],
+            ),
+        )
+    )
+    assert s.commitIndex == 4
+
+
+def test_append_entries_from_an_old_term_are_rejected_with_seq_echoed():
+    s = Follower(
+        name="S2", peers=["S1", "S2", "S3"], now=1, log=InMemoryLog([Entry(term=1, cmd="e=1")]),
+        currentTerm=3, votedFor=None,
+    )
+    s.handle_message(
+        Message(
+            frm="S1",
+            to="S2",
+            cmd=AppendEntries(
+                term=2, leaderId="S1", prevLogIndex=1, prevLogTerm=1, leaderCommit=0,
+                entries=[Entry(term=2, cmd="e=2")], seq=7,
+            ),
+        )
+    )
+    assert s.log.lastLogIndex == 1
+    [reply] = s.outbox
+    assert isinstance(reply.cmd, AppendEntriesFailed)
+    assert (reply.cmd.term, reply.cmd.seq) == (3, 7)
+
+
+def test_in_lease_mode_votes_are_ignored_while_the_leader_may_hold_a_lease():
+    s = Follower(
+        name="S2", peers=["S1", "S2", "S3"], now=1, log=InMemoryLog([]),
+        currentTerm=1, votedFor=None, lease_reads=True,
+    )
+    s.handle_message(Message(frm="S1", to="S2", cmd=AppendEntries(
+        term=1, leaderId="S1", prevLogIndex=0, prevLogTerm=0, leaderCommit=0, entries=[],
+    )))
+    s.outbox.clear()
+    vote_request = Message(
+        frm="S3", to="S2", cmd=RequestVote(term=2, candidateId="S3", lastLogIndex=0, lastLogTerm=0)
+    )
+    s.now = 1 + MIN_ELECTION_TIMEOUT - 0.001
+    s.handle_message(vote_request)
+    assert s.currentTerm == 1
+    assert s.outbox == []
+    s.now = 1 + MIN_ELECTION_TIMEOUT
+    s.handle_message(vote_request)
+    assert s.currentTerm == 2
+    assert s.outbox == [Message(frm="S2", to="S3", cmd=VoteGranted())]
+
+
+def _follower_hearing_from_S1() -> Follower:
+    s = Follower(
+        name="S2", peers=["S1", "S2", "S3"], now=1,
+        log=InMemoryLog([Entry(term=1, cmd="foo=1")]), currentTerm=1, votedFor=None,
+    )
+    s.handle_message(Message(frm="S1", to="S2", cmd=AppendEntries(
+        term=1, leaderId="S1", prevLogIndex=1, prevLogTerm=1, leaderCommit=0, entries=[],
+    )))
+    s.flush()
+    s.outbox.clear()
+    return s
+
+
+def test_follower_asks_the_leader_for_a_read_index_once_per_tick():
+    s = _follower_hearing_from_S1()
+    s.handle_message(Message(frm="client.a", to="S2", cmd=ClientGetCommand(guid='g1', key="foo")))
+    s.handle_message(Message(frm="client.b", to="S2", cmd=ClientGetCommand(guid='g2', key="foo")))
+    s.flush()
+    assert s.outbox == [Message(frm="S2", to="S1", cmd=ReadIndexRequest(term=1, readId=1))]
+
+
+def test_follower_answers_reads_once_it_has_applied_up_to_the_read_index():
+    s = _follower_hearing_from_S1()
+    s.handle_message(Message(frm="client.a", to="S2", cmd=ClientGetCommand(guid='g1', key="foo")))
+    s.flush()
+    s.outbox.clear()
+    s.handle_message(Message(frm="S1", to="S2", cmd=ReadIndexReply(term=1, readId=1, readIndex=1)))
+    s.flush()
+    assert s.outbox == []
+    s.handle_message(Message(frm="S1", to="S2", cmd=AppendEntries(
+        term=1, leaderId="S1", prevLogIndex=1, prevLogTerm=1, leaderCommit=1, entries=[],
+    )))
+    s.flush()
+    replies = [m for m in s.outbox if m.to == "client.a"]
+    assert replies == [Message(frm="S2", to="client.a", cmd=ClientGetSucceeded(guid='g1', value="1"))]
+
+
+def test_follower_answers_bounded_staleness_reads_itself():
+    s = _follower_hearing_from_S1()
+    s.now = 1.05
+    s.handle_message(Message(
+        frm="client.a", to="S2", cmd=ClientGetCommand(guid='g1', key="foo", max_staleness=0.1)
+    ))
+    assert s.outbox == [Message(frm="S2", to="client.a", cmd=ClientGetSucceeded(guid='g1', value=None))]
+    s.outbox.clear()
+    s.now = 1.2
+    s.handle_message(Message(
+        frm="client.a", to="S2", cmd=ClientGetCommand(guid='g2', key="foo", max_staleness=0.1)
+    ))
+    s.flush()
+    assert s.outbox == [Message(frm="S2", to="S1", cmd=ReadIndexRequest(term=1, readId=1))]
+
+
+def test_follower_redirects_reads_if_the_leader_doesnt_answer():
+    s = _follower_hearing_from_S1()
+    s.handle_message(Message(frm="client.a", to="S2", cmd=ClientGetCommand(guid='g1', key="foo")))
+    s.flush()
+    s.outbox.clear()
+    s.clock_tick(1 + REPLICATION_TIMEOUT + 0.001)
+    assert s.outbox == [
+        Message(frm="S2", to="client.a", cmd=ClientRedirect(guid='g1', leaderHint="S1"))
+    ]
+
+
+def test_follower_with_no_leader_redirects_reads():
+    s = Follower(
+        name="S2", peers=["S1", "S2", "S3"], now=1, log=InMemoryLog([]), currentTerm=1, votedFor=None,
+    )
+    s.handle_message(Message(frm="client.a", to="S2", cmd=ClientGetCommand(guid='g1', key="foo")))
+    s.flush()
+    assert s.outbox == [
+        Message(frm="S2", to="client.a", cmd=ClientRedirect(guid='g1', leaderHint=None))
+    ]
+
+
+def test_follower_forwards_client_commands_to_the_leader_and_relays_the_answer():
+    s = _follower_hearing_from_S1()
+    set_foo = ClientSetCommand(guid='g1', cmd="foo=2")
+    s.handle_message(Message(frm="client.a", to="S2", cmd=set_foo))
+    assert s.outbox == [Message(frm="S2", to="S1", cmd=set_foo)]
+    s.outbox.clear()
+    s.handle_message(Message(frm="S1", to="S2", cmd=ClientSetSucceeded(guid='g1')))
+    assert s.outbox == [Message(frm="S2", to="client.a", cmd=ClientSetSucceeded(guid='g1'))]
+
+
+def test_follower_redirects_client_commands_if_not_forwarding():
+    s = _follower_hearing_from_S1()
+    s.forward_client_commands = False
+    s.handle_message(Message(frm="client.a", to="S2", cmd=ClientSetCommand(guid='g1', cmd="foo=2")))
+    assert s.outbox == [
+        Message(frm="S2", to="client.a", cmd=ClientRedirect(guid='g1', leaderHint="S1"))
+    ]
+
+
+def test_follower_doesnt_pass_on_commands_forwarded_by_a_peer():
+    s = _follower_hearing_from_S1()
+    s.handle_message(Message(frm="S3", to="S2", cmd=ClientSetCommand(guid='g1', cmd="foo=2")))
+    assert s.outbox == [
+        Message(frm="S2", to="S3", cmd=ClientRedirect(guid='g1', leaderHint="S1"))
+    ]
+
+
+def test_forwarded_commands_are_redirected_when_the_term_changes():
+    s = _follower_hearing_from_S1()
+    s.handle_message(Message(frm="client.a", to="S2", cmd=ClientSetCommand(guid='g1', cmd="foo=2")))
+    s.outbox.clear()
+    s.handle_message(Message(frm="S3", to="S2", cmd=AppendEntries(
+        term=2, leaderId="S3", prevLogIndex=1, prevLogTerm=1, leaderCommit=0, entries=[],
+    )))
+    assert s.leaderId == "S3"
+    assert s.outbox[0] == Message(frm="S2", to="client.a", cmd=ClientRedirect(guid='g1', leaderHint="S3"))
+
+
+def test_follower_asks_for_pre_votes_before_standing():
+    f = Follower(
+        name="S2", peers=["S1", "S2", "S3"], now=0,
+        log=InMemoryLog([Entry(2, "foo=1")]), currentTerm=3, votedFor=None,
+    )
+    f.clock_tick(1)
+    assert f.currentTerm == 3
+    assert f.votedFor is None
+    assert [m.cmd for m in f.outbox] == [
+        PreVote(proposedTerm=4, candidateId="S2", lastLogIndex=1, lastLogTerm=2)
+    ] * 2
+    f.outbox.clear()
+    f.handle_message(Message(frm="S3", to="S2", cmd=PreVoteGranted(proposedTerm=4)))
+    assert isinstance(f, Candidate)
+    assert f.currentTerm == 4
+    assert [m.cmd for m in f.outbox] == [
+        RequestVote(term=4, candidateId="S2", lastLogIndex=1, lastLogTerm=2)
+    ] * 2
+
+
+def test_pre_vote_is_refused_while_we_hear_from_a_leader():
+    s = _follower_hearing_from_S1()
+    pre_vote = Message(
+        frm="S3", to="S2", cmd=PreVote(proposedTerm=2, candidateId="S3", lastLogIndex=1, lastLogTerm=1)
+    )
+    s.handle_message(pre_vote)
+    assert s.outbox == [Message(frm="S2", to="S3", cmd=PreVoteDenied(term=1))]
+    s.outbox.clear()
+    s.now = 1 + MIN_ELECTION_TIMEOUT
+    s.handle_message(pre_vote)
+    assert s.outbox == [Message(frm="S2", to="S3", cmd=PreVoteGranted(proposedTerm=2))]
+    assert s.currentTerm == 1
+
+
+def test_follower_takes_the_leaders_election_timeout_within_its_bounds():
+    s = Follower(
+        name="S2", peers=["S1", "S2", "S3"], now=1, log=InMemoryLog([]), currentTerm=1, votedFor=None,
+        min_election_timeout=0.05, max_election_timeout=1.0,
+    )
+    for timeout, expected in [(0.08, 0.08), (0.01, 0.05), (0.0, 0.05)]:
+        s.handle_message(Message(frm="S1", to="S2", cmd=AppendEntries(
+            term=1, leaderId="S1", prevLogIndex=0, prevLogTerm=0, leaderCommit=0, entries=[],
+            electionTimeout=timeout,
+        )))
+        assert s.election_timeout == expected
+
+
+def test_follower_of_a_quiet_leader_waits_longer_to_hear_from_it():
+    s = Follower(
+        name="S2", peers=["S1", "S2", "S3"], now=1, log=InMemoryLog([]), currentTerm=1, votedFor=None,
+    )
+    s.handle_message(Message(frm="S1", to="S2", cmd=AppendEntries(
+        term=1, leaderId="S1", prevLogIndex=0, prevLogTerm=0, leaderCommit=0, entries=[], quiescent=True,
+    )))
+    s.outbox.clear()
+    s.clock_tick(1 + MIN_ELECTION_TIMEOUT + ELECTION_TIMEOUT_JITTER + 0.001)
+    assert s.outbox == []
+    pre_vote = Message(
+        frm="S3", to="S2", cmd=PreVote(proposedTerm=2, candidateId="S3", lastLogIndex=0, lastLogTerm=0)
+    )
+    s.handle_message(pre_vote)
+    assert s.outbox == [Message(frm="S2", to="S3", cmd=PreVoteDenied(term=1))]
+    s.outbox.clear()
+
+    s.clock_tick(1 + QUIESCENT_ELECTION_TIMEOUT + ELECTION_TIMEOUT_JITTER + 0.001)
+    assert {type(m.cmd) for m in s.outbox} == {PreVote}
+
+
+def test_next_deadline_is_the_election_timeout_or_a_read_index_request_timing_out():
+    s = Follower(
+        name="S2", peers=["S1", "S2", "S3"], now=1, log=InMemoryLog([]), currentTerm=1, votedFor=None,
+    )
+    assert s.next_deadline() == s._election_timeout
+    s.handle_message(Message(frm="S1", to="S2", cmd=AppendEntries(
+        term=1, leaderId="S1", prevLogIndex=0, prevLogTerm=0, leaderCommit=0, entries=[],
+    )))
+    s.handle_message(Message(frm="client.id", to="S2", cmd=ClientGetCommand(guid="g", key="foo")))
+    s.flush()
+    assert s.next_deadline() == 1 + REPLICATION_TIMEOUT
@@ -1,14 +1,45 @@
+from typing import List
+
 import pytest
-from raft.server import Server, Leader, HEARTBEAT_FREQUENCY
-from raft.log import InMemoryLog, Entry
+from raft.server import (
+    Server, Leader, Follower, MatchIndexes, HEARTBEAT_FREQUENCY, REPLICATION_TIMEOUT,
+    MIN_ELECTION_TIMEOUT, MAX_CLOCK_DRIFT, CHECK_QUORUM_TIMEOUT, RTT_MULTIPLIER,
+    QUIESCENT_HEARTBEAT_INTERVAL, BUSY_POLL_INTERVAL,
+)
+from raft.log import InMemoryLog, Entry, Session, Snapshot
+from raft.state_machine import InlineApplier, KeyValueStore, pack_snapshot
+from fake_logs import SlowToSyncLog
 from raft.messages import (
     AppendEntries,
     AppendEntriesSucceeded,
     AppendEntriesFailed,
     Message,
     ClientSetCommand,
+    InstallSnapshot,
+    InstallSnapshotSucceeded,
+    InstallSnapshotFailed,
+    ClientSetSucceeded,
+    ClientGetCommand,
+    ClientGetSucceeded,
+    ClientRedirect,
+    ReadIndexRequest,
+    ReadIndexReply,
+    PreVote,
+    PreVoteDenied,
+    VoteGranted,
 )
 
+
+def _append_entries(msg: Message) -> AppendEntries:
+    assert isinstance(msg.cmd, AppendEntries)
+    return msg.cmd
+
+
+def _install_snapshot(msg: Message) -> InstallSnapshot:
+    assert isinstance(msg.cmd, InstallSnapshot)
+    return msg.cmd
+
+
 def test_init():
     peers = ["S1", "S2", "S3"]
     old_entries = [Entry(term=1, cmd="old=1"), Entry(term=2, cmd="old=2")]
@@ -25,6 +56,10 @@ def test_handle_client_set_updates_local_log_and_puts_AppendEntries_in_outbox():
     s = Leader(name="S1", now=1, log=log, peers=peers, currentTerm=2, votedFor=None)
 
     s.handle_message(Message(frm="client.id", to="S1", cmd=ClientSetCommand(guid='gaga', cmd="foo=bar")))
+    # buffered until the end of the tick
+    assert s.log.read() == old_entries
+    assert s.outbox == []
+    s.flush()
     expected_entry = Entry(term=2, cmd="foo=bar")
     assert s.log.read() == old_entries + [expected_entry]
     expected_appendentries = AppendEntries(
@@ -82,12 +117,14 @@ def test_duplicate_appendentries_responses_do_not_double_increment_index_counter
         Message(frm="S2", to="S1", cmd=AppendEntriesSucceeded(matchIndex=2))
     )
     assert s.matchIndex["S2"] == 2
-    assert s.nextIndex["S2"] == 3
+    assert s.nextIndex["S2"] == 4  # entry 3 has been sent
+    assert len(s.outbox) == 1
     s.handle_message(
         Message(frm="S2", to="S1", cmd=AppendEntriesSucceeded(matchIndex=2))
     )
     assert s.matchIndex["S2"] == 2
-    assert s.nextIndex["S2"] == 3
+    assert s.nextIndex["S2"] == 4
+    assert len(s.outbox) == 1
 
 
 def test_failed_appendentries_decrements_nextindex_and_adds_new_AppendEntries_to_outbox():
@@ -95,10 +132,10 @@ def test_failed_appendentries_decrements_nextindex_and_adds_new_AppendEntries_to
     old_entries = [Entry(term=1, cmd="old=1"), Entry(term=2, cmd="old=2")]
     log = InMemoryLog(old_entries)
     s = Leader(name="S1", now=1, log=log, peers=peers, currentTerm=2, votedFor=None)
-    s.matchIndex["S2"] = 2  # arbitrarily
+    s.matchIndex["S2"] = 0
     s.nextIndex["S2"] = 2  # arbitrarily
-    s.handle_message(Message(frm="S2", to="S1", cmd=AppendEntriesFailed(term=2)))
-    assert s.matchIndex["S2"] == 2  # should not move
+    s.handle_message(Message(frm="S2", to="S1", cmd=AppendEntriesFailed(term=2, conflictTerm=0, conflictIndex=1)))
+    assert s.matchIndex["S2"] == 0  # should not move
     assert s.nextIndex["S2"] == 1
     assert s.outbox == [
         Message(
@@ -110,7 +147,8 @@ def test_failed_appendentries_decrements_nextindex_and_adds_new_AppendEntries_to
                 prevLogIndex=0,
                 prevLogTerm=0,
                 leaderCommit=0,
-                entries=[old_entries[0]],
+                entries=old_entries,
+                seq=1,  # the probe starts a round of its own
             ),
         )
     ]
@@ -123,7 +161,7 @@ def test_failed_appendentries_cannot_take_nextIndex_below_one():
     s = Leader(name="S1", now=1, log=log, peers=peers, currentTerm=2, votedFor=None)
     s.nextIndex["S2"] = 1
 
-    s.handle_message(Message(frm="S2", to="S1", cmd=AppendEntriesFailed(term=2)))
+    s.handle_message(Message(frm="S2", to="S1", cmd=AppendEntriesFailed(term=2, conflictTerm=0, conflictIndex=1)))
     assert s.nextIndex["S2"] == 1
 
 
@@ -136,11 +174,11 @@ def test_duplicate_failed_appendentries_do_not_double_decrement_or_double_reappe
     s.nextIndex["S2"] = 3
     s.matchIndex["S2"] = 2  # arbitrarily
 
-    s.handle_message(Message(frm="S2", to="S1", cmd=AppendEntriesFailed(term=2)))
+    s.handle_message(Message(frm="S2", to="S1", cmd=AppendEntriesFailed(term=2, conflictTerm=0, conflictIndex=2)))
     assert s.matchIndex["S2"] == 2
     assert s.nextIndex["S2"] == 2
 
-    s.handle_message(Message(frm="S2", to="S1", cmd=AppendEntriesFailed(term=2)))
+    s.handle_message(Message(frm="S2", to="S1", cmd=AppendEntriesFailed(term=2, conflictTerm=0, conflictIndex=2)))
     assert s.matchIndex["S2"] == 2
     assert s.nextIndex["S2"] == 2  # do we care?
     assert s.outbox == [
@@ -188,7 +226,9 @@ def test_clock_tick_gives_first_heartbeat():
     peers = ["S1", "S2", "S3", "S4", "S5"]
     old_entries = [Entry(term=1, cmd="old=1"), Entry(term=2, cmd="old=2")]
     log = InMemoryLog(old_entries)
-    s = Leader(name="S1", now=1, log=log, peers=peers, currentTerm=2, votedFor=None)
+    s = Leader(
+        name="S1", now=1, log=log, peers=peers, currentTerm=2, votedFor=None, check_quorum=False,
+    )
     s.clock_tick(now=2)
     assert 2 - 1 > HEARTBEAT_FREQUENCY
 
@@ -199,6 +239,7 @@ def test_clock_tick_gives_first_heartbeat():
         prevLogTerm=2,
         leaderCommit=0,
         entries=[],
+        seq=1,  # every heartbeat starts a new round
     )
     assert s.outbox == [
         Message(frm="S1", to=s, cmd=expected_appendentries) for s in peers if s != "S1"
@@ -209,7 +250,9 @@ def test_heartbeat_is_custom_for_each_follower_based_on_nextIndex():
     peers = ["S1", "S2", "S3", "S4", "S5"]
     old_entries = [Entry(term=1, cmd="old=1"), Entry(term=2, cmd="old=2")]
     log = InMemoryLog(old_entries)
-    s = Leader(name="S1", now=1, log=log, peers=peers, currentTerm=2, votedFor=None)
+    s = Leader(
+        name="S1", now=1, log=log, peers=peers, currentTerm=2, votedFor=None, check_quorum=False,
+    )
     s.nextIndex['S2'] = 1
     s.nextIndex['S3'] = 2
     s.nextIndex['S4'] = 3
@@ -226,6 +269,7 @@ def test_heartbeat_is_custom_for_each_follower_based_on_nextIndex():
             prevLogTerm=0,
             leaderCommit=0,
             entries=[],
+            seq=1,
         )),
         Message(
             frm='S1', to='S3', cmd=AppendEntries(
@@ -235,6 +279,7 @@ def test_heartbeat_is_custom_for_each_follower_based_on_nextIndex():
             prevLogTerm=1,
             leaderCommit=0,
             entries=[],
+            seq=1,
         )),
         Message(
             frm='S1', to='S4', cmd=AppendEntries(
@@ -244,6 +289,7 @@ def test_heartbeat_is_custom_for_each_follower_based_on_nextIndex():
             prevLogTerm=2,
             leaderCommit=0,
             entries=[],
+            seq=1,
         )),
         Message(
             frm='S1', to='S5', cmd=AppendEntries(
@@ -253,6 +299,7 @@ def test_heartbeat_is_custom_for_each_follower_based_on_nextIndex():
             prevLogTerm=2,
             leaderCommit=0,
             entries=[],
+            seq=1,
         )),
     ]
 
@@ -311,3 +358,744 @@ def test_updates_commitIndex_on_quorum_AppendEntriesSucceeded():
         Message(frm="S3", to="S1", cmd=AppendEntriesSucceeded(matchIndex=1))
     )
     assert s.commitIndex == 1
+
+
+def test_leader_only_counts_itself_towards_commit_once_its_log_is_durable():
+    peers = ["S1", "S2", "S3"]
+    s = Leader(name="S1", now=1, log=SlowToSyncLog([]), peers=peers, currentTerm=1, votedFor=None)
+    s.handle_message(Message(frm="client.id", to="S1", cmd=ClientSetCommand(guid='gaga', cmd="foo=bar")))
+    s.handle_message(
+        Message(frm="S2", to="S1", cmd=AppendEntriesSucceeded(matchIndex=1))
+    )
+    assert s.commitIndex == 0
+    s.flush()
+    assert s.commitIndex == 1
+
+
+def test_append_entries_batch_is_limited_by_max_entries():
+    peers = ["S1", "S2", "S3"]
+    old_entries = [Entry(term=1, cmd=f"old={i}") for i in range(10)]
+    log = InMemoryLog(old_entries)
+    s = Leader(name="S1", now=1, log=log, peers=peers, currentTerm=1, votedFor=None, max_entries=4, max_inflight=1)
+    s.handle_message(
+        Message(frm="S2", to="S1", cmd=AppendEntriesSucceeded(matchIndex=2))
+    )
+    [msg] = map(_append_entries, s.outbox)
+    assert msg.prevLogIndex == 2
+    assert msg.entries == old_entries[2:6]
+
+
+def test_append_entries_batch_is_limited_by_max_bytes_but_always_sends_one():
+    peers = ["S1", "S2", "S3"]
+    old_entries = [
+        Entry(term=1, cmd="a=1"), Entry(term=1, cmd="b=2"), Entry(term=1, cmd="c=3"),
+        Entry(term=1, cmd="big=" + "x" * 100), Entry(term=1, cmd="d=4"),
+    ]
+    log = InMemoryLog(old_entries)
+    s = Leader(name="S1", now=1, log=log, peers=peers, currentTerm=1, votedFor=None, max_bytes=7, max_inflight=1)
+    s.handle_message(
+        Message(frm="S2", to="S1", cmd=AppendEntriesSucceeded(matchIndex=0))
+    )
+    s.handle_message(
+        Message(frm="S2", to="S1", cmd=AppendEntriesSucceeded(matchIndex=3))
+    )
+    [first, second] = map(_append_entries, s.outbox)
+    assert first.entries == old_entries[0:2]
+    assert second.entries == [old_entries[3]]
+
+
+def test_pipelines_batches_up_to_max_inflight_once_logs_match():
+    peers = ["S1", "S2", "S3"]
+    old_entries = [Entry(term=1, cmd=f"old={i}") for i in range(10)]
+    s = Leader(
+        name="S1", now=1, log=InMemoryLog(old_entries), peers=peers, currentTerm=1, votedFor=None,
+        max_entries=2, max_inflight=3,
+    )
+    s.handle_message(
+        Message(frm="S2", to="S1", cmd=AppendEntriesSucceeded(matchIndex=0))
+    )
+    assert [_append_entries(m).prevLogIndex for m in s.outbox] == [0, 2, 4]
+    assert s.nextIndex["S2"] == 7
+
+    s.outbox.clear()
+    s.handle_message(
+        Message(frm="S2", to="S1", cmd=AppendEntriesSucceeded(matchIndex=2))
+    )
+    assert [_append_entries(m).prevLogIndex for m in s.outbox] == [6]
+    assert s.nextIndex["S2"] == 9
+
+
+def test_only_one_probe_in_flight_until_logs_match():
+    peers = ["S1", "S2", "S3"]
+    old_entries = [Entry(term=1, cmd=f"old={i}") for i in range(10)]
+    s = Leader(
+        name="S1", now=1, log=InMemoryLog(old_entries), peers=peers, currentTerm=1, votedFor=None,
+        max_entries=2, max_inflight=3,
+    )
+    s.handle_message(Message(frm="S2", to="S1", cmd=AppendEntriesFailed(term=1, conflictTerm=0, conflictIndex=10)))
+    s.handle_message(Message(frm="client.id", to="S1", cmd=ClientSetCommand(guid="gaga", cmd="foo=bar")))
+    s.flush()
+    assert [m.to for m in s.outbox] == ["S2", "S3"]
+    assert s.nextIndex["S2"] == 10
+
+
+def test_failure_never_takes_nextIndex_back_past_matchIndex():
+    peers = ["S1", "S2", "S3"]
+    old_entries = [Entry(term=1, cmd=f"old={i}") for i in range(10)]
+    s = Leader(
+        name="S1", now=1, log=InMemoryLog(old_entries), peers=peers, currentTerm=1, votedFor=None,
+        max_entries=2, max_inflight=3,
+    )
+    s.handle_message(
+        Message(frm="S2", to="S1", cmd=AppendEntriesSucceeded(matchIndex=2))
+    )
+    s.outbox.clear()
+    s.handle_message(Message(frm="S2", to="S1", cmd=AppendEntriesFailed(term=1, conflictTerm=0, conflictIndex=1)))
+    assert s.nextIndex["S2"] == 3
+    [probe] = map(_append_entries, s.outbox)
+    assert probe.prevLogIndex == 2
+
+
+def test_only_the_first_failure_in_a_window_or_this_term_starts_a_probe():
+    peers = ["S1", "S2", "S3"]
+    old_entries = [Entry(term=1, cmd=f"old={i}") for i in range(10)]
+    s = Leader(
+        name="S1", now=1, log=InMemoryLog(old_entries), peers=peers, currentTerm=2, votedFor=None,
+        max_entries=2, max_inflight=3,
+    )
+    s.handle_message(
+        Message(frm="S2", to="S1", cmd=AppendEntriesSucceeded(matchIndex=2))
+    )
+    assert [_append_entries(m).prevLogIndex for m in s.outbox] == [2, 4, 6]
+    s.outbox.clear()
+    for _ in range(3):
+        s.handle_message(Message(frm="S2", to="S1", cmd=AppendEntriesFailed(term=2, conflictTerm=0, conflictIndex=4)))
+    [probe] = map(_append_entries, s.outbox)
+    assert probe.prevLogIndex == 3
+    assert probe.seq == 1
+    s.outbox.clear()
+    # an answer to something we sent when we led in term 1
+    s.handle_message(Message(frm="S2", to="S1", cmd=AppendEntriesFailed(term=1, conflictTerm=0, conflictIndex=1, seq=5)))
+    assert s.nextIndex["S2"] == 4
+    assert s.outbox == []
+
+
+def test_unacknowledged_appendentries_time_out_and_are_resent():
+    peers = ["S1", "S2", "S3"]
+    old_entries = [Entry(term=1, cmd=f"old={i}") for i in range(4)]
+    s = Leader(
+        name="S1", now=1, log=InMemoryLog(old_entries), peers=peers, currentTerm=1, votedFor=None,
+        max_entries=2, max_inflight=3,
+    )
+    s.handle_message(
+        Message(frm="S2", to="S1", cmd=AppendEntriesSucceeded(matchIndex=0))
+    )
+    assert s.nextIndex["S2"] == 5
+    s.outbox.clear()
+    s.clock_tick(1 + REPLICATION_TIMEOUT + 0.001)
+    resent = [m for m in s.outbox if m.to == "S2" and _append_entries(m).entries]
+    assert [_append_entries(m).prevLogIndex for m in resent] == [0]
+    assert s.nextIndex["S2"] == 1
+
+
+def test_failure_with_conflicting_term_we_have_skips_past_our_last_entry_of_that_term():
+    peers = ["S1", "S2", "S3"]
+    old_entries = [Entry(term=t, cmd=f"old={t}") for t in [1, 1, 1, 4, 4, 5, 5, 6, 6, 6]]
+    s = Leader(name="S1", now=1, log=InMemoryLog(old_entries), peers=peers, currentTerm=6, votedFor=None)
+    # follower has term 4 at 10, its first term 4 entry being at 4
+    s.handle_message(
+        Message(frm="S2", to="S1", cmd=AppendEntriesFailed(term=6, conflictTerm=4, conflictIndex=4))
+    )
+    assert s.nextIndex["S2"] == 6
+    [probe] = map(_append_entries, s.outbox)
+    assert probe.prevLogIndex == 5
+    assert probe.prevLogTerm == 4
+
+
+def test_failure_with_conflicting_term_we_dont_have_skips_to_followers_first_entry_of_it():
+    peers = ["S1", "S2", "S3"]
+    old_entries = [Entry(term=t, cmd=f"old={t}") for t in [1, 1, 1, 4, 4, 5, 5, 6, 6, 6]]
+    s = Leader(name="S1", now=1, log=InMemoryLog(old_entries), peers=peers, currentTerm=6, votedFor=None)
+    s.handle_message(
+        Message(frm="S2", to="S1", cmd=AppendEntriesFailed(term=6, conflictTerm=3, conflictIndex=7))
+    )
+    assert s.nextIndex["S2"] == 7
+
+
+def test_follower_behind_the_snapshot_is_sent_it_in_chunks():
+    peers = ["S1", "S2"]
+    old_entries = [Entry(term=1, cmd=f"old={i}") for i in range(6)]
+    log = InMemoryLog(old_entries)
+    log.compact(Snapshot(lastIncludedIndex=4, lastIncludedTerm=1, data=b'0123456789'))
+    s = Leader(name="S1", now=1, log=log, peers=peers, currentTerm=2, votedFor=None, max_bytes=4)
+    s.handle_message(
+        Message(frm="S2", to="S1", cmd=AppendEntriesFailed(term=2, conflictTerm=0, conflictIndex=1))
+    )
+    [chunk] = map(_install_snapshot, s.outbox)
+    assert chunk == InstallSnapshot(
+        term=2, leaderId="S1", lastIncludedIndex=4, lastIncludedTerm=1,
+        offset=0, data=b'0123', done=False,
+    )
+    s.outbox.clear()
+    s.handle_message(
+        Message(frm="S2", to="S1", cmd=InstallSnapshotSucceeded(term=2, lastIncludedIndex=4, offset=4, done=False))
+    )
+    [chunk] = map(_install_snapshot, s.outbox)
+    assert (chunk.offset, chunk.data, chunk.done) == (4, b'4567', False)
+    s.outbox.clear()
+    s.handle_message(
+        Message(frm="S2", to="S1", cmd=InstallSnapshotSucceeded(term=2, lastIncludedIndex=4, offset=8, done=False))
+    )
+    [chunk] = map(_install_snapshot, s.outbox)
+    assert (chunk.offset, chunk.data, chunk.done) == (8, b'89', True)
+    s.outbox.clear()
+    s.handle_message(
+        Message(frm="S2", to="S1", cmd=InstallSnapshotSucceeded(term=2, lastIncludedIndex=4, offset=10, done=True))
+    )
+    assert s.matchIndex["S2"] == 4
+    # then carries on with the entries after it, as usual
+    ae = _append_entries(s.outbox[0])
+    assert ae.prevLogIndex == 4
+    assert ae.prevLogTerm == 1
+    assert ae.entries == old_entries[4:5]
+
+
+def test_leader_steps_down_when_its_snapshot_is_refused_for_a_newer_term():
+    log = InMemoryLog([Entry(term=1, cmd="old=1")])
+    s = Leader(name="S1", now=1, log=log, peers=["S1", "S2"], currentTerm=2, votedFor=None)
+    s.handle_message(Message(frm="S2", to="S1", cmd=InstallSnapshotFailed(term=5)))
+    assert isinstance(s, Follower)
+    assert s.currentTerm == 5
+
+
+def test_leader_ignores_snapshot_progress_from_an_earlier_term():
+    log = InMemoryLog([Entry(term=1, cmd=f"old={i}") for i in range(4)])
+    log.compact(Snapshot(lastIncludedIndex=4, lastIncludedTerm=1, data=b'01234567'))
+    s = Leader(name="S1", now=1, log=log, peers=["S1", "S2"], currentTerm=3, votedFor=None)
+    s.handle_message(
+        Message(frm="S2", to="S1", cmd=InstallSnapshotSucceeded(term=2, lastIncludedIndex=4, offset=8, done=True))
+    )
+    assert s.matchIndex["S2"] == 0
+    assert s.outbox == []
+
+
+def test_no_heartbeats_for_followers_being_sent_a_snapshot():
+    peers = ["S1", "S2", "S3"]
+    log = InMemoryLog([Entry(term=1, cmd=f"old={i}") for i in range(4)])
+    log.compact(Snapshot(lastIncludedIndex=4, lastIncludedTerm=1, data=b'state'))
+    s = Leader(name="S1", now=1, log=log, peers=peers, currentTerm=2, votedFor=None)
+    s.nextIndex["S2"] = 2
+    s.clock_tick(1 + HEARTBEAT_FREQUENCY + 0.001)
+    assert [m.to for m in s.outbox] == ["S3"]
+
+
+def test_snapshot_chunk_times_out_and_is_resent():
+    peers = ["S1", "S2"]
+    log = InMemoryLog([Entry(term=1, cmd=f"old={i}") for i in range(4)])
+    log.compact(Snapshot(lastIncludedIndex=4, lastIncludedTerm=1, data=b'01234567'))
+    s = Leader(name="S1", now=1, log=log, peers=peers, currentTerm=2, votedFor=None, max_bytes=4)
+    s.handle_message(
+        Message(frm="S2", to="S1", cmd=AppendEntriesFailed(term=2, conflictTerm=0, conflictIndex=1))
+    )
+    s.handle_message(
+        Message(frm="S2", to="S1", cmd=InstallSnapshotSucceeded(term=2, lastIncludedIndex=4, offset=4, done=False))
+    )
+    s.outbox.clear()
+    s.clock_tick(1 + REPLICATION_TIMEOUT + 0.001)
+    [chunk] = [m.cmd for m in s.outbox if isinstance(m.cmd, InstallSnapshot)]
+    assert chunk.offset == 4
+
+
+def test_leader_compacts_once_applied_entries_pass_the_threshold():
+    peers = ["S1", "S2"]
+    log = InMemoryLog([Entry(term=1, cmd=f"old={i}") for i in range(10)])
+    s = Leader(
+        name="S1", now=1, log=log, peers=peers, currentTerm=1, votedFor=None,
+        snapshot_threshold=5,
+    )
+    s.handle_message(Message(frm="S2", to="S1", cmd=AppendEntriesSucceeded(matchIndex=4)))
+    s.flush()
+    assert s.lastApplied == 4
+    assert s.log.snapshot.lastIncludedIndex == 0
+    s.handle_message(Message(frm="S2", to="S1", cmd=AppendEntriesSucceeded(matchIndex=6)))
+    s.flush()
+    assert s.log.snapshot.lastIncludedIndex == 6
+    assert s.log.snapshot.data == pack_snapshot(b'{"old": "5"}')
+    assert s.log.lastLogIndex == 10
+
+
+def test_match_indexes_stay_sorted():
+    m = MatchIndexes(["S2", "S3", "S4", "S5"])
+    m["S2"] = 5
+    m["S3"] = 3
+    m["S4"] = 9
+    m["S2"] = 7
+    assert [m.nth_highest(n) for n in range(1, 6)] == [9, 7, 3, 0, 0]
+    m.clear()
+    assert m == {}
+    assert m.nth_highest(1) == 0
+
+
+def test_commitIndex_jumps_straight_to_the_quorum_index():
+    peers = ["S1", "S2", "S3", "S4", "S5"]
+    old_entries = [Entry(term=1, cmd=f"old={i}") for i in range(10)]
+    s = Leader(name="S1", now=1, log=InMemoryLog(old_entries), peers=peers, currentTerm=1, votedFor=None)
+    s.handle_message(Message(frm="S2", to="S1", cmd=AppendEntriesSucceeded(matchIndex=8)))
+    assert s.commitIndex == 0
+    s.handle_message(Message(frm="S3", to="S1", cmd=AppendEntriesSucceeded(matchIndex=6)))
+    assert s.commitIndex == 6
+    s.handle_message(Message(frm="S4", to="S1", cmd=AppendEntriesSucceeded(matchIndex=10)))
+    assert s.commitIndex == 8
+
+
+def test_entries_from_earlier_terms_are_not_committed_by_counting_replicas():
+    peers = ["S1", "S2", "S3"]
+    old_entries = [Entry(term=1, cmd="old=1"), Entry(term=2, cmd="old=2")]
+    s = Leader(name="S1", now=1, log=InMemoryLog(old_entries), peers=peers, currentTerm=3, votedFor=None)
+    s.handle_message(Message(frm="S2", to="S1", cmd=AppendEntriesSucceeded(matchIndex=2)))
+    assert s.commitIndex == 0
+    s.handle_message(Message(frm="client.id", to="S1", cmd=ClientSetCommand(guid='gaga', cmd="foo=3")))
+    s.flush()
+    s.handle_message(Message(frm="S2", to="S1", cmd=AppendEntriesSucceeded(matchIndex=3)))
+    assert s.commitIndex == 3
+
+
+def test_leaderCommit_goes_out_with_entries_and_heartbeats():
+    peers = ["S1", "S2", "S3"]
+    old_entries = [Entry(term=1, cmd=f"old={i}") for i in range(4)]
+    s = Leader(name="S1", now=1, log=InMemoryLog(old_entries), peers=peers, currentTerm=1, votedFor=None)
+    s.handle_message(Message(frm="S2", to="S1", cmd=AppendEntriesSucceeded(matchIndex=4)))
+    assert s.commitIndex == 4
+    s.outbox.clear()
+    s.handle_message(Message(frm="client.id", to="S1", cmd=ClientSetCommand(guid='gaga', cmd="foo=5")))
+    s.clock_tick(1 + HEARTBEAT_FREQUENCY + 0.001)
+    assert s.outbox
+    assert all(_append_entries(m).leaderCommit == 4 for m in s.outbox)
+
+
+def test_client_commands_in_a_tick_go_out_as_one_append_per_follower():
+    peers = ["S1", "S2", "S3"]
+    s = Leader(name="S1", now=1, log=InMemoryLog([]), peers=peers, currentTerm=1, votedFor=None)
+    for i in range(10):
+        s.handle_message(Message(frm="client.id", to="S1", cmd=ClientSetCommand(guid=f'g{i}', cmd=f"foo={i}")))
+    s.flush()
+    assert s.log.lastLogIndex == 10
+    assert [(m.to, len(_append_entries(m).entries)) for m in s.outbox] == [("S2", 10), ("S3", 10)]
+
+
+def test_proposals_are_appended_as_soon_as_a_batch_fills_up():
+    peers = ["S1", "S2"]
+    s = Leader(
+        name="S1", now=1, log=InMemoryLog([]), peers=peers, currentTerm=1, votedFor=None,
+        batch_size=3, max_batch_delay=1,
+    )
+    for i in range(4):
+        s.handle_message(Message(frm="client.id", to="S1", cmd=ClientSetCommand(guid=f'g{i}', cmd=f"foo={i}")))
+    assert s.log.lastLogIndex == 3
+    s.flush()
+    assert s.log.lastLogIndex == 3
+
+
+def test_proposals_wait_up_to_max_batch_delay():
+    peers = ["S1", "S2"]
+    s = Leader(
+        name="S1", now=1, log=InMemoryLog([]), peers=peers, currentTerm=1, votedFor=None,
+        max_batch_delay=0.005,
+    )
+    s.handle_message(Message(frm="client.id", to="S1", cmd=ClientSetCommand(guid='g', cmd="foo=1")))
+    s.flush()
+    assert s.log.lastLogIndex == 0
+    s.clock_tick(1.004)
+    s.flush()
+    assert s.log.lastLogIndex == 0
+    s.clock_tick(1.006)
+    s.flush()
+    assert s.log.lastLogIndex == 1
+
+
+def test_client_gets_reply_once_its_command_is_applied():
+    peers = ["S1", "S2", "S3"]
+    s = Leader(name="S1", now=1, log=InMemoryLog([]), peers=peers, currentTerm=1, votedFor=None)
+    s.handle_message(Message(frm="client.a", to="S1", cmd=ClientSetCommand(guid='g1', cmd="foo=1")))
+    s.handle_message(Message(frm="client.b", to="S1", cmd=ClientSetCommand(guid='g2', cmd="foo=2")))
+    s.flush()
+    s.outbox.clear()
+    s.now = 1.5
+    s.handle_message(Message(frm="S2", to="S1", cmd=AppendEntriesSucceeded(matchIndex=1)))
+    s.flush()
+    replies = [m for m in s.outbox if m.to.startswith("client")]
+    assert replies == [Message(frm="S1", to="client.a", cmd=ClientSetSucceeded(guid='g1'))]
+    assert s.commit_latency.count == 1
+    assert s.commit_latency.max == 0.5
+
+
+def test_stepping_down_redirects_waiting_clients_to_the_new_leader():
+    peers = ["S1", "S2", "S3"]
+    s = Leader(name="S1", now=1, log=InMemoryLog([]), peers=peers, currentTerm=1, votedFor=None)
+    s.handle_message(Message(frm="client.a", to="S1", cmd=ClientSetCommand(guid='g1', cmd="foo=1")))
+    s.flush()
+    s.handle_message(Message(frm="client.b", to="S1", cmd=ClientSetCommand(guid='g2', cmd="foo=2")))
+    s.outbox.clear()
+    s.handle_message(Message(frm="S3", to="S1", cmd=AppendEntries(
+        term=2, leaderId="S3", prevLogIndex=0, prevLogTerm=0, leaderCommit=0, entries=[],
+    )))
+    redirects = [m for m in s.outbox if m.to.startswith("client")]
+    assert redirects == [
+        Message(frm="S1", to="client.b", cmd=ClientRedirect(guid='g2', leaderHint="S3")),
+        Message(frm="S1", to="client.a", cmd=ClientRedirect(guid='g1', leaderHint="S3")),
+    ]
+
+
+def _leader_with_committed_entry(peers: List[str]) -> Leader:
+    log = InMemoryLog([Entry(term=1, cmd="foo=1")])
+    s = Leader(name="S1", now=1, log=log, peers=peers, currentTerm=1, votedFor=None)
+    s.handle_message(Message(frm="S2", to="S1", cmd=AppendEntriesSucceeded(matchIndex=1)))
+    s.flush()
+    s.outbox.clear()
+    return s
+
+
+def test_reads_in_a_tick_share_one_round_of_heartbeats():
+    s = _leader_with_committed_entry(["S1", "S2", "S3"])
+    s.handle_message(Message(frm="client.a", to="S1", cmd=ClientGetCommand(guid='g1', key="foo")))
+    s.handle_message(Message(frm="client.b", to="S1", cmd=ClientGetCommand(guid='g2', key="foo")))
+    s.flush()
+    assert [m.to for m in s.outbox] == ["S2", "S3"]
+    assert all(ae.entries == [] and ae.seq == 1 for ae in map(_append_entries, s.outbox))
+    assert s.log.lastLogIndex == 1  # reads don't go in the log
+
+
+def test_read_is_answered_once_a_majority_ack_its_round():
+    s = _leader_with_committed_entry(["S1", "S2", "S3"])
+    s.handle_message(Message(frm="client.a", to="S1", cmd=ClientGetCommand(guid='g1', key="foo")))
+    s.flush()
+    s.outbox.clear()
+    # an ack from before the round doesn't count
+    s.handle_message(Message(frm="S2", to="S1", cmd=AppendEntriesSucceeded(matchIndex=1, seq=0)))
+    s.flush()
+    assert s.outbox == []
+    s.handle_message(Message(frm="S3", to="S1", cmd=AppendEntriesSucceeded(matchIndex=1, seq=1)))
+    s.flush()
+    assert s.outbox == [
+        Message(frm="S1", to="client.a", cmd=ClientGetSucceeded(guid='g1', value="1"))
+    ]
+    assert s.read_latency.count == 1
+
+
+def test_a_late_ack_from_an_earlier_term_doesnt_confirm_a_read_after_re_election():
+    s = _leader_with_committed_entry(["S1", "S2", "S3"])
+    for i in range(3):
+        s.handle_message(Message(frm="client.a", to="S1", cmd=ClientGetCommand(guid=f'old{i}', key="foo")))
+        s.flush()
+    old_seq = _append_entries(s.outbox[-1]).seq
+    # deposed, then elected again
+    s.handle_message(Message(frm="S3", to="S1", cmd=AppendEntries(
+        term=2, leaderId="S3", prevLogIndex=1, prevLogTerm=1, leaderCommit=1, entries=[],
+    )))
+    assert isinstance(s, Follower)
+    s._become_candidate()
+    s.handle_message(Message(frm="S2", to="S1", cmd=VoteGranted()))
+    assert isinstance(s, Leader)
+    s.handle_message(Message(frm="S2", to="S1", cmd=AppendEntriesSucceeded(matchIndex=2)))
+    s.flush()
+    s.outbox.clear()
+    s.handle_message(Message(frm="client.b", to="S1", cmd=ClientGetCommand(guid='new', key="foo")))
+    s.flush()
+    new_seq = _append_entries(s.outbox[-1]).seq
+    assert new_seq > old_seq
+    s.outbox.clear()
+    # S2's answer to a heartbeat from our last term turns up late
+    s.handle_message(Message(frm="S2", to="S1", cmd=AppendEntriesSucceeded(matchIndex=2, seq=old_seq)))
+    s.flush()
+    assert not any(m.to == "client.b" for m in s.outbox)
+    s.handle_message(Message(frm="S3", to="S1", cmd=AppendEntriesSucceeded(matchIndex=2, seq=new_seq)))
+    s.flush()
+    assert Message(frm="S1", to="client.b", cmd=ClientGetSucceeded(guid='new', value="1")) in s.outbox
+
+
+def test_reads_wait_for_an_entry_from_the_current_term_to_commit():
+    log = InMemoryLog([Entry(term=1, cmd="foo=1"), Entry(term=2, cmd="")])
+    s = Leader(name="S1", now=1, log=log, peers=["S1", "S2", "S3"], currentTerm=2, votedFor=None)
+    s.handle_message(Message(frm="client.a", to="S1", cmd=ClientGetCommand(guid='g1', key="foo")))
+    s.flush()
+    assert all(_append_entries(m).seq == 0 for m in s.outbox)
+    s.outbox.clear()
+    s.handle_message(Message(frm="S2", to="S1", cmd=AppendEntriesSucceeded(matchIndex=2)))
+    s.flush()
+    assert s.commitIndex == 2
+    assert [_append_entries(m).seq for m in s.outbox] == [1, 1]
+    s.outbox.clear()
+    s.handle_message(Message(frm="S2", to="S1", cmd=AppendEntriesSucceeded(matchIndex=2, seq=1)))
+    s.flush()
+    assert s.outbox == [
+        Message(frm="S1", to="client.a", cmd=ClientGetSucceeded(guid='g1', value="1"))
+    ]
+
+
+def test_single_server_answers_reads_straight_away():
+    log = InMemoryLog([Entry(term=1, cmd="foo=1")])
+    s = Leader(name="S1", now=1, log=log, peers=["S1"], currentTerm=1, votedFor=None)
+    s.flush()
+    s.handle_message(Message(frm="client.a", to="S1", cmd=ClientGetCommand(guid='g1', key="foo")))
+    s.flush()
+    assert s.outbox == [
+        Message(frm="S1", to="client.a", cmd=ClientGetSucceeded(guid='g1', value="1"))
+    ]
+
+
+def test_stepping_down_redirects_waiting_reads():
+    s = _leader_with_committed_entry(["S1", "S2", "S3"])
+    s.handle_message(Message(frm="client.a", to="S1", cmd=ClientGetCommand(guid='g1', key="foo")))
+    s.flush()
+    s.handle_message(Message(frm="client.b", to="S1", cmd=ClientGetCommand(guid='g2', key="foo")))
+    s.outbox.clear()
+    s.handle_message(Message(frm="S3", to="S1", cmd=AppendEntries(
+        term=2, leaderId="S3", prevLogIndex=0, prevLogTerm=0, leaderCommit=0, entries=[],
+    )))
+    redirects = [m for m in s.outbox if m.to.startswith("client")]
+    assert redirects == [
+        Message(frm="S1", to="client.b", cmd=ClientRedirect(guid='g2', leaderHint="S3")),
+        Message(frm="S1", to="client.a", cmd=ClientRedirect(guid='g1', leaderHint="S3")),
+    ]
+
+
+def _leader_holding_lease() -> Leader:
+    log = InMemoryLog([Entry(term=1, cmd="foo=1")])
+    s = Leader(
+        name="S1", now=1, log=log, peers=["S1", "S2", "S3"], currentTerm=1, votedFor=None,
+        lease_reads=True,
+    )
+    s.clock_tick(1.1)  # heartbeats go out, as round 1
+    s.handle_message(Message(frm="S2", to="S1", cmd=AppendEntriesSucceeded(matchIndex=1, seq=1)))
+    s.flush()
+    s.outbox.clear()
+    return s
+
+
+def test_leader_with_a_lease_answers_reads_without_a_round_trip():
+    s = _leader_holding_lease()
+    s.now = 1.1 + MIN_ELECTION_TIMEOUT - MAX_CLOCK_DRIFT - 0.001
+    s.handle_message(Message(frm="client.a", to="S1", cmd=ClientGetCommand(guid='g1', key="foo")))
+    s.flush()
+    assert s.outbox == [
+        Message(frm="S1", to="client.a", cmd=ClientGetSucceeded(guid='g1', value="1"))
+    ]
+
+
+def test_once_the_lease_runs_out_reads_wait_for_a_round_trip_again():
+    s = _leader_holding_lease()
+    s.now = 1.1 + MIN_ELECTION_TIMEOUT - MAX_CLOCK_DRIFT
+    s.handle_message(Message(frm="client.a", to="S1", cmd=ClientGetCommand(guid='g1', key="foo")))
+    s.flush()
+    assert [m.to for m in s.outbox] == ["S2", "S3"]
+    assert all(_append_entries(m).seq == 2 for m in s.outbox)
+
+
+def test_lease_reads_are_off_by_default():
+    s = _leader_with_committed_entry(["S1", "S2", "S3"])
+    s.clock_tick(1.1)
+    s.handle_message(Message(frm="S2", to="S1", cmd=AppendEntriesSucceeded(matchIndex=1)))
+    s.flush()
+    s.outbox.clear()
+    s.handle_message(Message(frm="client.a", to="S1", cmd=ClientGetCommand(guid='g1', key="foo")))
+    s.flush()
+    assert [m.to for m in s.outbox] == ["S2", "S3"]
+
+
+def test_leader_tells_followers_the_read_index_once_a_majority_ack():
+    s = _leader_with_committed_entry(["S1", "S2", "S3"])
+    s.handle_message(Message(frm="S3", to="S1", cmd=ReadIndexRequest(term=1, readId=7)))
+    s.flush()
+    assert [_append_entries(m).seq for m in s.outbox] == [1, 1]
+    s.outbox.clear()
+    s.handle_message(Message(frm="S2", to="S1", cmd=AppendEntriesSucceeded(matchIndex=1, seq=1)))
+    s.flush()
+    assert s.outbox == [
+        Message(frm="S1", to="S3", cmd=ReadIndexReply(term=1, readId=7, readIndex=1))
+    ]
+
+
+def test_client_sessions_go_in_the_log_with_the_leaders_timestamp():
+    s = Leader(name="S1", now=1, log=InMemoryLog([]), peers=["S1"], currentTerm=1, votedFor=None)
+    s.handle_message(Message(
+        frm="client.a", to="S1", cmd=ClientSetCommand(guid='g1', cmd="foo=1", clientId="c1", seq=1)
+    ))
+    s.flush()
+    assert s.log.read() == [Entry(term=1, cmd="foo=1", session=Session("c1", seq=1, timestamp=1))]
+
+
+def test_retry_of_an_applied_command_is_answered_without_a_new_entry():
+    s = Leader(name="S1", now=1, log=InMemoryLog([]), peers=["S1"], currentTerm=1, votedFor=None)
+    set_foo = ClientSetCommand(guid='g1', cmd="foo=1", clientId="c1", seq=1)
+    s.handle_message(Message(frm="client.a", to="S1", cmd=set_foo))
+    s.flush()
+    assert s.lastApplied == 1
+    s.outbox.clear()
+    s.handle_message(Message(frm="client.a", to="S1", cmd=set_foo))
+    s.flush()
+    assert s.log.lastLogIndex == 1
+    assert s.outbox == [Message(frm="S1", to="client.a", cmd=ClientSetSucceeded(guid='g1'))]
+
+
+def test_leader_steps_down_once_out_of_touch_with_a_majority():
+    peers = ["S1", "S2", "S3", "S4", "S5"]
+    s = Leader(name="S1", now=1, log=InMemoryLog([]), peers=peers, currentTerm=1, votedFor=None)
+    s.now = 1 + CHECK_QUORUM_TIMEOUT / 2
+    for follower in ["S2", "S3"]:
+        s.handle_message(Message(frm=follower, to="S1", cmd=AppendEntriesSucceeded(matchIndex=0)))
+    s.clock_tick(1 + CHECK_QUORUM_TIMEOUT + 0.01)
+    assert isinstance(s, Leader)
+    s.clock_tick(1 + CHECK_QUORUM_TIMEOUT * 1.5 + 0.01)
+    assert not isinstance(s, Leader)
+    assert s.currentTerm == 1
+
+
+def test_leader_refuses_pre_votes():
+    s = Leader(name="S1", now=1, log=InMemoryLog([]), peers=["S1", "S2", "S3"], currentTerm=1, votedFor=None)
+    s.handle_message(Message(
+        frm="S3", to="S1", cmd=PreVote(proposedTerm=5, candidateId="S3", lastLogIndex=9, lastLogTerm=4)
+    ))
+    assert s.outbox == [Message(frm="S1", to="S3", cmd=PreVoteDenied(term=1))]
+    assert s.currentTerm == 1
+
+
+def _heartbeat_round_trip(s: Leader, now: float, rtt: float) -> None:
+    s.clock_tick(now)
+    seq = _append_entries(s.outbox[-1]).seq
+    s.outbox.clear()
+    s.now = now + rtt
+    for follower in s.nextIndex:
+        s.handle_message(Message(frm=follower, to="S1", cmd=AppendEntriesSucceeded(matchIndex=0, seq=seq)))
+    s.outbox.clear()
+
+
+def test_election_timeout_adapts_to_measured_round_trips_within_bounds():
+    s = Leader(
+        name="S1", now=1, log=InMemoryLog([]), peers=["S1", "S2", "S3"], currentTerm=1, votedFor=None,
+        min_election_timeout=0.05, max_election_timeout=1.0,
+    )
+    assert s.election_timeout == MIN_ELECTION_TIMEOUT
+    _heartbeat_round_trip(s, now=1.1, rtt=0.007)
+    assert s.round_trip_p99s() == {"S2": pytest.approx(0.007), "S3": pytest.approx(0.007)}
+    s.clock_tick(1.15)
+    assert s.election_timeout == pytest.approx(RTT_MULTIPLIER * 0.007)
+    assert s.heartbeat_interval == pytest.approx(s.election_timeout * HEARTBEAT_FREQUENCY / MIN_ELECTION_TIMEOUT)
+    assert {_append_entries(m).electionTimeout for m in s.outbox} == {s.election_timeout}
+    s.outbox.clear()
+
+    _heartbeat_round_trip(s, now=1.2, rtt=0.001)
+    s.clock_tick(1.25)
+    assert s.election_timeout == pytest.approx(RTT_MULTIPLIER * 0.007)  # p99, not the latest
+    _heartbeat_round_trip(s, now=1.3, rtt=0.5)
+    s.clock_tick(1.85)
+    assert s.election_timeout == 1.0
+
+
+def test_election_timeout_is_pinned_by_default():
+    s = Leader(name="S1", now=1, log=InMemoryLog([]), peers=["S1", "S2"], currentTerm=1, votedFor=None)
+    _heartbeat_round_trip(s, now=1.1, rtt=0.001)
+    s.clock_tick(1.2)
+    assert s.election_timeout == MIN_ELECTION_TIMEOUT
+    assert s.heartbeat_interval == HEARTBEAT_FREQUENCY
+    assert [_append_entries(m).electionTimeout for m in s.outbox] == [0.0]
+
+
+def test_no_heartbeat_for_followers_sent_entries_within_the_interval():
+    s = Leader(
+        name="S1", now=1, log=InMemoryLog([]), peers=["S1", "S2", "S3"], currentTerm=1, votedFor=None,
+        check_quorum=False,
+    )
+    s.clock_tick(1.001)
+    s.outbox.clear()
+    s.now = 1.01
+    s.handle_message(Message(frm="client.id", to="S1", cmd=ClientSetCommand(guid='g', cmd="foo=1")))
+    s.flush()
+    s.outbox.clear()
+
+    s.clock_tick(1.001 + HEARTBEAT_FREQUENCY + 0.001)
+    assert s.outbox == []
+    s.clock_tick(1.01 + HEARTBEAT_FREQUENCY + 0.001)
+    assert s.outbox == []  # not time for a round yet
+    s.clock_tick(1.001 + 2 * HEARTBEAT_FREQUENCY + 0.002)
+    assert [(m.to, _append_entries(m).seq) for m in s.outbox] == [("S2", 3), ("S3", 3)]
+
+
+def _idle_leader(quiesce: bool = True) -> Leader:
+    s = Leader(
+        name="S1", now=1, log=InMemoryLog([Entry(term=1, cmd="foo=1")]), peers=["S1", "S2", "S3"],
+        currentTerm=1, votedFor=None, quiesce=quiesce,
+    )
+    s.clock_tick(1.001)
+    for follower in s.nextIndex:
+        s.handle_message(Message(frm=follower, to="S1", cmd=AppendEntriesSucceeded(matchIndex=1, seq=1)))
+    s.flush()
+    s.outbox.clear()
+    return s
+
+
+def test_idle_leader_goes_quiet_and_stretches_its_heartbeats():
+    s = _idle_leader()
+    s.clock_tick(1.002)
+    assert s.outbox == []
+    went_quiet = 1.002 + MIN_ELECTION_TIMEOUT
+    s.clock_tick(went_quiet)
+    assert [(m.to, _append_entries(m).quiescent, _append_entries(m).leaderCommit) for m in s.outbox] == [
+        ("S2", True, 1), ("S3", True, 1),
+    ]
+    s.outbox.clear()
+    s.clock_tick(went_quiet + QUIESCENT_HEARTBEAT_INTERVAL)
+    assert s.outbox == []
+    assert isinstance(s, Leader)  # no stepping down for check_quorum
+    s.clock_tick(went_quiet + QUIESCENT_HEARTBEAT_INTERVAL + 0.001)
+    assert [m.to for m in s.outbox] == ["S2", "S3"]
+
+
+def test_quiet_leader_wakes_for_a_client_command():
+    s = _idle_leader()
+    s.clock_tick(1.002)
+    s.clock_tick(1.002 + MIN_ELECTION_TIMEOUT)
+    s.outbox.clear()
+    s.clock_tick(1.4)
+    s.handle_message(Message(frm="client.id", to="S1", cmd=ClientSetCommand(guid='g', cmd="foo=2")))
+    s.flush()
+    assert [(m.to, _append_entries(m).quiescent, len(_append_entries(m).entries)) for m in s.outbox] == [
+        ("S2", False, 1), ("S3", False, 1),
+    ]
+    s.outbox.clear()
+    s.clock_tick(1.4 + HEARTBEAT_FREQUENCY + 0.001)
+    assert [_append_entries(m).quiescent for m in s.outbox] == [False, False]
+
+
+def test_leaders_only_go_quiet_if_asked_to():
+    s = _idle_leader(quiesce=False)
+    s.clock_tick(1.002)
+    s.clock_tick(1.002 + MIN_ELECTION_TIMEOUT)
+    assert [_append_entries(m).quiescent for m in s.outbox] == [False, False]
+
+
+def test_next_deadline_is_the_next_heartbeat_or_buffered_proposal():
+    s = Leader(
+        name="S1", now=1, log=InMemoryLog([]), peers=["S1", "S2", "S3"], currentTerm=1, votedFor=None,
+        max_batch_delay=0.005,
+    )
+    s.clock_tick(1.001)
+    assert s.next_deadline() == 1.001 + HEARTBEAT_FREQUENCY
+    s.now = 1.01
+    s.handle_message(Message(frm="client.id", to="S1", cmd=ClientSetCommand(guid='g', cmd="foo=1")))
+    s.flush()
+    assert s.next_deadline() == pytest.approx(1.015)
+
+
+def test_next_deadline_is_soon_while_the_applier_is_busy():
+    class FullApplier(InlineApplier):
+        def offer(self, index, entry):
+            return False
+
+    s = Leader(
+        name="S1", now=1, log=InMemoryLog([Entry(term=1, cmd="foo=1")]), peers=["S1"], currentTerm=1,
+        votedFor=None, applier=FullApplier(KeyValueStore()),
+    )
+    s.clock_tick(1.001)
+    s.flush()
+    assert s.commitIndex == 1 and s.lastApplied == 0
+    assert s.next_deadline() == 1.001 + BUSY_POLL_INTERVAL
@@ -1,4 +1,5 @@
-from raft.log import InMemoryLog, Entry
+import pytest
+from raft.log import InMemoryLog, Entry, Snapshot
 
 def test_some_helpers():
     entries = [
@@ -161,3 +162,149 @@ def test_prevLogTerm_does_not_Match():
     log = InMemoryLog([old_entry])
     result = log.check_log(prevLogIndex=1, prevLogTerm=2)
     assert result is False
+
+
+def test_append_entries_adds_a_batch():
+    old_entry = Entry(term=1, cmd="foo=1")
+    log = InMemoryLog([old_entry])
+    new_entries = [Entry(term=2, cmd="foo=2"), Entry(term=2, cmd="foo=3")]
+    result = log.append_entries(prevLogIndex=1, prevLogTerm=1, entries=new_entries)
+    assert log.read() == [old_entry] + new_entries
+    assert result is True
+
+
+def test_append_entries_checks_prevLogTerm_once_for_the_batch():
+    old_entry = Entry(term=1, cmd="foo=1")
+    log = InMemoryLog([old_entry])
+    new_entries = [Entry(term=2, cmd="foo=2"), Entry(term=2, cmd="foo=3")]
+    result = log.append_entries(prevLogIndex=1, prevLogTerm=2, entries=new_entries)
+    assert log.read() == [old_entry]
+    assert result is False
+
+
+def test_append_entries_already_present_does_not_truncate_later_ones():
+    old_log = [
+        Entry(term=1, cmd="foo=1"),
+        Entry(term=1, cmd="foo=2"),
+        Entry(term=1, cmd="foo=3"),
+    ]
+    log = InMemoryLog(old_log)
+    result = log.append_entries(prevLogIndex=0, prevLogTerm=0, entries=old_log[:2])
+    assert log.read() == old_log
+    assert result is True
+
+
+def test_append_entries_truncates_from_first_conflict():
+    old_log = [
+        Entry(term=1, cmd="foo=1"),
+        Entry(term=1, cmd="foo=2"),
+        Entry(term=1, cmd="foo=3"),
+    ]
+    log = InMemoryLog(old_log)
+    new_entries = [old_log[1], Entry(term=2, cmd="bar=1")]
+    result = log.append_entries(prevLogIndex=1, prevLogTerm=1, entries=new_entries)
+    assert log.read() == [old_log[0]] + new_entries
+    assert result is True
+
+
+def test_log_does_not_mutate_the_list_it_was_given():
+    old_log = [Entry(term=1, cmd="foo=1")]
+    log = InMemoryLog(old_log)
+    log.add_entry(Entry(term=1, cmd="foo=2"), prevLogIndex=1, prevLogTerm=1, leaderCommit=0)
+    assert old_log == [Entry(term=1, cmd="foo=1")]
+
+
+def test_first_and_last_index_of_term():
+    log = InMemoryLog([Entry(term=t, cmd=f"foo={t}") for t in [1, 1, 1, 4, 4, 5, 6, 6]])
+    assert log.first_index_of_term(1) == 1
+    assert log.last_index_of_term(1) == 3
+    assert log.first_index_of_term(4) == 4
+    assert log.last_index_of_term(4) == 5
+    assert log.first_index_of_term(5) == log.last_index_of_term(5) == 6
+    assert log.first_index_of_term(6) == 7
+    assert log.last_index_of_term(6) == 8
+    assert log.first_index_of_term(2) == log.last_index_of_term(2) == 0
+    assert log.first_index_of_term(7) == log.last_index_of_term(7) == 0
+
+
+def test_term_boundaries_follow_truncation_and_appends():
+    log = InMemoryLog([Entry(term=t, cmd=f"foo={t}") for t in [1, 2, 2, 3]])
+    log.append_entries(prevLogIndex=2, prevLogTerm=2, entries=[Entry(term=4, cmd="bar=4")])
+    assert log.last_index_of_term(2) == 2
+    assert log.first_index_of_term(3) == 0
+    assert log.first_index_of_term(4) == log.last_index_of_term(4) == 3
+    log.add_entry(Entry(term=4, cmd="bar=5"), prevLogIndex=3, prevLogTerm=4, leaderCommit=0)
+    assert log.last_index_of_term(4) == 4
+
+
+def test_compacting_keeps_indexes_and_the_boundary_term():
+    log = InMemoryLog([Entry(term=t, cmd=f"foo={t}") for t in [1, 1, 2, 2, 3]])
+    log.compact(Snapshot(lastIncludedIndex=3, lastIncludedTerm=2, data=b'state'))
+    assert log.read() == [Entry(term=2, cmd="foo=2"), Entry(term=3, cmd="foo=3")]
+    assert log.lastLogIndex == 5
+    assert log.entry_term(3) == 2
+    assert log.entry_term(4) == 2
+    assert log.entry_at(5) == Entry(term=3, cmd="foo=3")
+    assert log.snapshot.data == b'state'
+    with pytest.raises(IndexError):
+        log.entry_at(3)
+
+
+def test_term_index_after_compacting_starts_at_the_first_entry_left():
+    log = InMemoryLog([Entry(term=t, cmd=f"foo={t}") for t in [1, 1, 2, 2, 2, 3]])
+    log.compact(Snapshot(lastIncludedIndex=3, lastIncludedTerm=2, data=b''))
+    assert log.first_index_of_term(1) == 0
+    assert log.first_index_of_term(2) == 4
+    assert log.last_index_of_term(2) == 5
+    assert log.first_index_of_term(3) == 6
+
+
+def test_compacting_everything_leaves_snapshot_term_as_last_term():
+    log = InMemoryLog([Entry(term=1, cmd="foo=1"), Entry(term=2, cmd="foo=2")])
+    log.compact(Snapshot(lastIncludedIndex=2, lastIncludedTerm=2, data=b''))
+    assert log.read() == []
+    assert log.lastLogIndex == 2
+    assert log.last_log_term == 2
+    assert log.add_entry(Entry(term=3, cmd="foo=3"), prevLogIndex=2, prevLogTerm=2, leaderCommit=0)
+    assert log.entry_term(3) == 3
+
+
+def test_check_log_accepts_anything_covered_by_the_snapshot():
+    log = InMemoryLog([Entry(term=1, cmd=f"foo={i}") for i in range(5)])
+    log.compact(Snapshot(lastIncludedIndex=3, lastIncludedTerm=1, data=b''))
+    assert log.check_log(prevLogIndex=1, prevLogTerm=1)
+    assert log.check_log(prevLogIndex=3, prevLogTerm=1)
+    assert not log.check_log(prevLogIndex=4, prevLogTerm=2)
+
+
+def test_append_entries_skips_entries_covered_by_the_snapshot():
+    entries = [Entry(term=1, cmd=f"foo={i}") for i in range(5)]
+    log = InMemoryLog(entries[:3])
+    log.compact(Snapshot(lastIncludedIndex=3, lastIncludedTerm=1, data=b''))
+    assert log.append_entries(prevLogIndex=1, prevLogTerm=1, entries=entries[1:])
+    assert log.read() == entries[3:]
+    assert log.lastLogIndex == 5
+
+
+def test_install_snapshot_keeps_entries_after_a_matching_last_entry():
+    log = InMemoryLog([Entry(term=1, cmd=f"foo={i}") for i in range(5)])
+    log.install_snapshot(Snapshot(lastIncludedIndex=3, lastIncludedTerm=1, data=b'x'))
+    assert log.read() == [Entry(term=1, cmd="foo=3"), Entry(term=1, cmd="foo=4")]
+    assert log.lastLogIndex == 5
+
+
+def test_install_snapshot_replaces_a_log_that_doesnt_match():
+    log = InMemoryLog([Entry(term=1, cmd=f"foo={i}") for i in range(5)])
+    log.install_snapshot(Snapshot(lastIncludedIndex=4, lastIncludedTerm=2, data=b'x'))
+    assert log.read() == []
+    assert log.lastLogIndex == 4
+    assert log.last_log_term == 2
+    assert log.first_index_of_term(1) == 0
+
+
+def test_install_snapshot_ignores_older_snapshots():
+    log = InMemoryLog([Entry(term=1, cmd=f"foo={i}") for i in range(5)])
+    log.compact(Snapshot(lastIncludedIndex=4, lastIncludedTerm=1, data=b'new'))
+    log.install_snapshot(Snapshot(lastIncludedIndex=2, lastIncludedTerm=1, data=b'old'))
+    assert log.snapshot.data == b'new'
+    assert log.lastLogIndex == 5
@@ -1,9 +1,14 @@
+import json
 import pytest
 from raft.adapters.network import FakeRaftNetwork
 from raft.adapters.run_server import clock_tick
-from raft.log import InMemoryLog, Entry
-from raft.messages import Message, ClientSetCommand
+from raft.log import InMemoryLog, Entry, Snapshot
+from raft.messages import (
+    Message, ClientSetCommand, ClientSetSucceeded, ClientGetCommand, ClientGetSucceeded,
+    AppendEntriesFailed,
+)
 from raft.server import Leader, Follower, HEARTBEAT_FREQUENCY
+from raft.state_machine import pack_snapshot
 import figure_7
 
 
@@ -123,3 +128,215 @@ def test_figure_seven_from_paper():
         print(f'Checking log for server {n}: {s.log.read()}')
         terms = [e.term for e in s.log.read()]
         assert terms[:10] == list(map(int, '1114455666'))
+
+
+@pytest.mark.parametrize('max_entries', [1, 10, 100])
+def test_lagging_follower_catches_up_one_batch_per_round_trip(max_entries):
+    peers = ["S1", "S2"]
+    entries = [Entry(term=1, cmd=f"foo={i}") for i in range(1000)]
+    leader = Leader(
+        name="S1", now=1, log=InMemoryLog(entries), peers=peers, currentTerm=1, votedFor=None,
+        max_entries=max_entries, max_inflight=1,
+    )
+    leader.nextIndex["S2"] = 1  # as if it had already backtracked
+    follower = Follower(
+        name="S2", peers=peers, now=1, log=InMemoryLog([]), currentTerm=1, votedFor=None
+    )
+
+    raftnet = FakeRaftNetwork([])
+    ticks = 0
+    while follower.log.read() != entries:
+        ticks += 1
+        clock_tick(leader, raftnet, 1 + ticks / 1000.0)
+        clock_tick(follower, raftnet, 1 + ticks / 1000.0)
+        assert ticks <= len(entries) + 2
+
+    print(f"caught up on {len(entries)} entries in {ticks} ticks")
+    # one heartbeat round trip, then one round trip per batch
+    assert ticks == 1 + len(entries) // max_entries
+
+
+@pytest.mark.parametrize('max_inflight', [1, 4, 16])
+def test_pipelining_lets_a_follower_take_several_batches_per_round_trip(max_inflight):
+    peers = ["S1", "S2"]
+    entries = [Entry(term=1, cmd=f"foo={i}") for i in range(1000)]
+    leader = Leader(
+        name="S1", now=1, log=InMemoryLog(entries), peers=peers, currentTerm=1, votedFor=None,
+        max_entries=10, max_inflight=max_inflight,
+    )
+    leader.nextIndex["S2"] = 1
+    follower = Follower(
+        name="S2", peers=peers, now=1, log=InMemoryLog([]), currentTerm=1, votedFor=None
+    )
+
+    raftnet = FakeRaftNetwork([])
+    ticks = 0
+    while follower.log.read() != entries:
+        ticks += 1
+        clock_tick(leader, raftnet, 1 + ticks / 1000.0)
+        clock_tick(follower, raftnet, 1 + ticks / 1000.0)
+        assert ticks <= len(entries) + 2
+
+    print(f"caught up on {len(entries)} entries in {ticks} ticks")
+    batches = len(entries) // 10
+    assert ticks == 1 + -(-batches // max_inflight)
+
+
+def test_figure_seven_backtracks_one_term_per_round_trip():
+    servers = figure_7.make_servers()
+    raftnet = FakeRaftNetwork([])
+    one_heartbeat_in = HEARTBEAT_FREQUENCY + 0.0001
+
+    for i in range(1, 100):
+        for _, s in servers.items():
+            clock_tick(s, raftnet, one_heartbeat_in + i / 1000.0)
+
+    for n, s in servers.items():
+        if n == 'l':
+            continue
+        failures = [
+            m for m in raftnet._message_backups
+            if m.frm == n and isinstance(m.cmd, AppendEntriesFailed)
+        ]
+        terms_in_log = len({e.term for e in s.log.read()})
+        print(f'{n} needed {len(failures)} failed round trips')
+        assert len(failures) <= terms_in_log
+
+
+def test_follower_behind_a_compacted_log_catches_up_via_snapshot():
+    peers = ["S1", "S2"]
+    entries = [Entry(term=1, cmd=f"foo={i}") for i in range(100)]
+    leader_log = InMemoryLog(entries)
+    state = pack_snapshot(json.dumps({f"key{i}": "x" * 10 for i in range(50)}).encode())
+    leader_log.compact(Snapshot(lastIncludedIndex=90, lastIncludedTerm=1, data=state))
+    leader = Leader(
+        name="S1", now=1, log=leader_log, peers=peers, currentTerm=1, votedFor=None,
+        max_bytes=256,
+    )
+    follower = Follower(
+        name="S2", peers=peers, now=1, log=InMemoryLog([]), currentTerm=1, votedFor=None
+    )
+
+    raftnet = FakeRaftNetwork([])
+    ticks = 0
+    while follower.log.lastLogIndex < 100:
+        ticks += 1
+        clock_tick(leader, raftnet, 1 + ticks / 1000.0)
+        clock_tick(follower, raftnet, 1 + ticks / 1000.0)
+        assert ticks <= 20
+
+    assert follower.log.snapshot == leader_log.snapshot
+    assert follower.log.read() == entries[90:]
+    assert follower.applier.read("key49") == "x" * 10
+
+
+def test_entries_commit_after_one_round_trip_and_followers_learn_it_next_time():
+    peers = ["S1", "S2", "S3"]
+    leader = Leader(
+        name="S1", now=1, log=InMemoryLog([]), peers=peers, currentTerm=1, votedFor=None
+    )
+    followers = [
+        Follower(name=n, peers=peers, now=1, log=InMemoryLog([]), currentTerm=1, votedFor=None)
+        for n in ["S2", "S3"]
+    ]
+    raftnet = FakeRaftNetwork([])
+    # first heartbeat round trip finds where the logs match
+    for s in [leader] + followers:
+        clock_tick(s, raftnet, 1.001)
+
+    for i in range(5):
+        raftnet.dispatch(
+            Message(frm="client.id", to="S1", cmd=ClientSetCommand(guid=f'g{i}', cmd=f"foo={i}"))
+        )
+    clock_tick(leader, raftnet, 1.002)
+    for f in followers:
+        clock_tick(f, raftnet, 1.002)
+    clock_tick(leader, raftnet, 1.003)
+    assert leader.commitIndex == 5
+
+    # followers get their next heartbeat an interval after the entries went out
+    next_heartbeat = 1.002 + HEARTBEAT_FREQUENCY + 0.001
+    clock_tick(leader, raftnet, next_heartbeat)
+    for f in followers:
+        clock_tick(f, raftnet, next_heartbeat)
+        assert f.commitIndex == 5
+
+
+def test_read_sees_a_committed_write_without_adding_to_the_log():
+    peers = ["S1", "S2", "S3"]
+    leader = Leader(
+        name="S1", now=1, log=InMemoryLog([]), peers=peers, currentTerm=1, votedFor=None
+    )
+    followers = [
+        Follower(name=n, peers=peers, now=1, log=InMemoryLog([]), currentTerm=1, votedFor=None)
+        for n in ["S2", "S3"]
+    ]
+    raftnet = FakeRaftNetwork([])
+    raftnet.dispatch(
+        Message(frm="client.id", to="S1", cmd=ClientSetCommand(guid='g1', cmd="foo=1"))
+    )
+    for i in range(1, 4):
+        for s in [leader] + followers:
+            clock_tick(s, raftnet, 1 + i / 1000.0)
+    assert leader.lastApplied == 1
+    raftnet.get_messages("client.id")  # the write's reply
+
+    raftnet.dispatch(Message(frm="client.id", to="S1", cmd=ClientGetCommand(guid='g2', key="foo")))
+    for i in range(4, 7):
+        for s in [leader] + followers:
+            clock_tick(s, raftnet, 1 + i / 1000.0)
+    [reply] = raftnet.get_messages("client.id")
+    assert reply.cmd == ClientGetSucceeded(guid='g2', value="1")
+    assert leader.log.lastLogIndex == 1
+
+
+def test_follower_read_sees_a_write_committed_through_the_leader():
+    peers = ["S1", "S2", "S3"]
+    leader = Leader(
+        name="S1", now=1, log=InMemoryLog([]), peers=peers, currentTerm=1, votedFor=None
+    )
+    followers = [
+        Follower(name=n, peers=peers, now=1, log=InMemoryLog([]), currentTerm=1, votedFor=None)
+        for n in ["S2", "S3"]
+    ]
+    raftnet = FakeRaftNetwork([])
+    raftnet.dispatch(
+        Message(frm="client.id", to="S1", cmd=ClientSetCommand(guid='g1', cmd="foo=1"))
+    )
+    for i in range(1, 4):
+        for s in [leader] + followers:
+            clock_tick(s, raftnet, 1 + i / 1000.0)
+    assert leader.lastApplied == 1
+    raftnet.get_messages("client.id")  # the write's reply
+
+    # S3 might not have heard that foo=1 is committed yet, but asks the leader
+    raftnet.dispatch(Message(frm="client.id", to="S3", cmd=ClientGetCommand(guid='g2', key="foo")))
+    for i in range(4, 30):
+        for s in [leader] + followers:
+            clock_tick(s, raftnet, 1 + i / 1000.0)
+    [reply] = raftnet.get_messages("client.id")
+    assert reply == Message(frm="S3", to="client.id", cmd=ClientGetSucceeded(guid='g2', value="1"))
+
+
+def test_command_sent_to_a_follower_is_committed_via_the_leader():
+    peers = ["S1", "S2", "S3"]
+    leader = Leader(
+        name="S1", now=1, log=InMemoryLog([]), peers=peers, currentTerm=1, votedFor=None
+    )
+    followers = [
+        Follower(name=n, peers=peers, now=1, log=InMemoryLog([]), currentTerm=1, votedFor=None)
+        for n in ["S2", "S3"]
+    ]
+    raftnet = FakeRaftNetwork([])
+    # followers learn who the leader is from its first heartbeat
+    for s in [leader] + followers:
+        clock_tick(s, raftnet, 1.001)
+
+    raftnet.dispatch(Message(frm="client.id", to="S2", cmd=ClientSetCommand(guid='g1', cmd="foo=1")))
+    for i in range(2, 10):
+        for s in [leader] + followers:
+            clock_tick(s, raftnet, 1 + i / 1000.0)
+    assert leader.log.read()[-1].cmd == "foo=1"
+    assert raftnet.get_messages("client.id") == [
+        Message(frm="S2", to="client.id", cmd=ClientSetSucceeded(guid='g1'))
+    ]
@@ -0,0 +1,27 @@
+from raft.metrics import LatencyHistogram
+
+
+def test_empty_histogram():
+    h = LatencyHistogram()
+    assert h.percentile(99) == 0.0
+    assert h.summary()['count'] == 0
+
+
+def test_percentiles_are_within_a_bucket():
+    h = LatencyHistogram()
+    for ms in range(1, 101):
+        h.record(ms / 1000)
+    assert h.count == 100
+    assert h.max == 0.1
+    for p in [50, 90, 99]:
+        exact = p / 1000
+        assert exact <= h.percentile(p) <= exact * 1.19
+    assert h.percentile(100) == 0.1
+
+
+def test_tiny_and_huge_latencies_go_in_the_end_buckets():
+    h = LatencyHistogram()
+    h.record(0)
+    h.record(1e9)
+    assert h.counts[0] == 1
+    assert h.counts[-1] == 1
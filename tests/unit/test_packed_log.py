@@ -0,0 +1,91 @@
+import pytest
+from raft.adapters.network import FakeRaftNetwork
+from raft.adapters.run_server import clock_tick
+from raft.log import InMemoryLog, PackedEntries, PackedLog, Entry, Session, Snapshot
+from raft.server import Leader, Follower
+
+
+def test_packed_entries_round_trip():
+    entries = [Entry(term=1, cmd="foo=1"), Entry(term=2, cmd="bar=ü"), Entry(term=2, cmd="")]
+    packed = PackedEntries(entries)
+    assert len(packed) == 3
+    assert list(packed) == entries
+    assert packed[-1] == Entry(term=2, cmd="")
+    assert packed.term_at(1) == 2
+    with pytest.raises(IndexError):
+        packed[3]  # pylint: disable=pointless-statement
+
+
+def test_packed_entries_keep_sessions_through_deletes():
+    entries = [
+        Entry(term=1, cmd=f"foo={i}", session=Session("c", seq=i, timestamp=i) if i % 2 else None)
+        for i in range(6)
+    ]
+    packed = PackedEntries(entries)
+    del packed[:3]
+    del packed[2:]
+    assert list(packed) == entries[3:5]
+    packed.append(Entry(term=2, cmd="new"))
+    assert packed[-1].session is None
+
+
+def test_packed_entries_delete_prefix_and_suffix():
+    entries = [Entry(term=1, cmd=f"foo={i}") for i in range(6)]
+    packed = PackedEntries(entries)
+    del packed[4:]
+    assert list(packed) == entries[:4]
+    del packed[:2]
+    assert list(packed) == entries[2:4]
+    packed.append(Entry(term=3, cmd="new"))
+    assert list(packed) == entries[2:4] + [Entry(term=3, cmd="new")]
+    with pytest.raises(ValueError):
+        del packed[1:2]
+
+
+def test_packed_log_behaves_like_inmemory_log():
+    old_entries = [Entry(term=t, cmd=f"foo={t}") for t in [1, 1, 2, 3, 3]]
+    new_entries = [Entry(term=2, cmd="foo=2"), Entry(term=4, cmd="foo=4")]
+    logs = [InMemoryLog(old_entries), PackedLog(old_entries)]
+    for log in logs:
+        assert log.append_entries(prevLogIndex=2, prevLogTerm=1, entries=new_entries)
+        assert not log.check_log(prevLogIndex=4, prevLogTerm=3)
+        log.compact(Snapshot(lastIncludedIndex=2, lastIncludedTerm=1, data=b""))
+    packed, plain = logs[1], logs[0]
+    assert packed.read() == plain.read()
+    for index in range(2, plain.lastLogIndex + 1):
+        assert packed.entry_term(index) == plain.entry_term(index)
+    assert packed.last_log_term == plain.last_log_term == 4
+    assert packed.first_index_of_term(2) == plain.first_index_of_term(2) == 3
+    with pytest.raises(IndexError):
+        packed.entry_term(1)
+
+
+def test_install_snapshot_over_a_packed_log():
+    log = PackedLog([Entry(term=1, cmd=f"foo={i}") for i in range(5)])
+    log.install_snapshot(Snapshot(lastIncludedIndex=7, lastIncludedTerm=2, data=b""))
+    assert log.read() == []
+    assert log.lastLogIndex == 7
+    assert log.last_log_term == 2
+
+
+def test_replication_between_packed_logs():
+    peers = ["S1", "S2"]
+    entries = [Entry(term=1, cmd=f"foo={i}") for i in range(50)]
+    leader = Leader(
+        name="S1",
+        now=1,
+        log=PackedLog(entries),
+        peers=peers,
+        currentTerm=1,
+        votedFor=None,
+        max_entries=10,
+    )
+    leader.nextIndex["S2"] = 1
+    follower = Follower(
+        name="S2", peers=peers, now=1, log=PackedLog([]), currentTerm=1, votedFor=None
+    )
+    raftnet = FakeRaftNetwork([])
+    for i in range(1, 4):
+        clock_tick(leader, raftnet, 1 + i / 1000.0)
+        clock_tick(follower, raftnet, 1 + i / 1000.0)
+    assert follower.log.read() == entries
@@ -0,0 +1,212 @@
+import threading
+import time
+from typing import Optional, Tuple
+from raft.log import Entry, Session, Snapshot, InMemoryLog
+from raft.messages import Message, AppendEntriesSucceeded
+from raft.server import Leader
+from raft.state_machine import (
+    InlineApplier, KeyValueStore, Sessions, ThreadedApplier, Watermark, pack_snapshot,
+)
+
+
+def test_key_value_store_applies_key_equals_value_commands():
+    kv = KeyValueStore()
+    kv.apply("foo=1")
+    kv.apply("bar=a=b")
+    kv.apply("foo=2")
+    kv.apply("not a set command")
+    assert kv.get("foo") == "2"
+    assert kv.get("bar") == "a=b"
+    assert kv.get("baz") is None
+
+
+def test_key_value_store_snapshot_round_trip():
+    kv = KeyValueStore()
+    kv.apply("foo=1")
+    restored = KeyValueStore()
+    restored.restore(kv.snapshot())
+    assert restored.data == {"foo": "1"}
+    restored.restore(b'')
+    assert restored.data == {}
+
+
+def test_watermark_only_goes_up_and_wakes_waiters():
+    mark = Watermark()
+    assert not mark.wait_for(1, timeout=0)
+    threading.Timer(0.01, mark.advance, args=(3,)).start()
+    assert mark.wait_for(2, timeout=1)
+    mark.advance(1)
+    assert mark.value == 3
+
+
+def test_inline_applier_skips_entries_covered_by_a_restored_snapshot():
+    applier = InlineApplier(KeyValueStore())
+    applier.offer(1, Entry(term=1, cmd="foo=1"))
+    applier.offer_snapshot(Snapshot(lastIncludedIndex=3, lastIncludedTerm=1, data=pack_snapshot(b'{"foo": "3"}')))
+    applier.offer(3, Entry(term=1, cmd="foo=stale"))
+    applier.offer(4, Entry(term=1, cmd="bar=4"))
+    assert applier.applied.value == 4
+    assert applier.snapshot() == (4, pack_snapshot(b'{"foo": "3", "bar": "4"}'))
+
+
+class BlockingStore(KeyValueStore):
+    def __init__(self) -> None:
+        super().__init__()
+        self.applying = threading.Event()
+        self.unblock = threading.Event()
+
+    def apply(self, cmd: str) -> None:
+        self.applying.set()
+        self.unblock.wait()
+        super().apply(cmd)
+
+
+def test_threaded_applier_applies_in_order_on_another_thread():
+    store = BlockingStore()
+    applier = ThreadedApplier(store, queue_size=2)
+    assert applier.offer(1, Entry(term=1, cmd="foo=1"))
+    # the first is picked up by the worker, which blocks, so two more fit
+    assert store.applying.wait(timeout=1)
+    assert applier.applied.value == 0
+    offered = [applier.offer(i, Entry(term=1, cmd=f"foo={i}")) for i in range(2, 6)]
+    assert offered[:2] == [True, True]
+    assert offered[-1] is False
+    store.unblock.set()
+    assert applier.applied.wait_for(3, timeout=1)
+    assert store.get("foo") == "3"
+    applier.close()
+
+
+def test_threaded_applier_snapshots_and_reads_dont_wait_for_a_slow_apply():
+    store = BlockingStore()
+    store.unblock.set()
+    applier = ThreadedApplier(store)
+    applier.offer(1, Entry(term=1, cmd="foo=1", session=Session("c1", seq=1, timestamp=1)))
+    assert applier.applied.wait_for(1, timeout=1)
+    store.unblock.clear()
+    applier.offer(2, Entry(term=1, cmd="foo=2"))
+    assert store.applying.wait(timeout=1)
+    # the worker is stuck applying 2, but none of these wait for it
+    assert applier.snapshot() is None
+    assert applier.read("foo") == "1"
+    assert applier.last_seq("c1") == 1
+    assert applier.snapshot() is None
+    store.unblock.set()
+    assert applier.applied.wait_for(2, timeout=1)
+    deadline = time.monotonic() + 1
+    snapshot = applier.snapshot()
+    while snapshot is None and time.monotonic() < deadline:
+        time.sleep(0.001)
+        snapshot = applier.snapshot()
+    assert snapshot == (2, pack_snapshot(b'{"foo": "2"}', b'[["c1", [1, 1]]]'))
+    applier.close()
+
+
+class SlowToSnapshotStore(KeyValueStore):
+    def __init__(self) -> None:
+        super().__init__()
+        self.unblock = threading.Event()
+
+    def snapshot(self) -> bytes:
+        self.unblock.wait()
+        return super().snapshot()
+
+
+def test_threaded_applier_keeps_a_snapshot_taken_while_its_asked_for_it():
+    store = SlowToSnapshotStore()
+    applier = ThreadedApplier(store)
+    assert applier.snapshot() is None
+    taken = applier._taken
+    look = taken.get_nowait
+
+    def look_as_the_worker_finishes() -> Optional[Tuple[int, bytes]]:
+        # the worker hands its snapshot over just after we've looked for it
+        try:
+            return look()
+        finally:
+            store.unblock.set()
+            deadline = time.monotonic() + 1
+            while taken.empty() and time.monotonic() < deadline:
+                time.sleep(0.001)
+
+    taken.get_nowait = look_as_the_worker_finishes  # type: ignore
+    assert applier.snapshot() is None
+    # not lost, so there's no need to ask again
+    assert applier.snapshot() == (0, pack_snapshot(b'{}'))
+    applier.close()
+
+
+def test_server_only_hands_over_what_the_applier_will_take():
+    class TakesTwoPerTick(InlineApplier):
+        def __init__(self) -> None:
+            super().__init__(KeyValueStore())
+            self.room = 2
+
+        def offer(self, index: int, entry: Entry) -> bool:
+            if not self.room:
+                return False
+            self.room -= 1
+            return super().offer(index, entry)
+
+    applier = TakesTwoPerTick()
+    log = InMemoryLog([Entry(term=1, cmd=f"foo={i}") for i in range(5)])
+    s = Leader(
+        name="S1", now=1, log=log, peers=["S1", "S2"], currentTerm=1, votedFor=None,
+        applier=applier,
+    )
+    s.handle_message(Message(frm="S2", to="S1", cmd=AppendEntriesSucceeded(matchIndex=5)))
+    s.flush()
+    assert s.lastApplied == 2
+    applier.room = 2
+    s.flush()
+    assert s.lastApplied == 4
+    assert applier.state_machine.get("foo") == "3"
+
+
+def test_retried_commands_are_only_applied_once():
+    applier = InlineApplier(KeyValueStore())
+    applier.offer(1, Entry(term=1, cmd="foo=1", session=Session("c1", seq=1, timestamp=1)))
+    applier.offer(2, Entry(term=1, cmd="foo=2"))
+    applier.offer(3, Entry(term=1, cmd="foo=1", session=Session("c1", seq=1, timestamp=2)))
+    assert applier.state_machine.get("foo") == "2"
+    assert applier.applied.value == 3
+    assert applier.last_seq("c1") == 1
+    assert applier.last_seq("c2") == 0
+
+
+def test_sessions_expire_by_log_timestamps_and_least_recently_used():
+    sessions = Sessions(max_sessions=2, timeout=10)
+    sessions.record(Session("a", seq=1, timestamp=1))
+    sessions.record(Session("b", seq=1, timestamp=2))
+    sessions.record(Session("a", seq=2, timestamp=3))
+    sessions.record(Session("c", seq=1, timestamp=4))
+    assert (sessions.last_seq("a"), sessions.last_seq("b"), sessions.last_seq("c")) == (2, 0, 1)
+    sessions.record(Session("c", seq=2, timestamp=13.5))
+    assert len(sessions) == 1
+    assert sessions.last_seq("a") == 0
+
+
+def test_many_sessions_still_get_evicted():
+    sessions = Sessions(max_sessions=1000, timeout=10)
+    for i in range(5000):
+        sessions.record(Session(f"c{i}", seq=1, timestamp=i / 1000))
+    assert len(sessions) == 1000
+    assert sessions.last_seq("c3999") == 0
+    assert sessions.last_seq("c4000") == 1
+    # and once they've expired, all of the old ones go at once
+    sessions.record(Session("late", seq=1, timestamp=100))
+    assert len(sessions) == 1
+    assert sessions.last_seq("late") == 1
+
+
+def test_sessions_are_part_of_the_snapshot():
+    applier = InlineApplier(KeyValueStore())
+    applier.offer(1, Entry(term=1, cmd="foo=1", session=Session("c1", seq=5, timestamp=1)))
+    snapshot = applier.snapshot()
+    assert snapshot is not None
+    index, data = snapshot
+    restored = InlineApplier(KeyValueStore())
+    restored.offer_snapshot(Snapshot(lastIncludedIndex=index, lastIncludedTerm=1, data=data))
+    assert restored.last_seq("c1") == 5
+    restored.offer(2, Entry(term=1, cmd="foo=2", session=Session("c1", seq=5, timestamp=2)))
+    assert restored.state_machine.get("foo") == "1"
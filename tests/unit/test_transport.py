@@ -0,0 +1,130 @@
+import socket
+from typing import List, cast
+
+import pytest
+from raft.adapters import transport
+
+
+class ChunkedSocket:
+    """hands out what's been sent to it in the chunks given, one per recv_into"""
+
+    def __init__(self, chunks: List[bytes]) -> None:
+        self.chunks = list(chunks)
+        self.recvs = 0
+
+    def recv_into(self, buffer: memoryview) -> int:
+        self.recvs += 1
+        if not self.chunks:
+            return 0
+        chunk = self.chunks.pop(0)
+        if len(chunk) > len(buffer):
+            chunk, rest = chunk[:len(buffer)], chunk[len(buffer):]
+            self.chunks.insert(0, rest)
+        buffer[:len(chunk)] = chunk
+        return len(chunk)
+
+
+def test_frames_have_a_binary_length_header():
+    framed = transport.frame(b'hello')
+    assert len(framed) == transport.HEADER_SIZE + 5
+    assert transport.frame_size(framed[:transport.HEADER_SIZE]) == 5
+
+
+def test_reads_every_frame_that_arrives_in_one_recv():
+    sock = ChunkedSocket([b''.join(transport.frame(b'msg%d' % i) for i in range(10))])
+    reader = transport.FrameReader(cast(socket.socket, sock))
+    assert [bytes(f) for f in reader.read_frames()] == [b'msg%d' % i for i in range(10)]
+    assert sock.recvs == 1
+
+
+def test_reassembles_frames_split_across_recvs():
+    data = transport.frame(b'first') + transport.frame(b'second') + transport.frame(b'')
+    sock = ChunkedSocket([data[i:i + 1] for i in range(len(data))])
+    reader = transport.FrameReader(cast(socket.socket, sock))
+    frames = []  # type: List[bytes]
+    while len(frames) < 3:
+        frames.extend(bytes(f) for f in reader.read_frames())
+    assert frames == [b'first', b'second', b'']
+
+
+def test_grows_the_buffer_for_frames_bigger_than_it():
+    big = bytes(range(256)) * 100
+    sock = ChunkedSocket([transport.frame(b'small') + transport.frame(big)[:10], transport.frame(big)[10:]])
+    reader = transport.FrameReader(cast(socket.socket, sock), buffer_size=64)
+    assert [bytes(f) for f in reader.read_frames()] == [b'small']
+    assert [bytes(f) for f in reader.read_frames()] == [big]
+
+
+def test_raises_connection_closed_at_end_of_stream():
+    reader = transport.FrameReader(cast(socket.socket, ChunkedSocket([transport.frame(b'last')[:3]])))
+    with pytest.raises(transport.ConnectionClosed):
+        reader.read_frames()
+
+
+def test_refuses_frames_over_the_size_limit():
+    header = (transport.MAX_FRAME_SIZE + 1).to_bytes(transport.HEADER_SIZE, 'big')
+    reader = transport.FrameReader(cast(socket.socket, ChunkedSocket([header])))
+    with pytest.raises(ConnectionError, match='limit'):
+        reader.read_frames()
+
+
+def test_recv_message_over_a_real_socket():
+    a, b = socket.socketpair()
+    with a, b:
+        transport.send_message(a, b'x' * 100_000)
+        transport.send_message(a, b'y')
+        assert transport.recv_message(b) == b'x' * 100_000
+        assert transport.recv_message(b) == b'y'
+        a.close()
+        with pytest.raises(transport.ConnectionClosed):
+            transport.recv_message(b)
+
+
+class TrickleSocket:
+    """takes at most `limit` bytes a sendmsg, like a socket with a full buffer"""
+
+    def __init__(self, limit: int) -> None:
+        self.limit = limit
+        self.sent = b''
+        self.calls = []  # type: List[int]
+
+    def sendmsg(self, buffers: List[bytes]) -> int:
+        self.calls.append(len(buffers))
+        data = b''.join(bytes(b) for b in buffers)[:self.limit]
+        self.sent += data
+        return len(data)
+
+
+def test_send_messages_gathers_them_into_one_sendmsg():
+    a, b = socket.socketpair()
+    with a, b:
+        transport.send_messages(a, [b'one', b'', b'three'])
+        a.close()
+        reader = transport.FrameReader(b)
+        assert [bytes(f) for f in reader.read_frames()] == [b'one', b'', b'three']
+
+
+def test_send_messages_carries_on_after_partial_sends():
+    msgs = [b'x' * 10, b'y' * 3, b'z' * 7]
+    sock = TrickleSocket(limit=6)
+    transport.send_messages(cast(socket.socket, sock), msgs)
+    assert sock.sent == b''.join(transport.frame(m) for m in msgs)
+
+
+def test_send_messages_passes_no_more_buffers_than_sendmsg_takes(monkeypatch):
+    monkeypatch.setattr(transport, 'MAX_SEND_BUFFERS', 4)
+    sock = TrickleSocket(limit=10_000)
+    transport.send_messages(cast(socket.socket, sock), [b'm%d' % i for i in range(5)])
+    assert sock.calls == [4, 4, 2]
+    assert sock.sent == b''.join(transport.frame(b'm%d' % i) for i in range(5))
+
+
+def test_socket_options():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        transport.SocketOptions(nodelay=True, send_buffer=32 * 1024, recv_buffer=48 * 1024).apply(sock)
+        assert sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)
+        # linux doubles what it's asked for, for its own bookkeeping
+        assert sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF) >= 32 * 1024
+        assert sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF) >= 48 * 1024
+        transport.SocketOptions(nodelay=False).apply(sock)
+        assert not sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)